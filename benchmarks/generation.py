@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""End to end generation benchmark.
+
+Builds a parameterized pki tree and times do.everything, do.verify_all,
+do.revoke and do.renew_branch on it:
+
+    python benchmarks/generation.py --width 10 --depth 2 --rsa 2048 --curves prime256v1
+    python benchmarks/generation.py --openssl fake --width 30 --depth 3 --json run.json
+    python benchmarks/generation.py --openssl fake --baseline run.json
+
+With --openssl fake, commands run benchmarks/fake-openssl which only writes
+placeholder files, what is measured is then tinypyki itself: ordering, state
+pickling, sans file growth and spawning. Whatever the binary, tinypyki.metrics
+splits each operation in the time spent in commands and the python side.
+
+The tree is a root CA with width sub CAs, each with width sub CAs and so on
+down to depth, the last level being users. Keys cycle through the --rsa sizes
+and --curves. Each repeat builds a fresh pki, the best repeat is reported.
+
+With --workers, stages run in parallel, see tinypyki.costs. With --costs, the
+timings observed by the last run are written in the format of
+pki.costs.dump, ready to seed the cost model of a production pki:
+
+    python benchmarks/generation.py --rsa 2048 4096 --curves ed25519 --costs costs.json
+
+With --baseline, the python side of each operation is compared to a former
+--json run and the benchmark exits with 1 if one of them regressed by more
+than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tinypyki as tiny
+
+# Stand-in openssl binary, see --openssl
+FAKE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake-openssl")
+
+# Timed operations, in order
+OPERATIONS = ("insert", "everything", "verify_all", "revoke", "renew_branch")
+
+def build(pki_id, width, depth, specs):
+    """Return a pki instance holding a width x depth tree, not inserted yet.
+
+    specs -- list of key specifications, ("rsa", size) or ("ecc", curve)
+    """
+    pki   = tiny.PKI(pki_id)
+    nodes = [tiny.Node(nid="root", pathlen=depth)]
+    level = ["root"]
+    for lvl in range(1, depth + 1):
+        below = []
+        for issuer in level:
+            for idx in range(width):
+                nid = "{0}-{1}".format(issuer, idx) if issuer != "root" else "n{0}".format(idx)
+                nodes.append(tiny.Node(nid=nid, issuer=issuer, ntype="u" if lvl == depth else "ca",
+                                       san="dns={0}.hexample.com".format(nid)))
+                below.append(nid)
+        level = below
+    for idx, node in enumerate(nodes):
+        kind, value = specs[idx % len(specs)]
+        if kind == "rsa":
+            node.key_len = value
+        else:
+            node.curve_name = value
+    return pki, nodes
+
+def measure(operation, function, *args):
+    """Run function, return its timing entry.
+
+    Holds the elapsed seconds, the seconds spent in spawned commands, their
+    number and the python side, the difference.
+    """
+    tiny.metrics.reset()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    spawns  = [entry for entry in tiny.metrics.snapshot() if entry["op"] == "spawn"]
+    spawned = sum(entry["wall"]["sum"] for entry in spawns)
+    return { "operation" : operation,
+             "seconds"   : elapsed,
+             "commands"  : spawned,
+             "spawns"    : sum(entry["count"] for entry in spawns),
+             "python"    : max(elapsed - spawned, 0.0) }
+
+def run(args, specs, repeat):
+    """Generate, verify, revoke and renew a fresh pki, return its timings."""
+    pki, nodes = build("bench-{0}".format(repeat), args.width, args.depth, specs)
+    pki.path["openssl"] = args.openssl
+    results = [measure("insert", lambda: [tiny.do.insert(node, pki) for node in nodes])]
+    results.append(measure("everything", tiny.do.everything, pki, True, args.p12, None, args.workers))
+    if args.costs:
+        pki.costs.dump(args.costs)
+    # Certificates are verified through their hash links
+    tiny.do.verifyenv(pki)
+    results.append(measure("verify_all", tiny.do.verify_all, pki))
+    leaf = pki.nodes[nodes[-1].nid]
+    results.append(measure("revoke", tiny.do.revoke, leaf, "keycompromise"))
+    branch = pki.nodes["n0"] if args.depth > 1 else leaf
+    results.append(measure("renew_branch", tiny.do.renew_branch, branch, "superseded", True))
+    sizes = { "nodes" : len(pki.nodes),
+              "state" : os.path.getsize(pki.path["state"]),
+              "sans"  : os.path.getsize(pki.path["sans"]) if os.path.isfile(pki.path["sans"]) else 0 }
+    return results, sizes
+
+def report(best, sizes, args):
+    """Print a timing table."""
+    print("{0} nodes, width {1}, depth {2}, openssl {3}, p12 {4}".format(sizes["nodes"], args.width, args.depth,
+                                                                        args.openssl, "on" if args.p12 else "off"))
+    print("state file {0} bytes, sans file {1} bytes".format(sizes["state"], sizes["sans"]))
+    print("{0:<14}{1:>10}{2:>10}{3:>10}{4:>8}{5:>14}".format("operation", "seconds", "commands", "python", "spawns", "python/node"))
+    for entry in best:
+        print("{0:<14}{1:>10.3f}{2:>10.3f}{3:>10.3f}{4:>8}{5:>13.3f}ms".format(entry["operation"], entry["seconds"], entry["commands"],
+                                                                             entry["python"], entry["spawns"],
+                                                                             1000 * entry["python"] / sizes["nodes"]))
+
+def compare(best, baseline, tolerance):
+    """Return the operations whose python side regressed against a baseline."""
+    former = dict((entry["operation"], entry) for entry in baseline["results"])
+    slower = []
+    for entry in best:
+        if entry["operation"] in former and entry["python"] > former[entry["operation"]]["python"] * (1 + tolerance):
+            slower.append("{0}: {1:.3f}s python side, was {2:.3f}s".format(entry["operation"], entry["python"],
+                                                                          former[entry["operation"]]["python"]))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description="tinypyki end to end generation benchmark")
+    parser.add_argument("--width", type=int, default=5, help="nodes issued by each CA (default 5)")
+    parser.add_argument("--depth", type=int, default=2, help="levels below the root CA (default 2)")
+    parser.add_argument("--rsa", type=int, nargs="*", default=[2048], help="RSA key sizes (default 2048)")
+    parser.add_argument("--curves", nargs="*", default=[], help="ECC curves, see macros.CURVES (default none)")
+    parser.add_argument("--p12", action="store_true", help="also generate p12 files")
+    parser.add_argument("--openssl", default="/usr/bin/openssl", help="openssl binary, \"fake\" for the stub (default /usr/bin/openssl)")
+    parser.add_argument("--workers", type=int, default=None, help="parallel openssl processes (default none, one at a time)")
+    parser.add_argument("--costs", default=None, help="write the observed operation timings to this file")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs, the best is reported (default 1)")
+    parser.add_argument("--wdir", default=None, help="where instances are generated (default a temporary directory)")
+    parser.add_argument("--json", default=None, help="write the results to this file")
+    parser.add_argument("--baseline", default=None, help="former --json results to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed python side regression (default 0.25)")
+    args = parser.parse_args()
+
+    args.openssl = FAKE if args.openssl == "fake" else args.openssl
+    specs = [("rsa", size) for size in args.rsa] + [("ecc", curve) for curve in args.curves]
+    if not specs:
+        parser.error("at least one RSA size or ECC curve is required")
+
+    wdir = args.wdir if args.wdir else tempfile.mkdtemp(prefix="tinypyki-bench-")
+    cwd  = os.getcwd()
+    os.makedirs(wdir, exist_ok=True)
+    os.chdir(wdir)
+    tiny.events.quiet()
+    tiny.metrics.enable()
+    best = None
+    try:
+        for repeat in range(args.repeat):
+            results, sizes = run(args, specs, repeat)
+            best = results if best is None else [min(old, new, key=lambda entry: entry["seconds"])
+                                                 for old, new in zip(best, results)]
+    finally:
+        tiny.events.reset()
+        os.chdir(cwd)
+        if not args.wdir:
+            shutil.rmtree(wdir, ignore_errors=True)
+
+    report(best, sizes, args)
+    if args.json:
+        with open(args.json, "w") as j_hdlr:
+            json.dump({ "parameters" : vars(args), "sizes" : sizes, "results" : best }, j_hdlr, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as b_hdlr:
+            slower = compare(best, json.load(b_hdlr), args.tolerance)
+        for line in slower:
+            print("REGRESSION " + line)
+        return 1 if slower else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Memory footprint benchmark.
+
+Measures how much memory a pki takes per node, with tracemalloc and by
+sampling the resident set size, along the phases of its life:
+
+insert   -- nodes created and inserted with do.insert
+load     -- the saved state loaded back with do.load, state file size included
+generate -- do.everything run with benchmarks/fake-openssl, on a smaller pki
+            (--generate nodes) since each node spawns a handful of commands
+
+    python benchmarks/memory.py --sizes 10000 100000 1000000
+    python benchmarks/memory.py --budget insert=2000 --budget load=2000 --rss 1024
+
+The insert phase is broken down by Node attribute and value type, plus the
+Node objects themselves and the pki indexes, from sys.getsizeof: objects
+shared between nodes, None, small integers or the default digests, are only
+counted once, for the first attribute seen holding them.
+
+Budgets are in bytes per node for a phase, --rss is the peak RSS in MB. The
+benchmark exits with 1 if one of them is exceeded, on any size.
+"""
+
+import argparse
+import gc
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tinypyki as tiny
+from tree import nodes, SHAPES
+
+# Stand-in openssl binary, see generation.py
+FAKE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake-openssl")
+
+# Measured phases
+PHASES = ("insert", "load", "generate")
+
+def rss():
+    """Return the current resident set size in bytes."""
+    try:
+        with open("/proc/self/statm", "r") as s_hdlr:
+            return int(s_hdlr.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def peak():
+    """Return the peak resident set size in bytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def traced():
+    """Return the bytes currently allocated by python, after a collection."""
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+def breakdown(pki):
+    """Return the shallow sizes of a pki's nodes, { "attr (type)": bytes }."""
+    sizes = { "Node objects" : 0, "pki.index" : 0, "pki._signed" : 0 }
+    seen  = set()
+    for node in pki.nodes.values():
+        sizes["Node objects"] += sys.getsizeof(node) + sys.getsizeof(node.__dict__)
+        for attr, value in node.__dict__.items():
+            # The pki and the generator are shared or transient
+            if attr in ["pki", "_itergen"] or id(value) in seen:
+                continue
+            seen.add(id(value))
+            key = "{0} ({1})".format(attr, type(value).__name__)
+            sizes[key] = sizes.get(key, 0) + sys.getsizeof(value)
+    for attr, values in pki.index.items():
+        sizes["pki.index"] += sys.getsizeof(values) + sum(sys.getsizeof(bucket) for bucket in values.values())
+    for issuer, signed in pki._signed.items():
+        sizes["pki._signed"] += sys.getsizeof(signed) + sys.getsizeof(signed[2])
+    return sizes
+
+def measure(shape, size, width, wdir):
+    """Return the insert and load footprints of a tree, and its breakdown."""
+    start = traced()
+    pki   = tiny.PKI("memory-{0}-{1}".format(shape, size))
+    pki.path["state"] = os.path.join(wdir, "memory.state")
+    for node in nodes(shape, size, width):
+        tiny.do.insert(node, pki)
+    result = { "insert" : traced() - start, "rss" : rss() }
+    sizes  = breakdown(pki)
+    tiny.gen.save(pki)
+    result["state"] = os.path.getsize(pki.path["state"])
+    del pki
+    start = traced()
+    pki   = tiny.do.load(os.path.join(wdir, "memory.state"))
+    result["load"] = traced() - start
+    del pki
+    os.remove(os.path.join(wdir, "memory.state"))
+    return result, sizes
+
+def generate(size, width, wdir):
+    """Return the footprint of do.everything on a balanced tree, fake openssl."""
+    pki = tiny.PKI("memory-generate")
+    pki.path["openssl"] = FAKE
+    for node in nodes("balanced", size, width):
+        tiny.do.insert(node, pki)
+    start = traced()
+    tiny.do.everything(pki, True, True)
+    # The metadata index is part of a generated pki
+    pki.meta
+    return traced() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="tinypyki memory footprint benchmark")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1000, 10000, 100000], help="tree sizes (default 1000 10000 100000)")
+    parser.add_argument("--shape", default="balanced", choices=SHAPES, help="tree shape, see tree.py (default balanced)")
+    parser.add_argument("--width", type=int, default=10, help="nodes issued by each CA of balanced trees (default 10)")
+    parser.add_argument("--generate", type=int, default=200, help="size of the generated pki, 0 to skip (default 200)")
+    parser.add_argument("--budget", action="append", default=[], metavar="PHASE=BYTES",
+                        help="maximum bytes per node of a phase, in {0}".format(", ".join(PHASES)))
+    parser.add_argument("--rss", type=float, default=None, help="maximum peak RSS in MB (default none)")
+    args = parser.parse_args()
+
+    budgets = {}
+    for budget in args.budget:
+        phase, sep, value = budget.partition("=")
+        if not sep or not phase in PHASES:
+            parser.error("budgets are PHASE=BYTES, PHASE in {0}".format(", ".join(PHASES)))
+        budgets[phase] = float(value)
+
+    wdir = tempfile.mkdtemp(prefix="tinypyki-memory-")
+    cwd  = os.getcwd()
+    os.chdir(wdir)
+    tiny.events.quiet()
+    tracemalloc.start()
+    failed = []
+    try:
+        print("{0} trees, bytes per node".format(args.shape))
+        print("{0:>10}{1:>10}{2:>10}{3:>10}{4:>12}".format("nodes", "insert", "load", "state", "rss MB"))
+        for size in args.sizes:
+            result, sizes = measure(args.shape, size, args.width, wdir)
+            print("{0:>10}{1:>10.0f}{2:>10.0f}{3:>10.0f}{4:>12.1f}".format(size, result["insert"] / size, result["load"] / size,
+                                                                       result["state"] / size, result["rss"] / 2 ** 20))
+            for phase in ["insert", "load"]:
+                if phase in budgets and result[phase] / size > budgets[phase]:
+                    failed.append("{0} of {1} nodes: {2:.0f} bytes per node, budget {3:.0f}".format(phase, size, result[phase] / size, budgets[phase]))
+        print("")
+        print("breakdown of {0} inserted nodes, bytes per node".format(size))
+        for key, value in sorted(sizes.items(), key=lambda item: -item[1]):
+            print("{0:<28}{1:>10.1f}".format(key, value / size))
+        if args.generate:
+            print("")
+            grown = generate(args.generate, args.width, wdir)
+            print("generate, {0} nodes: {1:.0f} bytes per node".format(args.generate, grown / args.generate))
+            if "generate" in budgets and grown / args.generate > budgets["generate"]:
+                failed.append("generate of {0} nodes: {1:.0f} bytes per node, budget {2:.0f}".format(args.generate, grown / args.generate, budgets["generate"]))
+    finally:
+        tracemalloc.stop()
+        tiny.events.reset()
+        os.chdir(cwd)
+        shutil.rmtree(wdir, ignore_errors=True)
+
+    print("peak rss {0:.1f} MB".format(peak() / 2 ** 20))
+    if args.rss is not None and peak() / 2 ** 20 > args.rss:
+        failed.append("peak rss {0:.1f} MB, budget {1:.1f} MB".format(peak() / 2 ** 20, args.rss))
+    for line in failed:
+        print("OVER BUDGET " + line)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Asymptotic micro-benchmarks of the tree operations.
+
+Times the operations of tinypyki/pki.py on synthetic trees of growing size,
+no file is written and no command is spawned:
+
+    python benchmarks/tree.py                       # 10^2 to 10^5 nodes
+    python benchmarks/tree.py --max 1000000 --shapes flat balanced
+
+Shapes are:
+
+flat     -- a root CA issuing every other node
+chain    -- each node issues the next, the tree is a single branch
+balanced -- every CA issues --width nodes
+
+For each operation and shape, the scaling exponent k of time ~ n^k is fitted
+over the sizes (least squares in log-log space) and compared to the exponent
+of its expected complexity class, e.g. 1 for a linear operation on the whole
+tree or 0 for a lookup walking a balanced tree. Operations are:
+
+insert      -- do.insert of every node, the whole tree
+ordered     -- PKI.ordered
+subtree     -- Node.subtree of the root
+iteration   -- iterating over the root, Node.__iter__
+trust_chain -- PKI.trust_chain of the deepest node
+contains    -- deepest node id in the root, Node.__contains__
+lt          -- deepest node < root, Node.__lt__
+
+Lookups walk the issuers of the deepest node: they are linear in a chain,
+constant otherwise. The benchmark exits with 1 if an exponent exceeds its
+expected class by more than --slack, so that a quadratic path does not come
+back unnoticed.
+"""
+
+import argparse
+import gc
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tinypyki as tiny
+
+# Tree shapes
+SHAPES = ("flat", "chain", "balanced")
+
+# Expected exponent of each operation, per shape
+EXPECTED = { "insert"      : { "flat" : 1, "chain" : 1, "balanced" : 1 },
+             "ordered"     : { "flat" : 1, "chain" : 1, "balanced" : 1 },
+             "subtree"     : { "flat" : 1, "chain" : 1, "balanced" : 1 },
+             "iteration"   : { "flat" : 1, "chain" : 1, "balanced" : 1 },
+             "trust_chain" : { "flat" : 0, "chain" : 1, "balanced" : 0 },
+             "contains"    : { "flat" : 0, "chain" : 1, "balanced" : 0 },
+             "lt"          : { "flat" : 0, "chain" : 1, "balanced" : 0 } }
+
+def nodes(shape, size, width):
+    """Return the nodes of a tree of a given shape and size, root first, deepest last."""
+    if shape == "flat":
+        return [tiny.Node(nid="root", pathlen=1)] + [tiny.Node(nid="n{0}".format(idx), issuer="root", ntype="u")
+                                                     for idx in range(1, size)]
+    if shape == "chain":
+        return [tiny.Node(nid="root", pathlen=size)] + [tiny.Node(nid="n{0}".format(idx), issuer="n{0}".format(idx - 1) if idx > 1 else "root",
+                                                                  ntype="u" if idx == size - 1 else "ca")
+                                                        for idx in range(1, size)]
+    depth  = max(1, int(math.ceil(math.log(size * (width - 1) + 1, width))) - 1)
+    result = [tiny.Node(nid="root", pathlen=depth + 1)]
+    for idx in range(1, size):
+        issuer = (idx - 1) // width
+        result.append(tiny.Node(nid="n{0}".format(idx), issuer="n{0}".format(issuer) if issuer else "root"))
+    # Nodes issuing nothing are users
+    issuers = set(node.issuer for node in result)
+    for node in result[1:]:
+        if not node.nid in issuers:
+            node.ntype = "u"
+    return result
+
+def clock(function, budget):
+    """Return the seconds per call of function, repeated for at least budget seconds."""
+    calls, total = 0, 0.0
+    while total < budget:
+        gc.disable()
+        start = time.perf_counter()
+        function()
+        total += time.perf_counter() - start
+        gc.enable()
+        calls += 1
+    return total / calls
+
+def measure(shape, size, width, budget):
+    """Return the seconds per call of each operation on a tree."""
+    tree = nodes(shape, size, width)
+    pki  = tiny.PKI("bench")
+    gc.disable()
+    start = time.perf_counter()
+    for node in tree:
+        tiny.do.insert(node, pki)
+    timings = { "insert" : time.perf_counter() - start }
+    gc.enable()
+    root, deepest = pki.nodes["root"], pki.nodes[tree[-1].nid]
+    timings["ordered"]     = clock(pki.ordered, budget)
+    timings["subtree"]     = clock(lambda: root.subtree(including=True), budget)
+    timings["iteration"]   = clock(lambda: [nid for nid in root], budget)
+    timings["trust_chain"] = clock(lambda: pki.trust_chain(deepest.nid), budget)
+    timings["contains"]    = clock(lambda: deepest.nid in root, budget)
+    timings["lt"]          = clock(lambda: deepest < root, budget)
+    return timings
+
+def exponent(sizes, timings):
+    """Return the least squares slope of log(timings) against log(sizes)."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(timing, 1e-9)) for timing in timings]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum((x - mx) ** 2 for x in xs)
+
+def main():
+    parser = argparse.ArgumentParser(description="tinypyki tree operation micro-benchmarks")
+    parser.add_argument("--min", type=int, default=100, help="smallest tree (default 100)")
+    parser.add_argument("--max", type=int, default=100000, help="largest tree (default 100000)")
+    parser.add_argument("--shapes", nargs="*", default=list(SHAPES), choices=SHAPES, help="tree shapes (default all)")
+    parser.add_argument("--width", type=int, default=10, help="nodes issued by each CA of balanced trees (default 10)")
+    parser.add_argument("--budget", type=float, default=0.05, help="seconds each timing is repeated for (default 0.05)")
+    parser.add_argument("--slack", type=float, default=0.3, help="allowed exponent above the expected class (default 0.3)")
+    args = parser.parse_args()
+
+    sizes = []
+    size  = args.min
+    while size <= args.max:
+        sizes.append(size)
+        size *= 10
+    if len(sizes) < 2:
+        parser.error("at least two sizes are required, --max must be at least 10 times --min")
+
+    tiny.events.quiet()
+    failed = []
+    try:
+        for shape in args.shapes:
+            results = dict((size, measure(shape, size, args.width, args.budget)) for size in sizes)
+            print("{0} trees".format(shape))
+            print("{0:<13}".format("operation") + "".join("{0:>12}".format(size) for size in sizes) + "{0:>10}{1:>10}".format("exponent", "expected"))
+            for operation in EXPECTED:
+                slope    = exponent(sizes, [results[size][operation] for size in sizes])
+                expected = EXPECTED[operation][shape]
+                status   = "" if slope <= expected + args.slack else "  FAILED"
+                print("{0:<13}".format(operation) + "".join("{0:>10.2e}s ".format(results[size][operation]) for size in sizes)
+                      + "{0:>9.2f}{1:>10}{2}".format(slope, expected, status))
+                if status:
+                    failed.append("{0} on {1} trees: n^{2:.2f}, expected n^{3}".format(operation, shape, slope, expected))
+            print("")
+    finally:
+        tiny.events.reset()
+
+    for line in failed:
+        print("SUPERLINEAR " + line)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
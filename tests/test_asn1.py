@@ -0,0 +1,112 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Unit tests of tinypyki.asn1 against openssl's own parsing, openssl must be installed."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import tinypyki as tiny
+
+def openssl(*args):
+    """Return the stdout of an openssl command."""
+    return subprocess.check_output(("openssl",) + args, stderr=subprocess.DEVNULL).decode("utf-8")
+
+class Asn1Test(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        tiny.events.quiet()
+        cls.cwd  = os.getcwd()
+        cls.wdir = tempfile.mkdtemp(prefix="tinypyki-test-")
+        os.chdir(cls.wdir)
+        cls.pki = tiny.PKI("asn1-test")
+        tiny.do.insert(tiny.Node(nid="rsa", pathlen=2, key_len=1024), cls.pki)
+        tiny.do.insert(tiny.Node(nid="ec", issuer="rsa", pathlen=1, curve_name="prime256v1"), cls.pki)
+        tiny.do.insert(tiny.Node(nid="ed", issuer="ec", ntype="u", curve_name="ed25519", san="dns=ed.hexample.com"), cls.pki)
+        tiny.do.insert(tiny.Node(nid="gone", issuer="ec", ntype="u", curve_name="prime256v1"), cls.pki)
+        for node in cls.pki.nodes.values():
+            tiny.change.subj(node, cn=node.nid)
+        tiny.do.everything(cls.pki)
+        tiny.do.revoke(cls.pki.nodes["gone"])
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.wdir, ignore_errors=True)
+        tiny.events.reset()
+
+    def cert(self, nid):
+        summary = tiny.asn1.summary(self.pki.nodes[nid].cert_path)
+        self.assertEqual(summary["type"], "cert")
+        serial = openssl("x509", "-noout", "-serial", "-in", self.pki.nodes[nid].cert_path).strip()
+        self.assertEqual(summary["serial"], int(serial.split("=")[1], 16))
+        self.assertTrue(summary["subject"].endswith("/CN={0}".format(nid)))
+        self.assertTrue(summary["not_before"] < summary["not_after"])
+        return summary
+
+    def test_rsa(self):
+        summary = self.cert("rsa")
+        self.assertEqual((summary["key_type"], summary["key_size"]), ("rsa", 1024))
+        self.assertEqual(summary["issuer"], summary["subject"])
+        self.assertEqual(tiny.asn1.summary(self.pki.nodes["rsa"].key_path)["key_size"], 1024)
+
+    def test_ec(self):
+        summary = self.cert("ec")
+        self.assertEqual((summary["key_type"], summary["curve"], summary["key_size"]), ("ec", "prime256v1", 256))
+        self.assertTrue(summary["issuer"].endswith("/CN=rsa"))
+        self.assertEqual(summary["digest"], self.pki.nodes["ec"].cert_digest)
+        self.assertEqual(tiny.asn1.summary(self.pki.nodes["ec"].key_path)["curve"], "prime256v1")
+
+    def test_ed25519(self):
+        summary = self.cert("ed")
+        # Key sizes are the ones openssl reports (EVP_PKEY_get_bits)
+        self.assertEqual((summary["key_type"], summary["key_size"]), ("ed25519", 253))
+        self.assertEqual(summary["sans"], ["DNS:ed.hexample.com"])
+        self.assertEqual(tiny.asn1.summary(self.pki.nodes["ed"].key_path)["key_type"], "ed25519")
+
+    def test_csr(self):
+        summary = tiny.asn1.summary(self.pki.nodes["ed"].csr_path)
+        self.assertEqual(summary["type"], "csr")
+        self.assertTrue(summary["subject"].endswith("/CN=ed"))
+        self.assertIsNone(summary["digest"])
+
+    def test_crl(self):
+        summary = tiny.asn1.summary(self.pki.nodes["ec"].crl_path)
+        serial  = openssl("x509", "-noout", "-serial", "-in", self.pki.nodes["gone"].cert_path).strip()
+        self.assertEqual(summary["type"], "crl")
+        self.assertTrue(summary["issuer"].endswith("/CN=ec"))
+        self.assertEqual(summary["revoked"], [int(serial.split("=")[1], 16)])
+        self.assertEqual(summary["entries"], 1)
+        self.assertTrue(summary["this_update"] < summary["next_update"])
+        self.assertEqual(tiny.asn1.summary(self.pki.nodes["rsa"].crl_path)["entries"], 0)
+
+    def test_der(self):
+        path = tiny.convert.convert(self.pki.nodes["ec"].cert_path, "der")
+        self.assertEqual(tiny.asn1.summary(path), tiny.asn1.summary(self.pki.nodes["ec"].cert_path))
+
+    def test_unparsable(self):
+        path = os.path.join(self.wdir, "garbage.cert.pem")
+        with open(path, "w") as g_hdlr:
+            g_hdlr.write("-----BEGIN CERTIFICATE-----\nAAAA\n-----END CERTIFICATE-----\n")
+        self.assertIsNone(tiny.asn1.summary(path))
+        self.assertIsNone(tiny.asn1.summary(os.path.join(self.wdir, "missing.pem")))
+
+    def test_memo_bound(self):
+        memoized, tiny.asn1.MEMOIZED = tiny.asn1.MEMOIZED, 2
+        tiny.asn1._summaries.clear()
+        try:
+            for nid in ["rsa", "ec", "ed"]:
+                tiny.asn1.summary(self.pki.nodes[nid].cert_path)
+            self.assertEqual(list(tiny.asn1._summaries), [self.pki.nodes[nid].cert_path for nid in ["ec", "ed"]])
+        finally:
+            tiny.asn1.MEMOIZED = memoized
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Unit tests of tinypyki.cache hits and misses, openssl must be installed."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import tinypyki as tiny
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tiny.events.quiet()
+        self.cwd  = os.getcwd()
+        self.wdir = tempfile.mkdtemp(prefix="tinypyki-test-")
+        os.chdir(self.wdir)
+        self.cache  = tiny.cache.Cache(os.path.join(self.wdir, "cache"))
+        self.served = []
+        tiny.events.subscribe(self.event)
+        self.pki = tiny.PKI("cache-test")
+        self.pki.cache = self.cache
+        tiny.do.insert(tiny.Node(nid="root", pathlen=1, curve_name="prime256v1"), self.pki)
+        tiny.do.insert(tiny.Node(nid="leaf", issuer="root", ntype="u", curve_name="prime256v1"), self.pki)
+        tiny.change.subj(self.pki.nodes["leaf"], cn="leaf")
+        tiny.do.everything(self.pki)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.wdir, ignore_errors=True)
+        tiny.events.reset()
+
+    def event(self, event):
+        if event.kind == "cache":
+            self.served.append((event.nid, event.stage))
+
+    def csr(self, node):
+        del self.served[:]
+        node._status = "csr"
+        self.assertTrue(tiny.gen.csr(node, False))
+        return (node.nid, "csr") in self.served
+
+    def test_hit(self):
+        leaf = self.pki.nodes["leaf"]
+        with open(leaf.csr_path, "rb") as c_hdlr:
+            former = c_hdlr.read()
+        self.assertTrue(self.csr(leaf))
+        with open(leaf.csr_path, "rb") as c_hdlr:
+            self.assertEqual(c_hdlr.read(), former)
+
+    def test_changed_inputs(self):
+        leaf = self.pki.nodes["leaf"]
+        tiny.change.subj(leaf, cn="other")
+        self.assertFalse(self.csr(leaf))
+        self.assertTrue(self.csr(leaf))
+
+    def test_rekey(self):
+        leaf = self.pki.nodes["leaf"]
+        with open(leaf.key_path, "rb") as k_hdlr:
+            former = k_hdlr.read()
+        del self.served[:]
+        tiny.do.renew_branch(leaf, "keycompromise", True)
+        with open(leaf.key_path, "rb") as k_hdlr:
+            self.assertNotEqual(k_hdlr.read(), former)
+        self.assertEqual(self.served, [])
+        self.assertEqual(leaf._status, "done")
+
+    def test_keys_not_cached(self):
+        self.assertIsNone(self.cache.digest(self.pki.nodes["leaf"], "key"))
+
+    def test_miss(self):
+        self.assertFalse(self.cache.fetch("ab" * 32, os.path.join(self.wdir, "miss")))
+        self.assertFalse(os.path.exists(os.path.join(self.wdir, "miss")))
+
+    def test_evict(self):
+        self.assertTrue(self.cache.size() > 0)
+        self.cache.clear()
+        self.assertEqual(self.cache.size(), 0)
+        self.assertFalse(self.csr(self.pki.nodes["leaf"]))
+
+if __name__ == "__main__":
+    unittest.main()
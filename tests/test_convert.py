@@ -0,0 +1,81 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Unit tests of tinypyki.convert PEM<->DER round-trips, openssl must be installed."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import tinypyki as tiny
+
+class ConvertTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        tiny.events.quiet()
+        cls.cwd  = os.getcwd()
+        cls.wdir = tempfile.mkdtemp(prefix="tinypyki-test-")
+        os.chdir(cls.wdir)
+        cls.pki = tiny.PKI("convert-test")
+        tiny.do.insert(tiny.Node(nid="root", pathlen=1, curve_name="prime256v1"), cls.pki)
+        tiny.do.insert(tiny.Node(nid="leaf", issuer="root", ntype="u", curve_name="prime256v1"), cls.pki)
+        tiny.change.subj(cls.pki.nodes["leaf"], cn="leaf")
+        tiny.do.everything(cls.pki)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls.cwd)
+        shutil.rmtree(cls.wdir, ignore_errors=True)
+        tiny.events.reset()
+
+    def copy(self, path):
+        """Copy a file out of the pki, return the copy's path."""
+        out = os.path.join(tempfile.mkdtemp(dir=self.wdir), os.path.basename(path))
+        shutil.copyfile(path, out)
+        return out
+
+    def round_trip(self, path, tool):
+        pem = self.copy(path)
+        der = tiny.convert.convert(pem, "der")
+        self.assertEqual(der, pem[:-len("pem")] + "der")
+        expected = subprocess.check_output(["openssl", tool, "-in", pem, "-outform", "der"], stderr=subprocess.DEVNULL)
+        with open(der, "rb") as d_hdlr:
+            self.assertEqual(d_hdlr.read(), expected)
+        os.remove(pem)
+        self.assertEqual(tiny.convert.convert(der, "pem"), pem)
+        with open(pem, "rb") as p_hdlr, open(path, "rb") as o_hdlr:
+            self.assertEqual(p_hdlr.read(), o_hdlr.read())
+
+    def test_csr(self):
+        self.round_trip(self.pki.nodes["leaf"].csr_path, "req")
+
+    def test_cert(self):
+        self.round_trip(self.pki.nodes["leaf"].cert_path, "x509")
+
+    def test_crl(self):
+        self.round_trip(self.pki.nodes["root"].crl_path, "crl")
+
+    def test_labels(self):
+        with open(self.pki.nodes["leaf"].cert_path, "rb") as c_hdlr:
+            label, der = tiny.convert.pem_to_der(c_hdlr.read())
+        self.assertEqual(label, "CERTIFICATE")
+        self.assertEqual(tiny.convert.pem_to_der(tiny.convert.der_to_pem(der, label)), (label, der))
+
+    def test_same_format(self):
+        self.assertIsNone(tiny.convert.convert(self.pki.nodes["leaf"].cert_path, "pem"))
+
+    def test_unknown_kind(self):
+        der = tiny.convert.convert(self.copy(self.pki.nodes["leaf"].cert_path), "der")
+        unknown = os.path.join(os.path.dirname(der), "unknown.der")
+        os.rename(der, unknown)
+        self.assertIsNone(tiny.convert.convert(unknown, "pem"))
+        self.assertEqual(tiny.convert.convert(unknown, "pem", "cert"), unknown[:-len("der")] + "pem")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Unit tests of tinypyki.meta queries, openssl must be installed."""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import tinypyki as tiny
+
+class MetaTest(unittest.TestCase):
+
+    def setUp(self):
+        tiny.events.quiet()
+        self.cwd  = os.getcwd()
+        self.wdir = tempfile.mkdtemp(prefix="tinypyki-test-")
+        os.chdir(self.wdir)
+        self.pki = tiny.PKI("meta-test")
+        tiny.do.insert(tiny.Node(nid="root", pathlen=2, life=100, curve_name="prime256v1"), self.pki)
+        tiny.do.insert(tiny.Node(nid="ca", issuer="root", pathlen=1, life=60, curve_name="prime256v1"), self.pki)
+        tiny.do.insert(tiny.Node(nid="short", issuer="ca", ntype="u", life=5, curve_name="prime256v1",
+                                 san="dns=short.hexample.com"), self.pki)
+        tiny.do.insert(tiny.Node(nid="long", issuer="ca", ntype="u", life=30, curve_name="prime256v1",
+                                 san="dns=long.hexample.com"), self.pki)
+        for node in self.pki.nodes.values():
+            tiny.change.subj(node, cn=node.nid)
+        tiny.do.everything(self.pki)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.wdir, ignore_errors=True)
+        tiny.events.reset()
+
+    def test_expiring(self):
+        meta = self.pki.meta
+        self.assertEqual(meta.expiring(10), ["short"])
+        self.assertEqual(meta.expiring(45), ["short", "long"])
+        self.assertEqual(meta.expiring(1000), ["short", "long", "ca", "root"])
+        self.assertEqual(meta.expiring(1000, "ca"), ["ca", "root"])
+        self.assertEqual(meta.expiring(0), [])
+
+    def test_issued_by(self):
+        meta = self.pki.meta
+        self.assertEqual(sorted(meta.issued_by("ca")), ["long", "short"])
+        self.assertEqual(sorted(meta.issued_by("root")), ["ca", "root"])
+        self.assertEqual(meta.issued_by("short"), [])
+
+    def test_san(self):
+        self.assertEqual(self.pki.meta.san("DNS:short.hexample.com"), ["short"])
+        self.assertEqual(self.pki.meta.san("hexample", prefix=True), [])
+        self.assertEqual(self.pki.meta.san("long.HEXAMPLE.com"), ["long"])
+
+    def test_update(self):
+        node = self.pki.nodes["short"]
+        node.life = 50
+        tiny.do.recertify(node)
+        self.assertEqual(self.pki.meta.expiring(10), [])
+        self.assertEqual(self.pki.meta.expiring(45), ["long"])
+        self.assertEqual(sorted(self.pki.meta.issued_by("ca")), ["long", "short"])
+        self.assertEqual(len(self.pki.meta.keys["issuer"]), 4)
+
+    def test_revoked(self):
+        tiny.do.revoke(self.pki.nodes["long"])
+        self.assertEqual(self.pki.meta.revoked(), ["long"])
+        self.assertEqual(self.pki.meta.crls["ca"]["entries"], 1)
+
+    def test_saved(self):
+        self.pki.meta.expiring(10)
+        self.assertFalse(self.pki.meta.dirty)
+        meta = tiny.meta.load(self.pki)
+        self.assertEqual(meta.expiring(10), ["short"])
+        self.assertEqual(sorted(meta.issued_by("ca")), ["long", "short"])
+
+    def test_pickle(self):
+        node = self.pki.nodes["long"]
+        node.life = 3
+        tiny.do.recertify(node, state=False)
+        meta = pickle.loads(pickle.dumps(self.pki.meta))
+        self.assertEqual(meta.expiring(10), ["long", "short"])
+        self.assertEqual(len(meta.keys["not_after"]), 4)
+
+if __name__ == "__main__":
+    unittest.main()
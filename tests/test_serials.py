@@ -0,0 +1,99 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Unit tests of tinypyki.serials allocation uniqueness."""
+
+import pickle
+import threading
+import unittest
+
+import tinypyki as tiny
+
+class SequentialTest(unittest.TestCase):
+
+    def test_sequence(self):
+        serials = tiny.serials.Allocator(start=5)
+        self.assertEqual([serials.allocate("ca") for idx in range(3)], [5, 6, 7])
+        self.assertEqual(serials.next, 8)
+
+    def test_blocks(self):
+        serials = tiny.serials.Allocator()
+        self.assertEqual(serials.reserve("w1", 2), (1, 2))
+        self.assertEqual(serials.reserve("w2", 2), (3, 4))
+        self.assertEqual([serials.allocate("ca", "w2"), serials.allocate("ca", "w1")], [3, 1])
+        # Exhausted blocks fall back to the global sequence
+        self.assertEqual([serials.allocate("ca", "w1") for idx in range(2)], [2, 5])
+
+    def test_threads(self):
+        serials, issued = tiny.serials.Allocator(), []
+        def worker(name):
+            serials.reserve(name, 50)
+            issued.extend(serials.allocate("ca", name) for idx in range(100))
+        threads = [threading.Thread(target=worker, args=("w{0}".format(idx),)) for idx in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(issued), 800)
+        self.assertEqual(len(set(issued)), 800)
+
+    def test_refund(self):
+        serials = tiny.serials.Allocator()
+        serial  = serials.allocate("ca")
+        serials.refund("ca", serial)
+        self.assertEqual(serials.allocate("ca"), serial)
+        serials.reserve("w", 4)
+        serial = serials.allocate("ca", "w")
+        serials.refund("ca", serial, "w")
+        self.assertEqual(serials.allocate("ca", "w"), serial)
+        # Only the last serial allocated is handed out again
+        first = serials.allocate("ca")
+        serials.allocate("ca")
+        serials.refund("ca", first)
+        self.assertNotEqual(serials.allocate("ca"), first)
+
+    def test_release(self):
+        serials = tiny.serials.Allocator()
+        serials.reserve("w1", 10)
+        serials.reserve("w2", 10)
+        serials.allocate("ca", "w2")
+        serials.release("w1")
+        self.assertEqual(serials.next, 21)
+        # The last block reserved gives its unused serials back
+        serials.release("w2")
+        self.assertEqual(serials.next, 12)
+        self.assertEqual(serials.blocks, {})
+
+    def test_merge(self):
+        serials = tiny.serials.Allocator()
+        serials.reserve("w", 10)
+        other = pickle.loads(pickle.dumps(serials))
+        self.assertEqual([other.allocate("ca", "w") for idx in range(3)], [1, 2, 3])
+        serials.merge(other)
+        self.assertEqual(serials.allocate("ca", "w"), 4)
+
+class RandomTest(unittest.TestCase):
+
+    def test_unique(self):
+        serials = tiny.serials.Allocator("random")
+        issued  = [serials.allocate("ca") for idx in range(1000)]
+        self.assertEqual(len(set(issued)), 1000)
+        self.assertTrue(all(0 < serial < 2 ** 127 for serial in issued))
+        self.assertEqual(serials.issued["ca"], set(issued))
+
+    def test_per_issuer(self):
+        serials = tiny.serials.Allocator("random")
+        serial  = serials.allocate("ca1")
+        self.assertIn(serial, serials.issued["ca1"])
+        self.assertNotIn("ca2", serials.issued)
+        serials.refund("ca1", serial)
+        self.assertNotIn(serial, serials.issued["ca1"])
+
+    def test_unknown_mode(self):
+        self.assertEqual(tiny.serials.Allocator("shuffled").mode, "sequential")
+
+if __name__ == "__main__":
+    unittest.main()
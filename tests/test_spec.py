@@ -0,0 +1,81 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Unit tests of tinypyki.spec range and template expansion."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import tinypyki as tiny
+
+SPEC = { "pki"       : "spec-test",
+         "defaults"  : { "life" : 30 },
+         "templates" : { "leaf" : { "ntype" : "u", "san" : "dns={nid}.hexample.com",
+                                    "subj"  : { "cn" : "{nid}-dummy" } } },
+         "nodes"     : [{ "nid" : "root", "children" : [
+                          { "nid" : "sub-{0..1}", "children" : [
+                            { "nid" : "{issuer}-leaf-{08..10}", "template" : "leaf", "life" : 7 }] }] }] }
+
+class SpecTest(unittest.TestCase):
+
+    def setUp(self):
+        tiny.events.quiet()
+        self.cwd  = os.getcwd()
+        self.wdir = tempfile.mkdtemp(prefix="tinypyki-test-")
+        os.chdir(self.wdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.wdir, ignore_errors=True)
+        tiny.events.reset()
+
+    def test_ranges(self):
+        nids = [node.nid for node in tiny.spec.nodes(SPEC)]
+        self.assertEqual(nids, ["root", "sub-0", "sub-0-leaf-08", "sub-0-leaf-09", "sub-0-leaf-10",
+                                        "sub-1", "sub-1-leaf-08", "sub-1-leaf-09", "sub-1-leaf-10"])
+
+    def test_issuers_first(self):
+        seen = set()
+        for node in tiny.spec.nodes(SPEC):
+            self.assertTrue(node.issuer == node.nid or node.issuer in seen)
+            seen.add(node.nid)
+
+    def test_templates(self):
+        nodes = dict((node.nid, node) for node in tiny.spec.nodes(SPEC))
+        leaf  = nodes["sub-1-leaf-09"]
+        self.assertEqual(leaf.issuer, "sub-1")
+        self.assertEqual(leaf.ntype, "u")
+        self.assertEqual(leaf.san, "dns=sub-1-leaf-09.hexample.com")
+        self.assertTrue(leaf.subj.endswith("sub-1-leaf-09-dummy"))
+        # Entry values win over the template, the defaults apply underneath
+        self.assertEqual(leaf.life, 7)
+        self.assertEqual(nodes["sub-0"].life, 30)
+        self.assertEqual(nodes["sub-0"].ntype, "ca")
+
+    def test_root_pathlen(self):
+        root = next(tiny.spec.nodes(SPEC))
+        self.assertEqual(root.pathlen, 2)
+        self.assertEqual(root.sign_list, ["root"])
+
+    def test_unknown_template(self):
+        spec  = { "nodes" : [{ "nid" : "alone", "template" : "missing" }] }
+        nodes = list(tiny.spec.nodes(spec))
+        self.assertEqual([node.nid for node in nodes], ["alone"])
+
+    def test_load(self):
+        path = os.path.join(self.wdir, "spec.json")
+        with open(path, "w") as s_hdlr:
+            json.dump(SPEC, s_hdlr)
+        pki = tiny.spec.load(path)
+        self.assertEqual(pki.id, "spec-test")
+        self.assertEqual(len(pki.nodes), 9)
+        self.assertIsNone(tiny.spec.load(os.path.join(self.wdir, "missing.json")))
+
+if __name__ == "__main__":
+    unittest.main()
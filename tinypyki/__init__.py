@@ -15,4 +15,5 @@ import sys
 
 from .pki  import *
 from .show import show
-from .     import do, change
+from .profiling import profile
+from .     import do, change, spec, cache, reservoir, asn1, meta, events, metrics, costs
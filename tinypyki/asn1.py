@@ -0,0 +1,439 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""A lightweight in process certificate inspector.
+
+summary(path) parses a PEM or DER key, csr, cert or crl file and returns a
+dictionary of its main fields, without calling openssl:
+
+type        -- "key", "csr", "cert" or "crl"
+subject     -- subject in the tinypyki.change.subj format (csr, cert)
+issuer      -- issuer in the same format (cert, crl)
+serial      -- serial number, an integer (cert)
+not_before  -- start of validity, "YYYY-MM-DDTHH:MM:SSZ" (cert)
+not_after   -- end of validity, same format (cert)
+this_update -- crl issuance, same format (crl)
+next_update -- crl expiry, same format (crl)
+sans        -- list of subject alternative names, e.g. "DNS:dilbert.el" (csr, cert)
+key_type    -- "rsa", "ec", "ed25519"... (key, csr, cert)
+key_size    -- key size in bits (key, csr, cert)
+curve       -- curve name, ECC keys only (key, csr, cert)
+signature   -- signature algorithm name (csr, cert, crl)
+digest      -- signature digest, e.g. "sha1", None for EdDSA (csr, cert, crl)
+extensions  -- a dictionary { "name": {"critical": bool, "value": parsed value} }
+entries     -- number of revoked certificates (crl)
+revoked     -- list of revoked serials (crl)
+
+Summaries of the last MEMOIZED files are memoized, and refreshed when the
+file changes. Key sizes are the ones openssl reports, e.g. 253 bits for
+Ed25519 and X25519, 456 for Ed448.
+"""
+
+import base64
+import os
+import threading
+from collections import OrderedDict
+
+from .macros import *
+
+# Object identifiers, dotted string -> name
+OIDS = { "2.5.4.6"                    : "C",
+         "2.5.4.8"                    : "ST",
+         "2.5.4.7"                    : "L",
+         "2.5.4.10"                   : "O",
+         "2.5.4.11"                   : "OU",
+         "2.5.4.3"                    : "CN",
+         "1.2.840.113549.1.9.1"       : "emailAddress",
+         "1.2.840.113549.1.1.1"       : "rsa",
+         "1.2.840.10045.2.1"          : "ec",
+         "1.3.101.110"                : "x25519",
+         "1.3.101.111"                : "x448",
+         "1.3.101.112"                : "ed25519",
+         "1.3.101.113"                : "ed448",
+         "1.2.840.113549.1.1.4"       : "md5WithRSAEncryption",
+         "1.2.840.113549.1.1.5"       : "sha1WithRSAEncryption",
+         "1.2.840.113549.1.1.11"      : "sha256WithRSAEncryption",
+         "1.2.840.113549.1.1.12"      : "sha384WithRSAEncryption",
+         "1.2.840.113549.1.1.13"      : "sha512WithRSAEncryption",
+         "1.2.840.10045.4.1"          : "ecdsa-with-SHA1",
+         "1.2.840.10045.4.3.2"        : "ecdsa-with-SHA256",
+         "1.2.840.10045.4.3.3"        : "ecdsa-with-SHA384",
+         "1.2.840.10045.4.3.4"        : "ecdsa-with-SHA512",
+         "2.5.29.14"                  : "subjectKeyIdentifier",
+         "2.5.29.15"                  : "keyUsage",
+         "2.5.29.17"                  : "subjectAltName",
+         "2.5.29.18"                  : "issuerAltName",
+         "2.5.29.19"                  : "basicConstraints",
+         "2.5.29.20"                  : "cRLNumber",
+         "2.5.29.31"                  : "crlDistributionPoints",
+         "2.5.29.35"                  : "authorityKeyIdentifier",
+         "2.5.29.37"                  : "extendedKeyUsage",
+         "1.3.6.1.5.5.7.1.1"          : "authorityInfoAccess",
+         "1.2.840.113549.1.9.14"      : "extensionRequest" }
+
+# Named curves, dotted string -> (name, size in bits)
+CURVES = { "1.2.840.10045.3.1.1"      : ("prime192v1", 192),
+           "1.2.840.10045.3.1.2"      : ("prime192v2", 192),
+           "1.2.840.10045.3.1.3"      : ("prime192v3", 192),
+           "1.2.840.10045.3.1.4"      : ("prime239v1", 239),
+           "1.2.840.10045.3.1.5"      : ("prime239v2", 239),
+           "1.2.840.10045.3.1.6"      : ("prime239v3", 239),
+           "1.2.840.10045.3.1.7"      : ("prime256v1", 256),
+           "1.3.132.0.6"              : ("secp112r1",  112),
+           "1.3.132.0.7"              : ("secp112r2",  112),
+           "1.3.132.0.28"             : ("secp128r1",  128),
+           "1.3.132.0.29"             : ("secp128r2",  128),
+           "1.3.132.0.9"              : ("secp160k1",  160),
+           "1.3.132.0.8"              : ("secp160r1",  160),
+           "1.3.132.0.30"             : ("secp160r2",  160),
+           "1.3.132.0.31"             : ("secp192k1",  192),
+           "1.3.132.0.32"             : ("secp224k1",  224),
+           "1.3.132.0.33"             : ("secp224r1",  224),
+           "1.3.132.0.10"             : ("secp256k1",  256),
+           "1.3.132.0.34"             : ("secp384r1",  384),
+           "1.3.132.0.35"             : ("secp521r1",  521),
+           "1.3.132.0.4"              : ("sect113r1",  113),
+           "1.3.132.0.5"              : ("sect113r2",  113),
+           "1.3.132.0.22"             : ("sect131r1",  131),
+           "1.3.132.0.23"             : ("sect131r2",  131),
+           "1.3.132.0.1"              : ("sect163k1",  163),
+           "1.3.132.0.2"              : ("sect163r1",  163),
+           "1.3.132.0.15"             : ("sect163r2",  163),
+           "1.3.132.0.24"             : ("sect193r1",  193),
+           "1.3.132.0.25"             : ("sect193r2",  193),
+           "1.3.132.0.26"             : ("sect233k1",  233),
+           "1.3.132.0.27"             : ("sect233r1",  233),
+           "1.3.132.0.3"              : ("sect239k1",  239),
+           "1.3.132.0.16"             : ("sect283k1",  283),
+           "1.3.132.0.17"             : ("sect283r1",  283),
+           "1.3.132.0.36"             : ("sect409k1",  409),
+           "1.3.132.0.37"             : ("sect409r1",  409),
+           "1.3.132.0.38"             : ("sect571k1",  571),
+           "1.3.132.0.39"             : ("sect571r1",  571) }
+
+# Key usage bit names, in bit order
+KEY_USAGES = ("digitalSignature", "nonRepudiation", "keyEncipherment", "dataEncipherment",
+              "keyAgreement", "keyCertSign", "cRLSign", "encipherOnly", "decipherOnly")
+
+# Key sizes of the Edwards and Montgomery curves, as openssl reports them
+EDWARDS_BITS = { "ed25519" : 253, "ed448" : 456, "x25519" : 253, "x448" : 448 }
+
+# Number of memoized summaries, least recently used first evicted
+MEMOIZED = 4096
+
+# Memoized summaries { "path": ((mtime, size), summary) }
+_summaries = OrderedDict()
+_memoizing = threading.Lock()
+
+def summary(path):
+    """Return the summary dictionary of a key, csr, cert or crl file.
+
+    path -- filepath to a PEM or DER file
+
+    Returns None if the file cannot be identified or parsed.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    with _memoizing:
+        if path in _summaries and _summaries[path][0] == (stat.st_mtime_ns, stat.st_size):
+            _summaries.move_to_end(path)
+            return _summaries[path][1]
+    with open(path, "rb") as f_hdlr:
+        data = f_hdlr.read()
+    try:
+        parsed = parse(data, os.path.basename(path))
+    except (IndexError, ValueError):
+        parsed = None
+    with _memoizing:
+        _summaries[path] = ((stat.st_mtime_ns, stat.st_size), parsed)
+        _summaries.move_to_end(path)
+        while len(_summaries) > MEMOIZED:
+            _summaries.popitem(last=False)
+    return parsed
+
+def parse(data, name=""):
+    """Return the summary dictionary of PEM or DER data (bytes).
+
+    name -- file name, used for identifying DER data (default "")
+    """
+    label = None
+    if b"-----BEGIN " in data:
+        label, data = _pem(data)
+    kind = _kind(label, name)
+    if kind == "cert":
+        return _cert(data)
+    elif kind == "csr":
+        return _csr(data)
+    elif kind == "crl":
+        return _crl(data)
+    elif kind == "key":
+        return _key(data, label)
+    return None
+
+def _pem(data):
+    """Return (label, DER bytes) of the first PEM block, EC PARAMETERS aside."""
+    blocks, label, body = [], None, []
+    for line in data.splitlines():
+        if line.startswith(b"-----BEGIN "):
+            label, body = line[11:].rstrip(b"-").decode("ascii"), []
+        elif line.startswith(b"-----END ") and label:
+            blocks.append((label, base64.b64decode(b"".join(body))))
+            label = None
+        elif label and not b":" in line:
+            body.append(line.strip())
+    blocks = [block for block in blocks if block[0] != "EC PARAMETERS"] or blocks
+    return blocks[0]
+
+def _kind(label, name):
+    """Identify the nature of a file from its PEM label or file name."""
+    if label:
+        return "cert" if label in ["CERTIFICATE", "X509 CERTIFICATE"] else "csr" if "REQUEST" in label else "crl" if "CRL" in label else "key" if "KEY" in label else None
+    parts = name.split(".")
+    return next((kind for kind in ["key", "csr", "cert", "crl"] if kind in parts), None)
+
+def _tlv(data, pos=0):
+    """Decode the DER element at pos, return (tag, value start, value end)."""
+    tag, length, pos = data[pos], data[pos + 1], pos + 2
+    if length & 0x80:
+        count, length = length & 0x7f, int.from_bytes(data[pos:pos + (length & 0x7f)], "big")
+        pos += count
+    if pos + length > len(data):
+        raise ValueError("truncated DER element")
+    return tag, pos, pos + length
+
+def _children(data, start, end):
+    """Return the list of (tag, start, end) elements between start and end."""
+    children = []
+    while start < end:
+        tag, v_start, v_end = _tlv(data, start)
+        children.append((tag, v_start, v_end))
+        start = v_end
+    return children
+
+def _seq(data, element):
+    """Return the children of a constructed element."""
+    return _children(data, element[1], element[2])
+
+def _oid(data, element):
+    """Decode an OBJECT IDENTIFIER into a dotted string."""
+    value, arcs, acc = data[element[1]:element[2]], [], 0
+    for byte in value:
+        acc = (acc << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            arcs.append(acc)
+            acc = 0
+    first = min(arcs[0] // 40, 2)
+    return ".".join(str(arc) for arc in [first, arcs[0] - 40 * first] + arcs[1:])
+
+def _int(data, element):
+    """Decode an INTEGER."""
+    return int.from_bytes(data[element[1]:element[2]], "big", signed=True)
+
+def _str(data, element):
+    """Decode a string type."""
+    value = data[element[1]:element[2]]
+    return value.decode("utf-16-be") if element[0] == 0x1e else value.decode("utf-8", "replace")
+
+def _time(data, element):
+    """Decode a UTCTime or GeneralizedTime into YYYY-MM-DDTHH:MM:SSZ."""
+    value = data[element[1]:element[2]].decode("ascii")
+    if element[0] == 0x17:
+        value = ("19" if int(value[:2]) >= 50 else "20") + value
+    return "{0}-{1}-{2}T{3}:{4}:{5}Z".format(value[:4], value[4:6], value[6:8], value[8:10], value[10:12], value[12:14])
+
+def _name(data, element):
+    """Decode a Name into the /C=../CN=.. format."""
+    name = ""
+    for rdn in _seq(data, element):
+        for atv in _children(data, rdn[1], rdn[2]):
+            oid, value = _seq(data, atv)[:2]
+            name += "/{0}={1}".format(OIDS.get(_oid(data, oid), _oid(data, oid)), _str(data, value))
+    return name
+
+def _algorithm(data, element):
+    """Decode an AlgorithmIdentifier, return (name, parameters element)."""
+    children = _seq(data, element)
+    oid = _oid(data, children[0])
+    return OIDS.get(oid, oid), children[1] if len(children) > 1 else None
+
+def _digest(algorithm):
+    """Return the digest of a signature algorithm name."""
+    lowered = algorithm.lower()
+    return next((digest for digest in DIGESTS if digest in lowered), None)
+
+def _spki(data, element):
+    """Decode a SubjectPublicKeyInfo, return key_type, key_size and curve."""
+    algorithm, key = _seq(data, element)[:2]
+    key_type, params = _algorithm(data, algorithm)
+    info = {"key_type": key_type, "key_size": None}
+    if key_type == "rsa":
+        modulus = _children(data, key[1] + 1, key[2])[0]
+        info["key_size"] = _int(data, _seq(data, modulus)[0]).bit_length()
+    elif key_type == "ec":
+        curve = _oid(data, params) if params and params[0] == 0x06 else None
+        info["curve"], info["key_size"] = CURVES.get(curve, (curve, (key[2] - key[1] - 2) * 4))
+    else:
+        info["key_size"] = EDWARDS_BITS.get(key_type)
+    return info
+
+def _general_names(data, element):
+    """Decode GeneralNames into a list of "TYPE:value" strings."""
+    names = []
+    for tag, start, end in _seq(data, element):
+        value = data[start:end]
+        if tag == 0x81:
+            names.append("email:" + value.decode("ascii"))
+        elif tag == 0x82:
+            names.append("DNS:" + value.decode("ascii"))
+        elif tag == 0x86:
+            names.append("URI:" + value.decode("ascii"))
+        elif tag == 0x87:
+            names.append("IP:" + (".".join(str(b) for b in value) if len(value) == 4 else ":".join("{0:02x}{1:02x}".format(value[i], value[i + 1]) for i in range(0, len(value), 2))))
+        elif tag == 0xa4:
+            names.append("DirName:" + _name(data, _seq(data, (tag, start, end))[0]))
+    return names
+
+def _uris(data, element):
+    """Collect the URIs nested anywhere under an element."""
+    uris = []
+    for child in _seq(data, element):
+        if child[0] == 0x86:
+            uris.append(data[child[1]:child[2]].decode("ascii"))
+        elif child[0] & 0x20:
+            uris += _uris(data, child)
+    return uris
+
+def _extension(name, data, value):
+    """Decode known extension values, others are returned as hex."""
+    if name == "basicConstraints":
+        children = _seq(data, value)
+        ca = bool(children and children[0][0] == 0x01 and data[children[0][1]])
+        pathlen = next((_int(data, child) for child in children if child[0] == 0x02), None)
+        return {"ca": ca, "pathlen": pathlen}
+    if name == "keyUsage":
+        bits = int.from_bytes(data[value[1] + 1:value[2]], "big") if value[2] > value[1] + 1 else 0
+        width = 8 * (value[2] - value[1] - 1)
+        return [usage for idx, usage in enumerate(KEY_USAGES) if idx < width and bits >> (width - 1 - idx) & 1]
+    if name in ["subjectAltName", "issuerAltName"]:
+        return _general_names(data, value)
+    if name in ["crlDistributionPoints", "authorityInfoAccess"]:
+        return _uris(data, value)
+    if name == "extendedKeyUsage":
+        return [OIDS.get(_oid(data, oid), _oid(data, oid)) for oid in _seq(data, value)]
+    if name == "cRLNumber":
+        return _int(data, value)
+    if name == "authorityKeyIdentifier":
+        key_id = next((child for child in _seq(data, value) if child[0] == 0x80), None)
+        return data[key_id[1]:key_id[2]].hex() if key_id else None
+    if name == "subjectKeyIdentifier":
+        return data[value[1]:value[2]].hex()
+    return data[value[1]:value[2]].hex()
+
+def _extensions(data, element):
+    """Decode a list of Extensions."""
+    extensions = {}
+    for ext in _seq(data, element):
+        children = _seq(data, ext)
+        oid      = _oid(data, children[0])
+        critical = len(children) == 3 and bool(data[children[1][1]])
+        octets   = children[-1]
+        try:
+            value = _extension(OIDS.get(oid, oid), data, _tlv(data, octets[1]))
+        except (IndexError, ValueError, UnicodeDecodeError):
+            value = data[octets[1]:octets[2]].hex()
+        extensions[OIDS.get(oid, oid)] = {"critical": critical, "value": value}
+    return extensions
+
+def _signed(data):
+    """Split a signed structure into (tbs children, signature algorithm name)."""
+    outer = _seq(data, _tlv(data))
+    algorithm = _algorithm(data, outer[1])[0]
+    return _seq(data, outer[0]), algorithm
+
+def _cert(data):
+    """Summarize a DER certificate."""
+    tbs, algorithm = _signed(data)
+    tbs = tbs[1:] if tbs[0][0] == 0xa0 else tbs
+    validity = _seq(data, tbs[3])
+    info = {"type"       : "cert",
+            "serial"     : _int(data, tbs[0]),
+            "issuer"     : _name(data, tbs[2]),
+            "not_before" : _time(data, validity[0]),
+            "not_after"  : _time(data, validity[1]),
+            "subject"    : _name(data, tbs[4]),
+            "signature"  : algorithm,
+            "digest"     : _digest(algorithm),
+            "extensions" : {}}
+    info.update(_spki(data, tbs[5]))
+    for element in tbs[6:]:
+        if element[0] == 0xa3:
+            info["extensions"] = _extensions(data, _seq(data, element)[0])
+    info["sans"] = info["extensions"].get("subjectAltName", {}).get("value", [])
+    return info
+
+def _csr(data):
+    """Summarize a DER certificate signing request."""
+    cri, algorithm = _signed(data)
+    info = {"type"       : "csr",
+            "subject"    : _name(data, cri[1]),
+            "signature"  : algorithm,
+            "digest"     : _digest(algorithm),
+            "extensions" : {}}
+    info.update(_spki(data, cri[2]))
+    for element in cri[3:]:
+        for attribute in _seq(data, element) if element[0] == 0xa0 else []:
+            oid, values = _seq(data, attribute)[:2]
+            if OIDS.get(_oid(data, oid)) == "extensionRequest":
+                info["extensions"] = _extensions(data, _seq(data, values)[0])
+    info["sans"] = info["extensions"].get("subjectAltName", {}).get("value", [])
+    return info
+
+def _crl(data):
+    """Summarize a DER certificate revocation list."""
+    tbs, algorithm = _signed(data)
+    tbs = tbs[1:] if tbs[0][0] == 0x02 else tbs
+    info = {"type"        : "crl",
+            "issuer"      : _name(data, tbs[1]),
+            "this_update" : _time(data, tbs[2]),
+            "next_update" : None,
+            "signature"   : algorithm,
+            "digest"      : _digest(algorithm),
+            "revoked"     : [],
+            "extensions"  : {}}
+    for element in tbs[3:]:
+        if element[0] in [0x17, 0x18]:
+            info["next_update"] = _time(data, element)
+        elif element[0] == 0x30:
+            info["revoked"] = [_int(data, _seq(data, entry)[0]) for entry in _seq(data, element)]
+        elif element[0] == 0xa0:
+            info["extensions"] = _extensions(data, _seq(data, element)[0])
+    info["entries"] = len(info["revoked"])
+    return info
+
+def _key(data, label):
+    """Summarize a DER private key (PKCS#8, PKCS#1 or SEC1)."""
+    children = _seq(data, _tlv(data))
+    info = {"type": "key", "key_size": None}
+    if label == "RSA PRIVATE KEY":
+        info.update({"key_type": "rsa", "key_size": _int(data, children[1]).bit_length()})
+    elif label == "EC PRIVATE KEY":
+        params = next((_seq(data, child)[0] for child in children if child[0] == 0xa0), None)
+        curve  = _oid(data, params) if params else None
+        info["key_type"] = "ec"
+        info["curve"], info["key_size"] = CURVES.get(curve, (curve, (children[1][2] - children[1][1]) * 8))
+    else:
+        key_type, params = _algorithm(data, children[1])
+        info["key_type"] = key_type
+        if key_type == "rsa":
+            info["key_size"] = _int(data, _seq(data, _tlv(data, children[2][1]))[1]).bit_length()
+        elif key_type == "ec":
+            curve = _oid(data, params) if params and params[0] == 0x06 else None
+            info["curve"], info["key_size"] = CURVES.get(curve, (curve, None))
+        else:
+            info["key_size"] = EDWARDS_BITS.get(key_type)
+    return info
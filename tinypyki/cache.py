@@ -0,0 +1,178 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""A content addressed artifact cache shared across PKI instances.
+
+Set pki.cache to a Cache object and gen.csr, gen.cert and gen.crl serve their
+output file from the cache when the same generation inputs were seen before,
+and populate it otherwise:
+
+    pki.cache = tiny.cache.Cache("/var/cache/tinypyki", max_size=2**30)
+
+Entries are addressed by a sha256 of the inputs of the openssl command:
+
+csr  -- nid, issuer, key length, curve name, the key file content, subject,
+        digest and extensions
+cert -- the above, plus the csr file content, the issuer's certificate, the
+        serial, the validity and the day of issuance
+crl  -- the above, plus the certificate, the index file content, the validity
+        and the day of issuance
+
+Certificates and CRLs are therefore only reused on the day they were issued,
+csrs for as long as they remain in the cache. Private keys are never cached: a
+rekey, e.g. after a key compromise, must not get the former key back, nor two
+pkis sharing node ids the same keys (see tinypyki.reservoir for pre-generated
+keys).
+
+Entries may be evicted by another thread or process at any time, a vanished
+entry is a miss.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from .macros import *
+
+class Cache():
+    """An on disk, size bounded, least recently used artifact cache."""
+
+    def __init__(self, path=None, max_size=2**30):
+        """Attributes:
+
+        .path     -- cache directory (default ~/.cache/tinypyki)
+        .max_size -- maximum cache size in bytes (default 1GiB), least recently
+                     used entries are evicted beyond
+        """
+        self.path     = path if path else os.path.join(os.path.expanduser("~"), ".cache", "tinypyki")
+        self.max_size = int(max_size)
+        self._size    = None
+
+    def __repr__(self):
+        """Formal Cache representation."""
+        return "Cache(\"{0}\", max_size={1})".format(self.path, self.max_size)
+
+    def digest(self, node, kind, serial=None):
+        """Return the cache address of a node's artifact.
+
+        node   -- a Node object
+        kind   -- string, one of "key", "csr", "cert", "crl"
+        serial -- integer, serial the cert is signed with (default None)
+
+        Returns None for keys, which are never cached.
+        """
+        if kind == "key":
+            return None
+        inputs = [kind, node.nid, node.issuer, node.key_len, node.curve_name]
+        if kind in ["csr", "cert", "crl"]:
+            inputs += [_content(node.key_path), node.subj, node.csr_digest, node.ntype, node.pathlen,
+                       node.san, node.crl_dps, node.ocsp_uri]
+        if kind in ["cert", "crl"]:
+            issuer  = node.pki.nodes[node.issuer]
+            inputs += [_content(node.csr_path), _content(issuer.cert_path) if issuer is not node else None,
+                       serial, node.cert_digest, node.life, time.strftime("%Y-%m-%d", time.gmtime())]
+        if kind == "crl":
+            inputs += [_content(node.cert_path), _content(node.pki.path["index"]), node.crl_digest, node.crl_life]
+        return hashlib.sha256(repr(inputs).encode("utf-8")).hexdigest()
+
+    def entry(self, digest):
+        """Return the path of a cache entry."""
+        return os.path.join(self.path, digest[:2], digest)
+
+    def fetch(self, digest, path):
+        """Copy a cache entry to path.
+
+        digest -- cache address, see Cache.digest
+        path   -- destination file path
+
+        Returns True on a hit, False on a miss.
+        """
+        entry = self.entry(digest)
+        try:
+            shutil.copyfile(entry, path)
+            os.utime(entry, None)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, digest, path):
+        """Copy a freshly generated file into the cache.
+
+        digest -- cache address, see Cache.digest
+        path   -- generated file path
+        """
+        entry = self.entry(digest)
+        if not os.path.isdir(os.path.dirname(entry)):
+            os.makedirs(os.path.dirname(entry))
+        tmp = entry + ".{0}.{1}.tmp".format(os.getpid(), threading.get_ident())
+        shutil.copyfile(path, tmp)
+        os.rename(tmp, entry)
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += _size(entry)
+        if self._size > self.max_size:
+            self.evict()
+
+    def size(self):
+        """Return the cache size in bytes."""
+        return sum(_size(entry) for entry, mtime in self._entries())
+
+    def evict(self, target=None):
+        """Remove least recently used entries.
+
+        target -- size in bytes to shrink the cache to (default 90% of max_size)
+        """
+        target  = int(target) if target is not None else self.max_size * 9 // 10
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        sizes   = dict((entry, _size(entry)) for entry, mtime in entries)
+        size    = sum(sizes.values())
+        for entry, mtime in entries:
+            if size <= target:
+                break
+            size -= sizes[entry]
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+        self._size = size
+
+    def clear(self):
+        """Remove every cache entry."""
+        self.evict(0)
+
+    def _entries(self):
+        """Generate (path, last use time) couples of the cache entries."""
+        if not os.path.isdir(self.path):
+            return
+        for directory in os.listdir(self.path):
+            try:
+                names = os.listdir(os.path.join(self.path, directory))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if not name.endswith(".tmp"):
+                    entry = os.path.join(self.path, directory, name)
+                    try:
+                        yield entry, os.path.getmtime(entry)
+                    except FileNotFoundError:
+                        continue
+
+def _size(path):
+    """Return the size of a cache entry, 0 if it was evicted meanwhile."""
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def _content(path):
+    """Return the sha256 of a file's content, None if there is no such file."""
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f_hdlr:
+        return hashlib.sha256(f_hdlr.read()).hexdigest()
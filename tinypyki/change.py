@@ -218,8 +218,8 @@ def curve(node, name):
     """Change a node's curve.
 
     node -- a Node object
-    name -- curve string name, must be in ECC_CURVES
+    name -- curve string name, must be in ECC_CURVES or EDDSA
     
     Use this function before generating the key, csr, cert and crl files.
     """
-    node.curve_name = name if name in ECC_CURVES else None
+    node.curve_name = name if name in ECC_CURVES or name in EDDSA else None
@@ -0,0 +1,69 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""In process PEM and DER format conversion.
+
+A PEM file is the base64 encoding of the DER structure between a BEGIN and an
+END line, so certificates, csrs and crls are converted without openssl. Keys
+are left to openssl (see gen.keyform), their PEM and DER encodings do not
+always hold the same structure.
+"""
+
+import base64
+import binascii
+import os
+
+from .macros import *
+from .       import events
+
+# PEM labels of the in process convertible files
+LABELS = { "csr"  : "CERTIFICATE REQUEST",
+           "cert" : "CERTIFICATE",
+           "crl"  : "X509 CRL" }
+
+def pem_to_der(pem):
+    """Return the (label, DER bytes) of the first PEM block of pem (bytes)."""
+    lines = pem.splitlines()
+    begin = next(idx for idx, line in enumerate(lines) if line.startswith(b"-----BEGIN "))
+    end   = next(idx for idx, line in enumerate(lines) if idx > begin and line.startswith(b"-----END "))
+    label = lines[begin][len(b"-----BEGIN "):].rstrip(b"-").decode("ascii")
+    return label, base64.b64decode(b"".join(line for line in lines[begin + 1:end] if not b":" in line))
+
+def der_to_pem(der, label):
+    """Return the PEM encoding (bytes) of der (bytes) under label."""
+    body = base64.b64encode(der)
+    return b"".join([b"-----BEGIN " + label.encode("ascii") + b"-----\n"]
+                    + [body[idx:idx + 64] + b"\n" for idx in range(0, len(body), 64)]
+                    + [b"-----END " + label.encode("ascii") + b"-----\n"])
+
+def convert(path, outform, kind=None):
+    """Convert a PEM or DER file.
+
+    path    -- input file path, its extension gives its format (.pem or .der)
+    outform -- string, output format, must be in FORMATS
+    kind    -- "csr", "cert" or "crl", gives the PEM label of DER input (default
+               None, guessed from the file name)
+
+    The output file is written next to the input file, with the outform
+    extension. Returns the output file path, None if nothing was converted.
+    """
+    inform = path.split(".")[-1]
+    if not outform in FORMATS or inform == outform:
+        return None
+    out  = ".".join(path.split(".")[:-1]) + ".{0}".format(outform)
+    kind = kind if kind else next((k for k in LABELS if k in os.path.basename(path).split(".")), None)
+    with open(path, "rb") as i_hdlr:
+        data = i_hdlr.read()
+    try:
+        data = pem_to_der(data)[1] if outform == "der" else der_to_pem(data, LABELS[kind])
+    except (StopIteration, binascii.Error, KeyError):
+        events.emit("warning", "Cannot convert {0} to {1}".format(path, outform), None, "convert")
+        return None
+    # Replaced rather than truncated, never write through a hardlink
+    with open(out + ".tmp", "wb") as o_hdlr:
+        o_hdlr.write(data)
+    os.replace(out + ".tmp", out)
+    return out
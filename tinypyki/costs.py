@@ -0,0 +1,326 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Operation cost model and longest processing time first scheduling.
+
+Every PKI instance holds a Model in pki.costs predicting how long each
+operation takes for a node, from seed timings measured with
+benchmarks/generation.py and refined with every operation run through
+schedule(). The do.keys, do.csrs, do.certs, do.crls and do.p12 stages
+run through schedule(): with several workers, the operations predicted to be
+the longest start first, so that a few large RSA keys do not run last while
+the other workers idle:
+
+    tiny.do.everything(pki, workers=8)
+    pki.costs.reports["key"]                 # predicted versus actual times
+    pki.costs.dump("costs.json")             # seed another pki with these
+
+The model also predicts the bytes written by each operation, from seed sizes
+refined with the files actually written, see do.plan for an estimate of a
+whole run before it starts.
+
+Operations are "key", "csr", "cert", "crl" and "p12", each costed for a key
+kind, ("rsa", key_len) or ("ecc", curve_name): the node's own key, except for
+certs which cost what signing with the issuer's key costs.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .macros import *
+from .       import events, gen
+
+# Seed timings in seconds { "operation": { kind: seconds } }, measured with
+# openssl 3.0, single core
+SEEDS = { "key"  : { ("rsa", 1024) : 0.03,  ("rsa", 2048) : 0.22,  ("rsa", 3072) : 0.9,
+                     ("rsa", 4096) : 2.3,   ("rsa", 8192) : 35.0 },
+          "csr"  : { ("rsa", 1024) : 0.011, ("rsa", 2048) : 0.012, ("rsa", 3072) : 0.015,
+                     ("rsa", 4096) : 0.023, ("rsa", 8192) : 0.08 },
+          "cert" : { ("rsa", 1024) : 0.056, ("rsa", 2048) : 0.057, ("rsa", 3072) : 0.06,
+                     ("rsa", 4096) : 0.068, ("rsa", 8192) : 0.13 },
+          "crl"  : { ("rsa", 2048) : 0.03,  ("rsa", 4096) : 0.04 },
+          "p12"  : { ("rsa", 2048) : 0.013, ("rsa", 4096) : 0.016 } }
+
+# Seconds of an operation whose kind is neither seeded nor observed, ECC keys
+# and signatures mostly
+DEFAULTS = { "key" : 0.01, "csr" : 0.01, "cert" : 0.055, "crl" : 0.03, "p12" : 0.014 }
+
+# RSA cost growth with the key length, cost ~ key_len ^ exponent
+GROWTH = { "key" : 4.0, "csr" : 2.0, "cert" : 1.0, "crl" : 1.0, "p12" : 1.0 }
+
+# Seed artifact sizes in bytes { "operation": { kind: bytes } }, measured on
+# default subjects with one SAN, empty crls and p12 files with their .p12.txt
+# companion
+SIZES = { "key"  : { ("rsa", 1024) : 916,  ("rsa", 2048) : 1704, ("rsa", 3072) : 2484, ("rsa", 4096) : 3272,
+                     ("ecc", "prime256v1") : 302, ("ecc", "secp384r1") : 359, ("ecc", "secp521r1") : 436,
+                     ("ecc", "ed25519") : 119, ("ecc", "ed448") : 156 },
+          "csr"  : { ("rsa", 1024) : 720,  ("rsa", 2048) : 1074, ("rsa", 4096) : 1765,
+                     ("ecc", "prime256v1") : 538, ("ecc", "secp384r1") : 620, ("ecc", "ed25519") : 460 },
+          "cert" : { ("rsa", 1024) : 1168, ("rsa", 2048) : 1521, ("rsa", 4096) : 2216,
+                     ("ecc", "prime256v1") : 985, ("ecc", "secp384r1") : 1066, ("ecc", "ed25519") : 899 },
+          "crl"  : { ("rsa", 1024) : 556,  ("rsa", 2048) : 731,  ("rsa", 4096) : 1076,
+                     ("ecc", "prime256v1") : 467, ("ecc", "secp384r1") : 512, ("ecc", "ed25519") : 447 },
+          "p12"  : { ("rsa", 1024) : 5044, ("rsa", 2048) : 7305, ("rsa", 4096) : 11744,
+                     ("ecc", "prime256v1") : 3516, ("ecc", "secp384r1") : 3828, ("ecc", "ed25519") : 3023 } }
+
+# Bytes of an operation whose kind is neither seeded nor observed
+SIZE_DEFAULTS = { "key" : 400, "csr" : 600, "cert" : 1100, "crl" : 500, "p12" : 4000 }
+
+# Weight of past observations, an observation counts for 1 / WINDOW at most
+WINDOW = 20
+
+def kind(node, op):
+    """Return the key kind an operation of a node is costed for."""
+    signer = node.pki.nodes[node.issuer] if op == "cert" and node.pki and node.issuer in node.pki.nodes else node
+    return ("ecc", signer.curve_name) if signer.curve_name else ("rsa", signer.key_len)
+
+def artifacts(node, op):
+    """Return the paths of the files an operation wrote for a node."""
+    path = getattr(node, "{0}_path".format(op), None)
+    if not path:
+        return []
+    # The .p12 file goes with its .p12.txt companion
+    return [path, path[:-4]] if op == "p12" and path.endswith(".p12.txt") else [path]
+
+class Model():
+    """Predicted seconds of each operation, per key kind."""
+
+    def __init__(self):
+        """Attributes:
+
+        .observed -- a dictionary of observed timings { (op, kind): [mean, count] }
+        .sized    -- a dictionary of observed artifact sizes { (op, kind): [mean, count] }
+        .reports  -- a dictionary of the last schedule report of each operation,
+                     see schedule
+        """
+        self.observed = {}
+        self.sized    = {}
+        self.reports  = {}
+        self._lock    = threading.Lock()
+
+    def __repr__(self):
+        """Formal Model representation."""
+        return "Model(observed={0})".format(len(self.observed))
+
+    def __getstate__(self):
+        """Locks are not saved with the pki state."""
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        """Restore a lock on load."""
+        self.__dict__.update(state)
+        self.__dict__.setdefault("sized", {})
+        self._lock = threading.Lock()
+
+    def predict(self, op, node):
+        """Return the predicted seconds of an operation for a node."""
+        return self.cost(op, kind(node, op))
+
+    def cost(self, op, key):
+        """Return the predicted seconds of an operation for a key kind.
+
+        Observed timings come first, then seeds. RSA lengths neither observed
+        nor seeded are extrapolated from the closest known length.
+        """
+        if (op, key) in self.observed:
+            return self.observed[(op, key)][0]
+        if key in SEEDS.get(op, {}):
+            return SEEDS[op][key]
+        if key[0] == "rsa" and key[1]:
+            known = [(size, seconds) for (algorithm, size), seconds in SEEDS.get(op, {}).items() if algorithm == "rsa"]
+            known += [(other[1], mean) for (name, other), (mean, count) in self.observed.items() if name == op and other[0] == "rsa"]
+            if known:
+                size, seconds = min(known, key=lambda item: abs(item[0] - key[1]))
+                return seconds * (float(key[1]) / size) ** GROWTH.get(op, 1.0)
+        return DEFAULTS.get(op, 0.01)
+
+    def size(self, op, node):
+        """Return the predicted bytes an operation writes for a node.
+
+        Observed sizes come first, then seeds. RSA lengths neither observed
+        nor seeded are interpolated, or extrapolated, from the two closest
+        known lengths: sizes grow linearly with the modulus.
+        """
+        key = kind(node, op)
+        if (op, key) in self.sized:
+            return self.sized[(op, key)][0]
+        if key in SIZES.get(op, {}):
+            return SIZES[op][key]
+        if key[0] == "rsa" and key[1]:
+            known = dict((length, size) for (algorithm, length), size in SIZES.get(op, {}).items() if algorithm == "rsa")
+            known.update((other[1], mean) for (name, other), (mean, count) in self.sized.items() if name == op and other[0] == "rsa")
+            closest = sorted(known, key=lambda length: abs(length - key[1]))[:2]
+            if len(closest) == 2:
+                (x0, x1), (y0, y1) = closest, (known[closest[0]], known[closest[1]])
+                return max(y0 + (y1 - y0) * float(key[1] - x0) / (x1 - x0), 0.0)
+            if closest:
+                return known[closest[0]] * float(key[1]) / closest[0]
+        return SIZE_DEFAULTS.get(op, 1000)
+
+    def observe(self, op, node, seconds):
+        """Refine the predictions of an operation for a node with its actual seconds and files."""
+        key   = kind(node, op)
+        paths = [path for path in artifacts(node, op) if os.path.isfile(path)]
+        size  = sum(os.path.getsize(path) for path in paths)
+        with self._lock:
+            mean, count = self.observed.get((op, key), [0.0, 0])
+            count = min(count + 1, WINDOW)
+            self.observed[(op, key)] = [mean + (seconds - mean) / count, count]
+            if paths:
+                mean, count = self.sized.get((op, key), [0.0, 0])
+                count = min(count + 1, WINDOW)
+                self.sized[(op, key)] = [mean + (size - mean) / count, count]
+
+    def dump(self, path=None):
+        """Return the observed timings and sizes as JSON, also written to path if any."""
+        data = json.dumps([dict([("op", op), ("kind", list(key)), ("seconds", mean), ("count", count)]
+                                + ([("bytes", self.sized[(op, key)][0])] if (op, key) in self.sized else []))
+                           for (op, key), (mean, count) in sorted(self.observed.items(), key=str)], indent=2)
+        if path:
+            with open(path, "w") as c_hdlr:
+                c_hdlr.write(data)
+        return data
+
+    def seed(self, path):
+        """Load timings written by dump, e.g. from another pki or a benchmark run."""
+        with open(path, "r") as c_hdlr:
+            entries = json.load(c_hdlr)
+        with self._lock:
+            for entry in entries:
+                self.observed[(entry["op"], tuple(entry["kind"]))] = [entry["seconds"], min(entry["count"], WINDOW)]
+                if "bytes" in entry:
+                    self.sized[(entry["op"], tuple(entry["kind"]))] = [entry["bytes"], min(entry["count"], WINDOW)]
+
+def lpt(costs, workers):
+    """Simulate longest processing time first list scheduling.
+
+    costs   -- list of (task, seconds) couples
+    workers -- number of workers
+
+    Returns the predicted makespan and a dictionary { task: (start, end) }.
+    """
+    free  = [(0.0, idx) for idx in range(max(1, workers))]
+    times = {}
+    for task, seconds in sorted(costs, key=lambda item: -item[1]):
+        start, idx = heapq.heappop(free)
+        times[task] = (start, start + seconds)
+        heapq.heappush(free, (start + seconds, idx))
+    return max([end for start, end in times.values()] + [0.0]), times
+
+def estimate(pki, op, nids, workers=None, levels=None):
+    """Predict the run of an operation on nodes, see schedule.
+
+    Returns a dictionary holding, in seconds: the predicted "makespan", the
+    "bound" no schedule can beat (for each level, the longest operation or
+    the total divided by workers), the "serial" total, the "cost" of each
+    node and the predicted (start, end) "times" of each node. "batches" are
+    the node ids of each level, in the order they are started.
+    """
+    model   = pki.costs
+    workers = workers if workers and workers > 1 else 1
+    cost    = dict((nid, model.predict(op, pki.nodes[nid])) for nid in nids)
+    groups  = {}
+    for nid in nids:
+        groups.setdefault(levels[nid] if levels else 0, []).append(nid)
+    batches, times, predicted, bound = [], {}, 0.0, 0.0
+    for level in sorted(groups):
+        span, spans = lpt([(nid, cost[nid]) for nid in groups[level]], workers)
+        times.update((nid, (start + predicted, end + predicted)) for nid, (start, end) in spans.items())
+        batches.append(groups[level] if workers == 1 else sorted(groups[level], key=lambda nid: -cost[nid]))
+        predicted += span
+        bound     += max(sum(cost[nid] for nid in groups[level]) / workers, max(cost[nid] for nid in groups[level]))
+    return { "makespan" : predicted,
+             "bound"    : bound,
+             "serial"   : sum(cost.values()),
+             "cost"     : cost,
+             "times"    : times,
+             "batches"  : batches }
+
+def schedule(pki, op, nids, function, workers=None, levels=None, blocks=False):
+    """Run an operation on nodes, longest predicted first.
+
+    pki      -- a PKI object
+    op       -- operation, "key", "csr", "cert", "crl" or "p12"
+    nids     -- node ids, in dependency order
+    function -- called with a Node object and a state boolean (save the pki
+                state afterwards), returns True on success
+    workers  -- number of parallel operations (default None, one at a time in
+                the order of nids, saving the state after each node)
+    levels   -- a dictionary { nid: level }, nodes of a level only start once
+                the lower levels are done, e.g. depths for certs (default
+                None, a single level)
+    blocks   -- boolean, with workers, reserve a block of serials per worker in
+                pki.serials and call function with its worker id as a third
+                argument (default False), see tinypyki.serials
+
+    With workers, the nodes of a level are started longest predicted first
+    and the pki state is saved once done. The metadata index is saved once
+    done in any case. From events.BULK nodes on, the printer only prints
+    warnings and failures meanwhile, see events.bulk. Timings of successful
+    operations refine pki.costs. The report in pki.costs.reports[op] holds, in seconds:
+    the predicted and actual makespans, the predicted bound no schedule can
+    beat (for each level, the longest operation or the total divided by
+    workers) and the predicted and actual (start, end) of each node. Returns
+    the list of node ids that failed.
+    """
+    model   = pki.costs
+    workers = workers if workers and workers > 1 else 1
+    plan    = estimate(pki, op, nids, workers, levels)
+    actual, origin = {}, time.time()
+
+    # Each worker signs from its own block, without the allocator's lock
+    blocks   = blocks and workers > 1 and pki.serials.mode == "sequential"
+    size     = -(-len(nids) // workers)
+    reserved = set()
+
+    def run(nid):
+        start = time.time()
+        if blocks:
+            worker = "{0}-{1}".format(op, threading.current_thread().name)
+            if not worker in reserved:
+                pki.serials.reserve(worker, size)
+                reserved.add(worker)
+            done = function(pki.nodes[nid], False, worker)
+        else:
+            done = function(pki.nodes[nid], workers == 1)
+        actual[nid] = (start - origin, time.time() - origin)
+        if done:
+            model.observe(op, pki.nodes[nid], actual[nid][1] - actual[nid][0])
+        return done
+
+    results = {}
+    with events.bulk(len(nids)):
+        if workers == 1:
+            results = dict((nid, run(nid)) for batch in plan["batches"] for nid in batch)
+            # The metadata index is saved once per stage, see gen.save_index
+            if nids:
+                gen.save_index(pki)
+        elif plan["batches"]:
+            try:
+                with ThreadPoolExecutor(workers) as pool:
+                    for batch in plan["batches"]:
+                        results.update(zip(batch, pool.map(run, batch)))
+            finally:
+                for worker in reserved:
+                    pki.serials.release(worker)
+            gen.save(pki)
+    makespan = time.time() - origin
+
+    if nids:
+        model.reports[op] = { "workers"   : workers,
+                              "predicted" : plan["makespan"],
+                              "actual"    : makespan,
+                              "bound"     : plan["bound"],
+                              "nodes"     : dict((nid, { "predicted" : plan["times"][nid], "actual" : actual.get(nid) }) for nid in nids) }
+        events.emit("info", "{0} {1} operation(s) on {2} worker(s): predicted {3:.2f}s, took {4:.2f}s".format(
+                    len(nids), op, workers, plan["makespan"], makespan), None, op)
+    return [nid for nid in nids if not results[nid]]
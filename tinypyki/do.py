@@ -6,12 +6,41 @@
 
 """Core PKI manipulation functions."""
 
+import json
 import pickle
+import shlex
 import os
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import call, Popen, PIPE
 
 from .macros import *
-from . import gen
+from . import gen, events, costs
+
+def _selection(pki, selection=None):
+    """Return the node ids of a node selection.
+
+    selection -- None (every node), a Node object or a node id (its subtree,
+                 including itself), a list of node ids or a predicate called
+                 with each Node object
+    """
+    if selection is None:
+        return list(pki.nodes)
+    if isinstance(selection, str):
+        return pki.nodes[selection].subtree(including=True) if selection in pki.nodes else []
+    if hasattr(selection, "subtree"):
+        return selection.subtree(including=True)
+    if callable(selection):
+        return [nid for nid, node in pki.nodes.items() if selection(node)]
+    return [nid for nid in selection if nid in pki.nodes]
+
+def _ordered(pki, nids):
+    """Return node ids in dependency order, issuers before the nodes they issue."""
+    depth = pki._depths(nids)
+    return sorted(nids, key=depth.__getitem__)
 
 def insert(node, pki):
     """Insert a node into a PKI tree.
@@ -35,20 +64,19 @@ def insert(node, pki):
         node.sign_list = [node.nid]
 
     if node.issuer != node.nid and not node.issuer in pki.nodes:
-        print("First create and insert parent node with issuer ID: {0}".format(node.issuer))
+        events.emit("text", "First create and insert parent node with issuer ID: {0}".format(node.issuer), node.nid, "insert")
         return
 
     if node.issuer != node.nid and (pki.nodes[node.issuer].ntype == "u" or pki.nodes[node.issuer].pathlen == 0):
-        print("Parent node cannot issue a certificate: ntype={0} and pathlen={1}".format(pki.nodes[node.issuer].ntype, pki.nodes[node.issuer].pathlen))
+        events.emit("text", "Parent node cannot issue a certificate: ntype={0} and pathlen={1}".format(pki.nodes[node.issuer].ntype, pki.nodes[node.issuer].pathlen), node.nid, "insert")
         return
 
     pki.nodes[node.nid] = node
     node.pathlen        = 0 if node.ntype == "u" else pki.nodes[node.issuer].pathlen - 1 if node.issuer != node.nid else node.pathlen
     node.pki            = pki
-    if not node.nid in pki.nodes[node.issuer].sign_list:
-        pki.nodes[node.issuer].sign_list.append(node.nid) 
+    pki._link(node.issuer, node.nid)
 
-    print("~~> Node {0} updated and inserted".format(node.nid))
+    events.emit("stage", "Node {0} updated and inserted".format(node.nid), node.nid, "insert")
 
 def clean(pki):
     """Remove all data on disk related to this pki.
@@ -58,90 +86,124 @@ def clean(pki):
     Used for cleanup.
     """
     cmd = "rm -rfI {0}".format(pki.path["wdir"])
-    print(cmd)
+    events.emit("text", cmd, None, "clean", cmd)
+    # Interactive, the prompt must reach the terminal
     call(cmd.split())
 
-def keys(pki):
+def _staged(pki, statuses, selection=None):
+    """Return the node ids of a selection in one of statuses, in dependency order.
+
+    Without a selection the nodes are looked up in pki.index, nodes in other
+    statuses are never visited. A one line summary of what is skipped is
+    printed instead of a line per node.
+    """
+    if selection is None:
+        nids  = [nid for status in statuses for nid in pki.having("_status", status)]
+        total = len(pki.nodes)
+    else:
+        nids  = _selection(pki, selection)
+        total = len(nids)
+        nids  = [nid for nid in nids if pki.nodes[nid]._status in statuses]
+    if total > len(nids):
+        events.emit("info", "Skipping {0} node(s) not in status {1}".format(total - len(nids), "/".join(statuses)))
+    return _ordered(pki, nids)
+
+def keys(pki, selection=None, workers=None):
     """Generate all keys for all nodes in the pki.
 
-    pki -- a PKI object
+    pki       -- a PKI object
+    selection -- nodes to consider, see _selection (default None, every node)
+    workers   -- number of parallel openssl processes (default None, one at a
+                 time), see costs.schedule
 
     For each node in pki.nodes whose status is "key" it generates the keys.
     If a node has a curve_name, it generates a ecc key, otherwise it generates
-    an RSA key.
+    an RSA key. With workers, the longest keys to generate start first.
+
+    Returns the list of node ids whose key could not be generated.
     """
-    print("~~> Generating keys for {0}...".format(pki.id))
-    for node in pki.nodes.values():
-        if node._status == "key":
-            if not node.curve_name:
-                gen.key(node)
-            else:
-                gen.ecc_key(node)
-        else:
-            print("Node {0} [status {1}]: {2}".format(node.nid, node._status, node.key_path))
+    events.emit("stage", "Generating keys for {0}...".format(pki.id), None, "key")
+    return costs.schedule(pki, "key", _staged(pki, ["key"], selection),
+                          lambda node, state: gen.key(node, state) if not node.curve_name else gen.ecc_key(node, state), workers)
 
-def csrs(pki):
+def csrs(pki, selection=None, workers=None):
     """Generate all csrs for all nodes in the pki.
 
-    pki - a PKI object
+    pki       -- a PKI object
+    selection -- nodes to consider, see _selection (default None, every node)
+    workers   -- number of parallel openssl processes (default None, one at a
+                 time), see costs.schedule
 
     For each node in pki.nodes whose status is "csr" it generates the csr.
+    Returns the list of node ids whose csr could not be generated.
     """
-    print("~~> Generating csrs for {0}...".format(pki.id))
-    for node in pki.nodes.values():
-        if node._status == "csr":
-            gen.csr(node)
-        else:
-            print("\t`-> [info] Skipping node {0} [status {1}]: {2}".format(node.nid, node._status, node.csr_path))
+    events.emit("stage", "Generating csrs for {0}...".format(pki.id), None, "csr")
+    return costs.schedule(pki, "csr", _staged(pki, ["csr"], selection), gen.csr, workers)
 
-def certs(pki):
+def certs(pki, selection=None, workers=None):
     """Generate all certs for all nodes in the pki.
 
-    pki -- a PKI object
+    pki       -- a PKI object
+    selection -- nodes to consider, see _selection (default None, every node)
+    workers   -- number of parallel openssl processes (default None, one at a
+                 time), see costs.schedule
 
-    For each node in pki.nodes whose status is "cert" it generates the cert.
+    For each node in pki.nodes whose status is "cert" it generates the cert,
+    issuers first: with workers, the certs of a depth in the tree are signed
+    in parallel once the depth above is done, each worker allocating serials
+    from its own block. Returns the list of node ids
+    whose cert could not be generated.
     """
-    print("~~> Generating certs for {0}...".format(pki.id))
-    for nid in pki.ordered():
-        if pki.nodes[nid]._status == "cert":
-            gen.cert(pki.nodes[nid])
-        else:
-            print("\t`-> [info] Skipping node {0} [status {1}]: {2}".format(nid, pki.nodes[nid]._status, pki.nodes[nid].cert_path))
+    events.emit("stage", "Generating certs for {0}...".format(pki.id), None, "cert")
+    nids = _staged(pki, ["cert"], selection)
+    return costs.schedule(pki, "cert", nids, gen.cert, workers, pki._depths(nids), True)
 
-def crls(pki):
+def crls(pki, selection=None, workers=None):
     """Generate all crls for all nodes in the pki.
 
-    pki -- a PKI object
+    pki       -- a PKI object
+    selection -- nodes to consider, see _selection (default None, every node)
+    workers   -- number of parallel openssl processes (default None, one at a
+                 time), see costs.schedule
 
     For all "ca" nodes in pki.nodes whose status is "crl" it generates the crl.
+    Returns the list of node ids whose crl could not be generated.
     """
-    print("~~> Generating crls for {0}...".format(pki.id))
-    for node in pki.nodes.values():
-        if node._status == "crl":
-            gen.crl(node)
-        else:
-            print("\t`-> [info] Skipping node {0} [status {1}]: {2}".format(node.nid, node._status, node.crl_path))
+    events.emit("stage", "Generating crls for {0}...".format(pki.id), None, "crl")
+    return costs.schedule(pki, "crl", _staged(pki, ["crl"], selection), gen.crl, workers)
 
-def p12(pki):
+def p12(pki, workers=None, text=True, selection=None):
     """Generate all p12 for all nodes in the pki.
 
-    pki -- a PKI object
+    pki       -- a PKI object
+    workers   -- number of parallel openssl processes (default None, the number
+                 of processors)
+    text      -- boolean, also write the .p12.txt companions (default True), see
+                 gen.pkcs12
+    selection -- nodes to consider, see _selection (default None, every node)
 
-    For all nodes in pki.nodes whose status is "crl" or "done" it generates the p12.
+    For all nodes in pki.nodes whose status is "crl" or "done" it generates the p12,
+    the longest first (see costs.schedule).
+    Returns the list of node ids whose p12 could not be generated.
     """
-    print("~~> Generating pkcs12 for {0}...".format(pki.id))
-    for node in pki.nodes.values():
-        if node._status in ["crl", "done"] and not node.p12_path:
-            gen.pkcs12(node)
-        else:
-            print("\t`-> [info] Skipping node {0} [status {1}]: {2}".format(node.nid, node._status, node.p12_path))
-
-def everything(pki, environment=True, pkcs12=False):
+    events.emit("stage", "Generating pkcs12 for {0}...".format(pki.id), None, "p12")
+    workers = workers if workers else os.cpu_count()
+    todo    = [nid for nid in _staged(pki, ["crl", "done"], selection) if not pki.nodes[nid].p12_path]
+    failed  = costs.schedule(pki, "p12", todo, lambda node, state: gen.pkcs12(node, text), workers)
+    # Parallel runs are saved by costs.schedule
+    if workers == 1:
+        gen.save(pki)
+    return failed
+
+def everything(pki, environment=True, pkcs12=False, selection=None, workers=None):
     """Generate all files.
 
     pki         -- a PKI object
     environment -- boolean, also generate pki environment (default True)
     pkcs12      -- boolean, also generate p12 files (default False)
+    selection   -- nodes to generate, see _selection (default None, every node)
+    workers     -- number of parallel openssl processes (default None, one at a
+                   time, p12 files on every processor), see costs.schedule
 
     An all in one function to create everything.
     Equivalent to do.keys(), do.csrs(), do.certs(), do.crls() and, if enabled,
@@ -149,12 +211,97 @@ def everything(pki, environment=True, pkcs12=False):
     """
     if environment:
         gen.env(pki)
-    keys(pki)
-    csrs(pki)
-    certs(pki)
-    crls(pki)
+    # Predicates are resolved once, before statuses change. Each stage orders
+    # its own staged nodes, looked up in pki.index without a selection
+    selection = _selection(pki, selection) if selection is not None else None
+    keys(pki, selection, workers)
+    csrs(pki, selection, workers)
+    certs(pki, selection, workers)
+    crls(pki, selection, workers)
     if pkcs12:
-        p12(pki)
+        p12(pki, workers, selection=selection)
+
+def plan(pki, pkcs12=False, selection=None, workers=None):
+    """Plan what everything would run, without running anything.
+
+    pki       -- a PKI object
+    pkcs12    -- boolean, also plan p12 files (default False)
+    selection -- nodes to plan, see _selection (default None, every node)
+    workers   -- number of parallel openssl processes the estimate is made
+                 for (default None, one at a time, p12 files on every
+                 processor), as in everything
+
+    The pending operations of each node are read from its status: a node in
+    status "key" needs a key, a csr, a cert and, for CAs that can issue CAs,
+    a crl, a node in status "cert" only the last two and so on. Every
+    operation is one openssl command. Seconds and bytes are predicted with
+    pki.costs, see tinypyki.costs: stages run one after the other, certs
+    by depth in the tree, as everything does.
+
+    Returns a dictionary holding:
+    tasks       -- the list of operations in the order they would run, each
+                   a dictionary with its "op", "nid", the (op, nid) couples
+                   it comes "after", its predicted "seconds", "bytes" and
+                   "start" and "end" seconds within the run
+    counts      -- the number of operations of each type { op: count }
+    invocations -- the number of openssl commands
+    bytes       -- the predicted bytes written by each type of operation,
+                   and their "total"
+    seconds     -- the predicted seconds of each stage { op: { "serial",
+                   "predicted", "bound", "workers" } } and of the whole run,
+                   "serial" (one at a time), "predicted" (with workers) and
+                   "bound" (no schedule can beat it)
+    """
+    stages  = ["key", "csr", "cert", "crl"] + (["p12"] if pkcs12 else [])
+    nids    = _ordered(pki, _selection(pki, selection))
+    pending = dict((op, []) for op in stages)
+    for nid in nids:
+        node  = pki.nodes[nid]
+        first = stages.index(node._status) if node._status in stages else len(stages)
+        for op in stages[first:4]:
+            # Users and CAs with pathlen 0 have no crl, see gen.crl
+            if op != "crl" or node.ntype == "ca" and node.pathlen != 0:
+                pending[op].append(nid)
+        if pkcs12 and not node.p12_path:
+            pending["p12"].append(nid)
+
+    queued = dict((op, set(pending[op])) for op in stages)
+    tasks, summary, origin = [], { "serial" : 0.0, "predicted" : 0.0, "bound" : 0.0 }, 0.0
+    for op in stages:
+        count = workers if op != "p12" else workers if workers else os.cpu_count()
+        guess = costs.estimate(pki, op, pending[op], count, pki._depths(pending[op]) if op == "cert" else None)
+        for batch in guess["batches"]:
+            for nid in batch:
+                node  = pki.nodes[nid]
+                after = [("key", nid)] if op == "csr" else [("csr", nid)] if op == "cert" else [("cert", nid)] if op in ["crl", "p12"] else []
+                if op == "cert" and node.issuer != nid and node.issuer in queued["cert"]:
+                    after.append(("cert", node.issuer))
+                tasks.append({ "op"      : op,
+                               "nid"     : nid,
+                               "after"   : [dep for dep in after if dep[1] in queued[dep[0]]],
+                               "seconds" : guess["cost"][nid],
+                               "bytes"   : int(round(pki.costs.size(op, node))),
+                               "start"   : origin + guess["times"][nid][0],
+                               "end"     : origin + guess["times"][nid][1] })
+        summary[op] = { "serial"    : guess["serial"],
+                        "predicted" : guess["makespan"],
+                        "bound"     : guess["bound"],
+                        "workers"   : count if count and count > 1 else 1 }
+        origin += guess["makespan"]
+        for key in ["serial", "bound"]:
+            summary[key] += guess[key]
+    summary["predicted"] = origin
+
+    sizes = dict((op, sum(task["bytes"] for task in tasks if task["op"] == op)) for op in stages)
+    sizes["total"] = sum(sizes.values())
+    result = { "tasks"       : tasks,
+               "counts"      : dict((op, len(pending[op])) for op in stages),
+               "invocations" : len(tasks),
+               "bytes"       : sizes,
+               "seconds"     : summary }
+    events.emit("info", "{0} openssl command(s), {1:.1f} MB, {2:.1f}s predicted ({3:.1f}s one at a time)".format(
+                len(tasks), sizes["total"] / 2.0 ** 20, summary["predicted"], summary["serial"]), None, "plan")
+    return result
 
 def load(pki_path):
     """Load a pki instance.
@@ -163,7 +310,7 @@ def load(pki_path):
 
     Unpickles a saved pki state.
     """
-    print("~~> Loading pki instance from {0}...".format(pki_path))
+    events.emit("stage", "Loading pki instance from {0}...".format(pki_path), None, "load")
     if os.path.isfile(pki_path):
         with open(pki_path, "rb") as p_hdlr:
             pki = pickle.load(p_hdlr)
@@ -184,9 +331,11 @@ def revoke(node, reason=None, including=True):
 
     This function also re-generates the CRL file accordingly. If this node is
     also revoked, it re-generates the CRL of the issuer, otherwise, it
-    re-generates the CRL of this node.
+    re-generates the CRL of this node. Returns True if every revocation and
+    the CRL succeeded.
     """
-    print("~~> Revoking {0}...".format(node.nid))
+    events.emit("stage", "Revoking {0}...".format(node.nid), node.nid, "revoke")
+    done = True
 
     # revoke subtree
     for nid in node.subtree(including)[::-1]:
@@ -197,13 +346,15 @@ def revoke(node, reason=None, including=True):
         cmd += " -cert {0}".format(node.pki.nodes[node.pki.nodes[nid].issuer].cert_path)
         cmd += " -config {0}".format(node.pki.path["config.cnf"])
 
-        print("\t`-> [openssl] " + cmd)
-
-        if call(cmd.split()):
-           print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+        if events.call(cmd.split(), nid, "revoke"):
+           done = False
+        else:
+           node.pki.meta.revoke(nid, REASONS[reason] if reason in REASONS else "unspecified")
 
     # update CRLs accordingly
-    gen.crl(node.pki.nodes[node.nid if not including and node.ntype == "ca" else node.issuer])
+    done = gen.crl(node.pki.nodes[node.nid if not including and node.ntype == "ca" else node.issuer]) and done
+    gen.save_index(node.pki)
+    return done
 
 def verifyenv(pki, create=True):
     """Create or destroy verify environment.
@@ -226,13 +377,12 @@ def verifyenv(pki, create=True):
         cmd += " -hash"
         cmd += " -in {0}".format(pki.nodes[nid].cert_path)
         cmd += " -noout"
-        print("\t`-> [openssl] " + cmd)
+        events.emit("openssl", cmd, nid, "verify", cmd)
         proc = Popen(cmd.split(), stdout=PIPE)
         # link hash file to cert
         hashed = str(proc.communicate()[0].decode(encoding="utf-8").strip())
         cmd  = "ln -sf {0} {1}/{2}.0".format(pki.nodes[nid].cert_path, pki.path["certs"], hashed)
-        if call(cmd.split()):
-            print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+        events.call(cmd.split(), nid, "verify", "ln")
 
 def verify(node, thing=None):
     """A compound verification function.
@@ -242,10 +392,13 @@ def verify(node, thing=None):
              if it is "cert", ensure the proper environment has been created
              first (see verifyenv). For anything else, it verifies everything
              that can be verified for this node (i.e. all the above if defined)
+
+    Returns True if everything verified.
     """
     if thing in ["key", "csr", "crl", "ecc"]:
         cmd  = "{0}".format(node.pki.path["openssl"])
-        cmd += " rsa" if thing == "key" else " req" if thing == "csr" else " ecparam" if thing == "ecc" else " crl -CAfile {0}".format(node.cert_path)
+        cmd += " rsa" if thing == "key" else " req" if thing == "csr" else " crl -CAfile {0}".format(node.cert_path) if thing == "crl" \
+               else " pkey" if node.curve_name in EDDSA else " ecparam"
         cmd += " -in {0}".format(node.key_path if thing in ["key", "ecc"] else node.csr_path if thing == "csr" else node.crl_path)
         cmd += " -noout"
         cmd += " -check" if thing in ["key", "ecc"] else " -verify" if thing == "csr" else ""
@@ -253,7 +406,7 @@ def verify(node, thing=None):
     elif thing == "pkcs12":
         cmd  = "{0} pkcs12".format(node.pki.path["openssl"])
         # Stored is .txt, skip to .p12 files
-        cmd += " -in {0}".format(node.p12_path[:-4])
+        cmd += " -in {0}".format(node.p12_path[:-4] if node.p12_path.endswith(".txt") else node.p12_path)
         cmd += " -info"
         cmd += " -noout"
         cmd += " -password pass:"
@@ -272,53 +425,42 @@ def verify(node, thing=None):
         cmd += " {0}/{1}.0".format(node.pki.path["certs"], cert_hash)
 
     else:
+        done = True
         if node.key_path:
-            if not node.curve_name:
-                verify(node, "key")
-            else:
-                verify(node, "ecc")
+            done = verify(node, "key" if not node.curve_name else "ecc") and done
         if node.csr_path:
-            verify(node, "csr")
+            done = verify(node, "csr") and done
         if node.cert_path:
-            verify(node, "cert")
+            done = verify(node, "cert") and done
         if node.crl_path:
-            verify(node, "crl")
+            done = verify(node, "crl") and done
         if node.p12_path:
-            verify(node, "pkcs12")
-        return 
-
-    print("\t`-> [openssl] " + cmd)
+            done = verify(node, "pkcs12") and done
+        return done
 
-    if call(cmd, shell=True):
-        print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+    return not events.call(cmd, node.nid, "verify", shell=True)
 
-def verify_all(pki):
+def verify_all(pki, selection=None):
     """A verification function for the whole pki.
 
-    pki -- a PKI object
+    pki       -- a PKI object
+    selection -- nodes to verify, see _selection (default None, every node)
 
     Verifies everything that can be verified for all nodes inserted in the pki.
+    Returns the list of node ids for which something did not verify.
     """
-    print("~~> Verifying everything in PKI: {0}".format(pki.id))
-    for node in pki.nodes.values():
-        if node.key_path:
-            print("\t`-> Verifying key for: {0}".format(node.nid))
-            if not node.curve_name:
-                verify(node, "key")
-            else:
-                verify(node, "ecc")
-        if node.csr_path:
-            print("\t`-> Verifying csr for: {0}".format(node.nid))
-            verify(node, "csr")
-        if node.cert_path:
-            print("\t`-> Verifying cert for: {0}".format(node.nid))
-            verify(node, "cert")
-        if node.crl_path:
-            print("\t`-> Verifying crl for: {0}".format(node.nid))
-            verify(node, "crl")
-        if node.p12_path:
-            print("\t`-> Verifying p12 for: {0}".format(node.nid))
-            verify(node, "pkcs12")
+    events.emit("stage", "Verifying everything in PKI: {0}".format(pki.id), None, "verify")
+    failed = []
+    for node in [pki.nodes[nid] for nid in _ordered(pki, _selection(pki, selection))]:
+        done = True
+        for thing, path in [("key" if not node.curve_name else "ecc", node.key_path), ("csr", node.csr_path),
+                            ("cert", node.cert_path), ("crl", node.crl_path), ("pkcs12", node.p12_path)]:
+            if path:
+                events.emit("info", "Verifying {0} for: {1}".format(thing, node.nid), node.nid, "verify")
+                done = verify(node, thing) and done
+        if not done:
+            failed.append(node.nid)
+    return failed
 
 def renew_crl(node, life=None, state=True, verbose=False):
     """Renew a crl. 
@@ -332,48 +474,211 @@ def renew_crl(node, life=None, state=True, verbose=False):
     """
     node.crl_life = min(int(life), node.life) if life and int(life) >= 1 else node.life
     gen.crl(node, state, verbose)
+    if state:
+        gen.save_index(node.pki)
 
-def renew_branch(node, reason="unspecified", including=False):
+def renew_branch(node, reason="unspecified", including=False, rekey=True):
     """Renew a whole subtree.
 
     node      -- a Node object
     reason    -- string, revocation reason (default "unspecified"), must be in REASONS
     including -- boolean, include this node or not in the renewal process (default False)
+    rekey     -- boolean, generate new keys and csrs (default True), otherwise
+                 the existing ones are re-signed, see recertify
 
     First, the whole subtree (including this node or not) is revoked for the
     specified reason, then the state of the nodes is set to "key" and then
-    the whole subtree is generated anew. If nodes already had a p12 created,
-    those too will be automatically re-created.
+    the whole subtree is generated anew, the rest of the pki is left
+    untouched. If nodes already had a p12 created, those too will be
+    automatically re-created.
     """
+    pkcs12 = node.p12_path
     # Revoke whole branch
     revoke(node, reason, including)
+    subtree = node.subtree(including)
+    for nid in subtree:
+        node.pki.nodes[nid].p12_path = None
     # Renew whole branch
-    for nid in node.subtree(including):
-        node.pki.nodes[nid]._status = "key"
-    keys(node.pki)
-    csrs(node.pki)
-    certs(node.pki)
-    crls(node.pki)
-    if node.p12_path:
-        p12(node.pki)
+    if not rekey:
+        recertify(node, including)
+    else:
+        for nid in subtree:
+            node.pki.nodes[nid]._status = "key"
+        keys(node.pki, subtree)
+        csrs(node.pki, subtree)
+        certs(node.pki, subtree)
+        crls(node.pki, subtree)
+    if pkcs12:
+        p12(node.pki, selection=subtree)
 
-def keystore(node, format):
-    """Generate a keystore.
+def recertify(node, including=True, state=True):
+    """Re-issue the certs of a subtree from their existing csrs.
 
-    node   -- a Node object
-    format -- string, the format of the keystore, must be one of "p12", "pkcs12", "cert", "cert", "crt", "pem"
+    node      -- a Node object
+    including -- boolean, include this node or not (default True)
+    state     -- boolean, save pki state afterwards (default True)
 
-    Creates a keystore of the specified format (p12 or .cert.pem).
+    Keys and csrs are kept, each cert is signed again with a new serial and
+    node.life validity: one signature per node, no key generation. CAs are
+    re-signed before the certs they issue, and their crls re-generated
+    afterwards. Former certs are not revoked, see renew_branch for that.
+    """
+    events.emit("stage", "Re-certifying {0}...".format(node.nid), node.nid, "cert")
+    subtree = [nid for nid in node.subtree(including) if node.pki.nodes[nid].csr_path]
+    for nid in subtree:
+        node.pki.nodes[nid]._status = "cert"
+        gen.cert(node.pki.nodes[nid], False)
+    for nid in subtree:
+        if node.pki.nodes[nid]._status == "crl":
+            gen.crl(node.pki.nodes[nid], False)
+    if state:
+        gen.save(node.pki)
+
+def renewals(pki, days=1, now=None, limit=None):
+    """Plan the renewal of certs and crls approaching expiry.
+
+    pki   -- a PKI object
+    days  -- renew what expires within this number of days (default 1)
+    now   -- seconds since the epoch (default None, current time)
+    limit -- maximum number of renewals (default None, no maximum), the
+             soonest to expire come first
+
+    Certs and crls are looked up in pki.meta (see tinypyki.meta), revoked
+    certs are left aside. Returns a list of batches, each a list of
+    ("cert", nid) or ("crl", nid) couples: certs are batched by depth in
+    the tree, so issuers are renewed before their dependents, and crls come
+    last, once their issuer's cert is renewed.
+    """
+    now   = time.time() if now is None else now
+    certs = [("cert", nid) for nid in pki.meta.expiring(days, now=now)
+             if nid in pki.nodes and not pki.meta.records[nid]["revoked"]]
+    crls  = [("crl", nid) for nid in pki.meta.crl_expiry(None, now + days * 86400) if nid in pki.nodes]
+    due   = sorted(certs + crls, key=lambda item: pki.meta.records[item[1]]["not_after"] if item[0] == "cert"
+                                                  else pki.meta.crls[item[1]]["next_update"])
+    due   = due[:limit] if limit is not None else due
+    depth = dict((nid, len(pki.trust_chain(nid))) for kind, nid in due)
+    plan  = []
+    for level in sorted(set(depth[nid] for kind, nid in due if kind == "cert")):
+        plan.append([("cert", nid) for kind, nid in due if kind == "cert" and depth[nid] == level])
+    if any(kind == "crl" for kind, nid in due):
+        plan.append([("crl", nid) for kind, nid in due if kind == "crl"])
+    return plan
+
+def _throttle(rate):
+    """Return a function waiting for the next slot of a rate limit.
+
+    rate -- maximum number of calls per second (None, no limit)
+    """
+    lock, slot = threading.Lock(), [time.time()]
+    def wait():
+        if not rate:
+            return
+        with lock:
+            delay   = slot[0] - time.time()
+            slot[0] = max(slot[0], time.time()) + 1.0 / rate
+        if delay > 0:
+            time.sleep(delay)
+    return wait
+
+def _renew(pki, kind, nid, wait):
+    """Renew a node's cert or crl, return its report entry.
+
+    A failed renewal leaves the node's status as it was, the former cert or
+    crl still being in place.
+    """
+    wait()
+    node, start = pki.nodes[nid], time.time()
+    status = node._status
+    if kind == "cert":
+        before = pki.meta.records[nid]["not_after"] if nid in pki.meta.records else None
+        node._status = "cert"
+        done  = gen.cert(node, False)
+        after = pki.meta.records[nid]["not_after"] if nid in pki.meta.records else None
+    else:
+        before = pki.meta.crls[nid]["next_update"] if nid in pki.meta.crls else None
+        node._status = "crl"
+        done  = gen.crl(node, False)
+        after = pki.meta.crls[nid]["next_update"] if nid in pki.meta.crls else None
+    if not done:
+        node._status = status
+    return { "kind"    : kind,
+             "nid"     : nid,
+             "status"  : "renewed" if done else "failed",
+             "before"  : before,
+             "after"   : after,
+             "seconds" : round(time.time() - start, 3) }
+
+def renew(pki, days=1, workers=None, rate=None, limit=None, report=None, now=None):
+    """Renew the certs and crls approaching expiry.
+
+    pki     -- a PKI object
+    days    -- renew what expires within this number of days (default 1)
+    workers -- number of parallel openssl processes (default None, the number
+               of processors)
+    rate    -- maximum number of renewals started per second (default None,
+               no limit)
+    limit   -- maximum number of renewals in this run (default None, no
+               maximum), see renewals
+    report  -- path of the JSON report (default pki.path["wdir"]/renewal.json)
+    now     -- seconds since the epoch (default None, current time)
+
+    Meant to be run periodically, e.g. from cron, to keep a pki fresh. The
+    plan of renewals (see renewals) is run batch by batch, each batch on a
+    pool of workers. Certs are re-issued from the existing csr with a new
+    serial and validity, the key is kept so the certs a CA issued remain
+    valid and are not renewed along. Superseded certs are not revoked, they
+    expire shortly. Crls are re-generated with node.crl_life.
+
+    The report lists the plan and, for each renewal, its former and new
+    expiry, status and duration. It is returned as a dictionary.
     """
+    events.emit("stage", "Renewing what expires within {0} day(s) in {1}...".format(days, pki.id), None, "renew")
+    plan    = renewals(pki, days, now, limit)
+    wait    = _throttle(rate)
+    results = []
+    start   = time.time()
+    for batch in plan:
+        with ThreadPoolExecutor(workers if workers else os.cpu_count()) as pool:
+            results += list(pool.map(lambda item: _renew(pki, item[0], item[1], wait), batch))
+    gen.save(pki)
+    summary = { "pki"     : pki.id,
+                "days"    : days,
+                "started" : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start)),
+                "seconds" : round(time.time() - start, 3),
+                "plan"    : plan,
+                "renewed" : len([r for r in results if r["status"] == "renewed"]),
+                "failed"  : len([r for r in results if r["status"] == "failed"]),
+                "results" : results }
+    report = report if report else os.path.join(pki.path["wdir"], "renewal.json")
+    with open(report, "w") as r_hdlr:
+        json.dump(summary, r_hdlr, indent=2)
+    events.emit("info", "{0} renewed, {1} failed, report in {2}".format(summary["renewed"], summary["failed"], report), None, "renew")
+    return summary
+
+def _chain(pki, nid, bundles):
+    """Return the PEM trust chain of a node (bytes), from the node to the root.
+
+    bundles -- a dictionary caching the chain of each CA { "nid": bytes }
+    """
+    if nid in bundles:
+        return bundles[nid]
+    with open(pki.nodes[nid].cert_path, "rb") as c_hdlr:
+        chain = c_hdlr.read()
+    if pki.nodes[nid].issuer != nid:
+        chain += _chain(pki, pki.nodes[nid].issuer, bundles)
+    if pki.nodes[nid].ntype == "ca":
+        bundles[nid] = chain
+    return chain
+
+def _keystore(node, format, bundles):
+    """Write a node's PEM keystore, return its node id and the openssl command packaging it, if any."""
     if format in ["p12", "pkcs12"]:
-        cmd  = "cat"
-        cmd += " {0}".format(node.key_path)
-        for nid in node.pki.trust_chain(node.nid):
-            cmd += " {0}".format(node.pki.nodes[nid].cert_path)
-        cmd += " > {0}/{1}.keystore".format(node.pki.path["certs"], node.nid)
-        print("\t`-> [info] " + cmd)
-        if call(cmd, shell=True):
-            print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+        events.emit("info", "Writing {0}/{1}.keystore".format(node.pki.path["certs"], node.nid), node.nid, "keystore")
+        out = "{0}/{1}.keystore".format(node.pki.path["certs"], node.nid)
+        # Replaced rather than truncated, never write through a hardlink
+        with open(node.key_path, "rb") as k_hdlr, open(out + ".tmp", "wb") as s_hdlr:
+            s_hdlr.write(k_hdlr.read() + _chain(node.pki, node.nid, bundles))
+        os.replace(out + ".tmp", out)
         cmd  = "{0}".format(node.pki.path["openssl"])
         cmd += " pkcs12"
         cmd += " -export"
@@ -382,17 +687,294 @@ def keystore(node, format):
         cmd += " -macalg sha1"
         cmd += " -in {0}/{1}.keystore".format(node.pki.path["certs"], node.nid)
         cmd += " -out {0}/{1}.keystore.p12".format(node.pki.path["certs"], node.nid)
-        print("\t`-> [openssl] " + cmd)
-        if call(cmd.split()):
-            print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
-    elif format in ["cert", "cer", "crt", "pem"]:
-        cmd  = "cat"
-        for nid in node.pki.trust_chain(node.nid):
-            cmd += " {0}".format(node.pki.nodes[nid].cert_path)
-        cmd += " >> {0}/{1}.keystore.cert.pem".format(node.pki.path["certs"], node.nid)
-        print("\t`-> [info] " + cmd)
-        if call(cmd, shell=True):
-            print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+        return node.nid, cmd
+    events.emit("info", "Writing {0}/{1}.keystore.cert.pem".format(node.pki.path["certs"], node.nid), node.nid, "keystore")
+    out = "{0}/{1}.keystore.cert.pem".format(node.pki.path["certs"], node.nid)
+    with open(out + ".tmp", "wb") as s_hdlr:
+        s_hdlr.write(_chain(node.pki, node.nid, bundles))
+    os.replace(out + ".tmp", out)
+    return node.nid, None
+
+def _package(nid, cmd):
+    """Run a node's keystore packaging command, return True on success."""
+    return not events.call(cmd.split(), nid, "keystore")
+
+def keystore(node, format):
+    """Generate a keystore.
+
+    node   -- a Node object
+    format -- string, the format of the keystore, must be one of "p12", "pkcs12", "cert", "cert", "crt", "pem"
+
+    Creates a keystore of the specified format (p12 or .cert.pem). The key and
+    trust chain are concatenated in process, the keystore file is overwritten.
+    Returns True on success.
+    """
+    if not format in ["p12", "pkcs12", "cert", "cer", "crt", "pem"]:
+        events.emit("warning", "Format currently not supported: {0}".format(str(format)), None, "keystore")
+        return False
+    nid, cmd = _keystore(node, format, {})
+    return _package(nid, cmd) if cmd else True
+
+def keystores(pki, format, selection=None, workers=None):
+    """Generate keystores in bulk.
+
+    pki       -- a PKI object
+    format    -- string, the format of the keystores, see keystore
+    selection -- nodes to generate a keystore for, see _selection (default None,
+                 every node with a certificate)
+    workers   -- number of parallel openssl pkcs12 processes (default None, the
+                 number of processors)
+
+    The chain bundle of each CA is read once and shared by every node it
+    issued. PEM keystores are written in process, p12 packaging runs on a
+    pool of workers, for the nodes with a key. Returns True if every keystore
+    was generated.
+    """
+    if not format in ["p12", "pkcs12", "cert", "cer", "crt", "pem"]:
+        events.emit("warning", "Format currently not supported: {0}".format(str(format)), None, "keystore")
+        return False
+    events.emit("stage", "Generating {0} keystores for {1}...".format(format, pki.id), None, "keystore")
+    bundles = {}
+    keyed   = format in ["p12", "pkcs12"]
+    jobs    = [_keystore(pki.nodes[nid], format, bundles) for nid in _selection(pki, selection)
+               if pki.nodes[nid].cert_path and (pki.nodes[nid].key_path or not keyed)]
+    if keyed:
+        with events.bulk(len(jobs)), ThreadPoolExecutor(workers if workers else os.cpu_count()) as pool:
+            return all(pool.map(_package, [nid for nid, cmd in jobs], [cmd for nid, cmd in jobs]))
+    return True
+
+def _exported(node, kind):
+    """Return the path of a node artifact to export, None if there is none."""
+    if kind in ["p12", "p12.txt"]:
+        # node.p12_path is the .p12.txt companion when there is one
+        path = node.p12_path[:-4] if node.p12_path and node.p12_path.endswith(".txt") else node.p12_path
+        return path if kind == "p12" else path + ".txt" if path and os.path.isfile(path + ".txt") else None
+    return getattr(node, "{0}_path".format(kind))
+
+def export(pki, dest, format="tar", selection=None, kinds=None, compression=None, chunk_size=2**20):
+    """Export a pki to an archive in a single pass.
+
+    pki         -- a PKI object
+    dest        -- archive file path or writable file object (a pipe, a socket...)
+    format      -- string, "tar" or "zip" (default "tar")
+    selection   -- nodes to export, see _selection (default None, the whole work
+                   directory: artifacts, .old crls, hash links, index, state...)
+    kinds       -- list of node artifacts to export when there is a selection,
+                   any of "key", "csr", "cert", "crl", "p12" (default all) and
+                   "p12.txt", the plaintext companion of the p12 file holding
+                   the private key (see gen.pkcs12), only when listed
+    compression -- None, "gz", "bz2" or "xz" for tar, None or "deflate" for zip
+                   (default None)
+    chunk_size  -- write size in bytes (default 1MiB)
+
+    Files are streamed from the work directory into the archive, nothing is
+    staged on disk. Archive members are named <pki.id>/<path in wdir>.
+    Returns the number of members written, False if the format is not
+    supported.
+    """
+    if not format in ["tar", "zip"]:
+        events.emit("warning", "Format currently not supported: {0}".format(str(format)), None, "export")
+        return False
+    events.emit("stage", "Exporting {0} to {1}...".format(pki.id, dest), None, "export")
+    if selection is None:
+        paths = (os.path.join(root, name) for root, dirs, files in os.walk(pki.path["wdir"]) for name in sorted(files))
     else:
-        print("\t/!\ [info]\t\tFormat currently not supported: {0}".format(str(format)))
-        
\ No newline at end of file
+        kinds = kinds if kinds else ["key", "csr", "cert", "crl", "p12"]
+        paths = (path for nid in _selection(pki, selection) for kind in kinds for path in [_exported(pki.nodes[nid], kind)] if path)
+
+    count = 0
+    if format == "zip":
+        archive = zipfile.ZipFile(dest, "w", zipfile.ZIP_DEFLATED if compression else zipfile.ZIP_STORED, allowZip64=True)
+    else:
+        mode    = "w|{0}".format(compression if compression else "")
+        archive = tarfile.open(dest, mode, bufsize=chunk_size) if isinstance(dest, str) else tarfile.open(fileobj=dest, mode=mode, bufsize=chunk_size)
+    with archive:
+        for path in paths:
+            arcname = os.path.join(pki.id, os.path.relpath(path, pki.path["wdir"]))
+            # Links within the work directory (cert hashes) are made relative
+            link    = os.readlink(path) if os.path.islink(path) else None
+            link    = os.path.relpath(link, os.path.dirname(path)) if link and link.startswith(pki.path["wdir"]) else link
+            if format != "zip" and link:
+                info = archive.gettarinfo(path, arcname)
+                info.linkname = link
+                archive.addfile(info)
+            elif format != "zip":
+                archive.add(path, arcname, recursive=False)
+            elif link:
+                # Info-ZIP symbolic link convention
+                info = zipfile.ZipInfo(arcname, time.localtime(os.lstat(path).st_mtime)[:6])
+                info.external_attr = 0o120777 << 16
+                archive.writestr(info, link)
+            else:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                info.compress_type = archive.compression
+                with open(path, "rb") as src, archive.open(info, "w", force_zip64=True) as dst:
+                    for chunk in iter(lambda: src.read(chunk_size), b""):
+                        dst.write(chunk)
+            count += 1
+    events.emit("info", "{0} files exported".format(count), None, "export")
+    return count
+
+def convert(pki, kinds=None, outform="der", selection=None):
+    """Convert the files of a whole pki in a single pass.
+
+    pki       -- a PKI object
+    kinds     -- list of files to convert, any of "key", "csr", "cert", "crl"
+                 (default all)
+    outform   -- string, output format, must be in FORMATS (default "der")
+    selection -- nodes to convert, see _selection (default None, every node)
+
+    csrs, certs and crls are converted in process, keys through openssl (see
+    gen.keyform).
+    """
+    events.emit("stage", "Converting {0} to {1}...".format(pki.id, outform), None, "convert")
+    kinds = kinds if kinds else ["key", "csr", "cert", "crl"]
+    forms = { "key" : gen.keyform, "csr" : gen.csrform, "cert" : gen.certform, "crl" : gen.crlform }
+    for nid in _selection(pki, selection):
+        for kind in kinds:
+            if getattr(pki.nodes[nid], "{0}_path".format(kind)):
+                forms[kind](pki.nodes[nid], outform)
+
+def _artifacts(pki, node):
+    """Return the paths gen writes the files of a node to { kind: path }."""
+    return { "key"     : "{0}/{1}.{2}key.pem".format(pki.path[".keys"], node.nid, "ecc." if node.curve_name else ""),
+             "csr"     : "{0}/{1}.csr.pem".format(pki.path["csrs"], node.nid),
+             "cert"    : "{0}/{1}.cert.pem".format(pki.path["certs"], node.nid),
+             "crl"     : "{0}/{1}.crl.pem".format(pki.path["crls"], node.nid),
+             "p12"     : "{0}/{1}.p12".format(pki.path["certs"], node.nid),
+             "p12.txt" : "{0}/{1}.p12.txt".format(pki.path["certs"], node.nid) }
+
+def _rules(pki, node, fragment, pkcs12):
+    """Return the build rules of a node, a list of (kind, target, dependencies, command).
+
+    Commands are those of gen, paths are absolute and quoted for a shell,
+    openssl is left as a "{openssl}" placeholder.
+    """
+    path   = lambda kind, nid=node.nid: os.path.abspath(_artifacts(pki, pki.nodes[nid])[kind])
+    quote  = lambda *items: [shlex.quote(str(item)) for item in items]
+    config = os.path.abspath(pki.path["config.cnf"])
+    issuer = pki.nodes[node.issuer]
+    rules  = []
+
+    if node.curve_name in EDDSA:
+        cmd = "{{openssl}} genpkey -algorithm {0} -out {1} -outform pem".format(node.curve_name, *quote(path("key")))
+    elif node.curve_name:
+        cmd = "{{openssl}} ecparam -name {0} -genkey -out {1}".format(node.curve_name, *quote(path("key")))
+    else:
+        cmd = "{{openssl}} genpkey -algorithm rsa -pkeyopt rsa_keygen_bits:{0} -out {1} -outform pem".format(node.key_len, *quote(path("key")))
+    rules.append(("key", path("key"), [], cmd))
+
+    cmd  = "{openssl} req -new"
+    cmd += " -{0}".format(node.csr_digest) if not node.curve_name in EDDSA else ""
+    cmd += " -key {0} -keyform pem -subj {1} -out {2} -outform pem -config {3}".format(*quote(path("key"), node.subj, path("csr"), config))
+    rules.append(("csr", path("csr"), [path("key"), fragment, config], cmd))
+
+    # Serials are left to openssl, random, so that certs can be signed in parallel
+    cmd = "{{openssl}} x509 -req -in {0} -inform pem".format(*quote(path("csr")))
+    if node.nid == node.issuer:
+        cmd  += " -signkey {0} -keyform pem".format(*quote(path("key")))
+        after = [path("csr"), fragment]
+    else:
+        cmd  += " -CA {0} -CAform pem -CAkey {1} -CAkeyform pem".format(*quote(path("cert", issuer.nid), path("key", issuer.nid)))
+        after = [path("csr"), fragment, path("cert", issuer.nid), path("key", issuer.nid)]
+    cmd += " -{0}".format(node.cert_digest) if not issuer.curve_name in EDDSA else ""
+    cmd += " -days {0} -extfile {1} -extensions {2}_ext -out {3} -outform pem".format(node.life, *quote(fragment, node.nid, path("cert")))
+    rules.append(("cert", path("cert"), after, cmd))
+
+    # Users and CAs with pathlen 0 have no crl, see gen.crl
+    if node.ntype == "ca" and node.pathlen != 0:
+        cmd  = "{{openssl}} ca -gencrl -cert {0} -keyfile {1} -crldays {2}".format(*quote(path("cert"), path("key"), node.crl_life))
+        cmd += " -out {0} -config {1} -crlexts crl_ext".format(*quote(path("crl"), config))
+        rules.append(("crl", path("crl"), [path("cert"), path("key"), config, os.path.abspath(pki.path["index"])], cmd))
+
+    if pkcs12:
+        cmd  = "{{openssl}} pkcs12 -export -password pass: -in {0} -inkey {1} -certfile {0}".format(*quote(path("cert"), path("key")))
+        cmd += " -name {0} -macalg sha1 -out {1}".format(*quote(node.nid, path("p12")))
+        rules.append(("p12", path("p12"), [path("cert"), path("key")], cmd))
+        # The .p12.txt companion, as written by gen.pkcs12
+        bag  = "printf 'Bag Attributes\\n    friendlyName: %s\\n' {0}".format(*quote(node.nid))
+        cmd  = "({0}; cat {1}; {0}; cat {2}) > {3}".format(bag, *quote(path("cert"), path("key"), path("p12.txt")))
+        rules.append(("p12.txt", path("p12.txt"), [path("cert"), path("key")], cmd))
+    return rules
+
+def export_build(pki, format="ninja", dest=None, pkcs12=False, selection=None):
+    """Export the generation of a pki as a ninja or make build file.
+
+    pki       -- a PKI object
+    format    -- string, "ninja" or "make" (default "ninja")
+    dest      -- build file path (default pki.path["wdir"]/build.ninja or
+                 pki.path["wdir"]/Makefile)
+    pkcs12    -- boolean, also build p12 files and their .p12.txt companions
+                 (default False)
+    selection -- nodes to build, see _selection (default None, every node),
+                 the issuers of the selection must already be generated if
+                 they are left out
+
+    Every key, csr, cert, crl and p12 file is a target of its own, built
+    with the openssl command gen would run, at the path gen would write it
+    to. A cert depends on its csr, on the cert and key of its issuer and on
+    the node's config fragment, pki.path["wdir"]/build/<nid>.cnf, holding
+    its extensions section (see gen.extensions) and the parameters of its
+    csr and cert. Fragments are only rewritten when the node changed, so
+    that exporting again and running the build only regenerates what
+    changed and what depends on it:
+
+        tiny.do.export_build(pki, "ninja")
+        ninja -f instances/<pki.id>/build.ninja -j 64
+
+    Ninja also rebuilds targets whose command changed, make only goes by
+    timestamps: keys are never regenerated by make unless removed. Crls
+    depend on pki.path["index"] and are regenerated after revocations. Cert
+    serials are random, chosen by openssl, pki.cache and pki.reservoir are
+    not used and the pki state is not updated by the build.
+
+    Returns the build file path, or None if the format is not supported.
+    """
+    if not format in ["ninja", "make"]:
+        events.emit("warning", "Format currently not supported: {0}".format(str(format)), None, "build")
+        return None
+    events.emit("stage", "Exporting {0} build of {1}...".format(format, pki.id), None, "build")
+    gen.env(pki)
+    fragments = os.path.join(pki.path["wdir"], "build")
+    if not os.path.exists(fragments):
+        os.makedirs(fragments)
+    dest = dest if dest else os.path.join(pki.path["wdir"], "build.ninja" if format == "ninja" else "Makefile")
+
+    rules = []
+    for nid in _ordered(pki, _selection(pki, selection)):
+        node     = pki.nodes[nid]
+        fragment = os.path.abspath(os.path.join(fragments, "{0}.cnf".format(nid)))
+        template  = "# {0} csr and cert parameters, written by do.export_build\n".format(nid)
+        template += "# subj        = {0}\n".format(node.subj)
+        template += "# issuer      = {0}\n".format(node.issuer)
+        template += "# csr_digest  = {0}\n".format(node.csr_digest)
+        template += "# cert_digest = {0}\n".format(node.cert_digest)
+        template += "# life        = {0}\n\n".format(node.life)
+        template += gen.extensions(node)
+        # Unchanged fragments keep their timestamp
+        if not os.path.isfile(fragment) or open(fragment, "r").read() != template:
+            with open(fragment, "w") as f_hdlr:
+                f_hdlr.write(template)
+        rules += _rules(pki, node, fragment, pkcs12)
+
+    openssl = os.path.abspath(pki.path["openssl"])
+    with open(dest, "w") as b_hdlr:
+        b_hdlr.write("# {0} build of pki {1}, written by tinypyki do.export_build\n\n".format(format, pki.id))
+        if format == "ninja":
+            escape = lambda path: path.replace("$", "$$").replace(" ", "$ ").replace(":", "$:")
+            b_hdlr.write("openssl = {0}\n\n".format(openssl.replace("$", "$$")))
+            for kind in ["key", "csr", "cert", "crl", "p12", "p12.txt"]:
+                b_hdlr.write("rule {0}\n  command = $cmd\n  description = {1} $out\n\n".format(kind.replace(".", "_"), kind))
+            for kind, target, after, cmd in rules:
+                b_hdlr.write("build {0}: {1}{2}\n".format(escape(target), kind.replace(".", "_"), "".join(" " + escape(path) for path in after)))
+                b_hdlr.write("  cmd = {0}\n\n".format(cmd.replace("$", "$$").replace("{openssl}", "$openssl")))
+            b_hdlr.write("build all: phony{0}\n\ndefault all\n".format("".join(" " + escape(rule[1]) for rule in rules)))
+        else:
+            escape = lambda path: path.replace("$", "$$").replace(" ", "\\ ")
+            b_hdlr.write("OPENSSL = {0}\n\n.DELETE_ON_ERROR:\n\n.PHONY: all\n\n".format(openssl.replace("$", "$$")))
+            b_hdlr.write("all:{0}\n\n".format("".join(" \\\n    " + escape(rule[1]) for rule in rules)))
+            for kind, target, after, cmd in rules:
+                b_hdlr.write("{0}:{1}\n\t{2}\n\n".format(escape(target), "".join(" " + escape(path) for path in after),
+                                                       cmd.replace("$", "$$").replace("{openssl}", "$(OPENSSL)")))
+    events.emit("info", "{0} targets written to {1}".format(len(rules), dest), None, "build")
+    return dest
@@ -0,0 +1,214 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Structured progress and outcome events.
+
+tinypyki functions report what they do through emit() rather than print.
+Each Event is dispatched to the subscribers, by default the printer which
+writes the familiar "~~>", "`-> [openssl]" and "/!\ [WARNING]" lines:
+
+    tiny.events.quiet()                               # no output at all
+    tiny.events.subscribe(tiny.events.logger())       # python logging
+    tiny.events.subscribe(tiny.events.jsonl("run.jsonl"))
+
+Event kinds:
+
+stage     -- a do.* stage or operation starts, "~~>" lines
+text      -- plain text, e.g. show output
+openssl   -- a command is about to run, cmd holds it
+exit      -- a command ran, with its exit code and duration in seconds
+cache     -- an artifact was served from pki.cache
+reservoir -- a key was claimed from pki.reservoir
+convert   -- a file was converted in process
+info      -- anything else worth knowing
+warning   -- something went wrong
+
+Emitting without subscribers costs a function call. Printing costs a
+terminal write per line, several per node, so bulk runs (stages of BULK
+nodes or more, see bulk) are only printed their stage lines, warnings and
+failures, unless verbose() was called. Silence them altogether with quiet().
+
+The stderr of commands is always captured: that of a failed command is the
+message of its exit event, printed above the failure line. Their stdout
+goes to the terminal with the printer, e.g. openssl verify's "OK".
+"""
+
+import contextlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+from .macros import *
+from .       import metrics
+
+# A tinypyki event, fields not relevant to its kind are None
+Event = namedtuple("Event", ["kind", "message", "nid", "stage", "cmd", "code", "seconds", "time"])
+
+# Stages run by background threads, e.g. reservoir refills: the printer only
+# prints their warnings, the logger logs the rest as debug
+BACKGROUND = ["reservoir"]
+
+# Message of failed commands, for the printer
+FAILURE = "Well, clearly something went wrong when calling, investigate the error message above."
+
+def text(event):
+    """Return the printer line of an event, None if it has none."""
+    if event.kind == "stage":
+        return "~~> " + event.message
+    if event.kind == "text":
+        return event.message
+    if event.kind == "warning":
+        return "\t/!\ [WARNING]\t\t" + event.message
+    if event.kind == "exit":
+        return "\t/!\ [WARNING]\t\t" + FAILURE if event.code else None
+    return "\t`-> [{0}] {1}".format(event.kind, event.message)
+
+def printer(event):
+    """Print events, the default subscriber, see bulk and BACKGROUND."""
+    if event.stage in BACKGROUND and event.kind != "warning":
+        return
+    if _bulk and not _verbose and not event.kind in ["stage", "warning", "exit"]:
+        return
+    line = text(event)
+    if line is not None:
+        if event.kind == "exit" and event.message:
+            print(event.message)
+        print(line)
+
+def logger(name="tinypyki"):
+    """Return a subscriber logging events.
+
+    name -- logger name (default "tinypyki")
+
+    Warnings and failed commands are logged as warnings, command exits and
+    the events of BACKGROUND stages as debug and everything else as info.
+    """
+    log = logging.getLogger(name)
+    def subscriber(event):
+        if event.kind == "warning" or event.kind == "exit" and event.code:
+            log.warning("%s", event.message if event.kind == "warning" else "{0} exited with {1}: {2}".format(event.cmd, event.code, event.message))
+        elif event.stage in BACKGROUND:
+            log.debug("%s", text(event).strip() if event.kind != "exit" else "{0} exited with {1}".format(event.cmd, event.code))
+        elif event.kind == "exit":
+            log.debug("%s exited with %s in %.3fs", event.cmd, event.code, event.seconds)
+        else:
+            log.info("%s", text(event).strip())
+    return subscriber
+
+def jsonl(dest):
+    """Return a subscriber writing events as JSON lines.
+
+    dest -- a file path, appended to, or a file object
+    """
+    handle = open(dest, "a") if isinstance(dest, str) else dest
+    lock   = threading.Lock()
+    def subscriber(event):
+        line = json.dumps(event._asdict())
+        with lock:
+            handle.write(line + "\n")
+            handle.flush()
+    return subscriber
+
+# Event subscribers, called in order
+_subscribers = [printer]
+
+# Number of nodes from which a stage is a bulk run, see bulk
+BULK = 64
+
+# Bulk runs in progress, and whether the printer prints them in full
+_bulk     = 0
+_verbose  = False
+_counting = threading.Lock()
+
+def subscribe(subscriber):
+    """Add a subscriber, a callable taking an Event."""
+    if not subscriber in _subscribers:
+        _subscribers.append(subscriber)
+
+def unsubscribe(subscriber):
+    """Remove a subscriber."""
+    if subscriber in _subscribers:
+        _subscribers.remove(subscriber)
+
+def quiet():
+    """Remove every subscriber, printer included."""
+    del _subscribers[:]
+
+def reset():
+    """Restore the printer as the only subscriber, in its default verbosity."""
+    _subscribers[:] = [printer]
+    verbose(False)
+
+def verbose(enabled=True):
+    """Have the printer print bulk runs in full (default, only their stage
+    lines, warnings and failures)."""
+    global _verbose
+    _verbose = bool(enabled)
+
+@contextlib.contextmanager
+def bulk(count):
+    """Context manager for an operation on count nodes, a bulk run from BULK
+    nodes on: the printer only prints its stage lines, warnings and failures
+    meanwhile, unless verbose() was called. Other subscribers get every event.
+    """
+    global _bulk
+    if count < BULK:
+        yield
+        return
+    with _counting:
+        _bulk += 1
+    try:
+        yield
+    finally:
+        with _counting:
+            _bulk -= 1
+
+def emit(kind, message="", nid=None, stage=None, cmd=None, code=None, seconds=None):
+    """Dispatch an event to the subscribers.
+
+    kind    -- event kind, see above
+    message -- human readable message (default "")
+    nid     -- node id concerned (default None)
+    stage   -- operation, e.g. "key", "csr", "cert", "crl", "p12" (default None)
+    cmd     -- command line (default None)
+    code    -- command exit code (default None)
+    seconds -- command duration (default None)
+    """
+    if not _subscribers:
+        return
+    event = Event(kind, message, nid, stage, cmd, code, seconds, time.time())
+    for subscriber in list(_subscribers):
+        subscriber(event)
+
+def call(args, nid=None, stage=None, tool="openssl", **kwargs):
+    """Run a command, emit its events and return its exit code.
+
+    args  -- list of arguments, or a string with shell=True
+    nid   -- node id concerned (default None)
+    stage -- operation (default None)
+    tool  -- kind of the event emitted before running (default "openssl")
+
+    Extra keyword arguments are passed to subprocess.
+    """
+    cmd = args if isinstance(args, str) else " ".join(args)
+    emit(tool, cmd, nid, stage, cmd)
+    start = time.perf_counter()
+    stdout  = None if printer in _subscribers else subprocess.DEVNULL
+    proc    = subprocess.Popen(args, stdout=stdout, stderr=subprocess.PIPE, **kwargs)
+    spawned = time.perf_counter()
+    output  = proc.stderr.read().decode("utf-8", "replace").strip()
+    # Reap the child ourselves for its resource usage, see tinypyki.metrics
+    pid, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    proc.stderr.close()
+    seconds = time.perf_counter() - start
+    metrics.spawn(stage, spawned - start, seconds, usage.ru_utime + usage.ru_stime)
+    emit("exit", output, nid, stage, cmd, code, seconds)
+    return code
@@ -12,10 +12,11 @@ get an idea of the options used and improve on them.
 
 import os
 import pickle
-from subprocess import call
 
 from .macros import *
+from .       import convert, events, metrics
 
+@metrics.timed("gen.env")
 def env(pki):
     """Generates the environment for a pki instance.
 
@@ -42,7 +43,7 @@ def env(pki):
     automation reasons, the bare minimum is specified in the config files and
     everything revolves around the flexibility allowed by command line options.
     """
-    print("Generating environment for {0}...".format(pki.id))
+    events.emit("text", "Generating environment for {0}...".format(pki.id))
     # Create working directory 
     if not os.path.exists(pki.path["wdir"]):
         os.makedirs(pki.path["wdir"])
@@ -174,18 +175,57 @@ def env(pki):
     if not os.path.isfile(pki.path["state"]):
         open(pki.path["state"], "a").close()
 
-def save(pki):
+@metrics.timed("gen.save")
+def save(pki, index=True):
     """Save pki state on disk.
 
-    pki -- a PKI object
+    pki   -- a PKI object
+    index -- boolean, also save the metadata index (default True)
 
-    Pickle the pki object in the pki.path["state"] file for later reuse.
+    Pickle the pki object in the pki.path["state"] file for later reuse, and
+    its metadata index in the pki.path["meta"] file if it changed, see
+    save_index.
     """
-    print("Saving pki instance {0}...".format(pki.id))
+    events.emit("text", "Saving pki instance {0}...".format(pki.id))
     with open(pki.path["state"], "wb") as p_hdlr:
         pickle.dump(pki, p_hdlr)
         p_hdlr.close()
+    if index:
+        save_index(pki)
+
+def save_index(pki):
+    """Save the metadata index of a pki in the pki.path["meta"] file if it changed.
+
+    gen.cert and gen.crl leave it unsaved, it is saved once per stage by
+    costs.schedule rather than re-pickled after every node.
+    """
+    if pki._meta is not None and pki._meta.dirty:
+        pki._meta.save(pki.path["meta"])
+
+def _call(node, kind, args, out, serial=None):
+    """Run an openssl command, or serve its output file from pki.cache.
+
+    Keys are claimed from pki.reservoir, if any, before being generated.
+    Returns the command's return code (0 on a cache hit or a claimed key).
+    See tinypyki.cache, tinypyki.reservoir and tinypyki.events.
+    """
+    # Never write through a hardlink shared with a cloned pki (see PKI.clone)
+    if os.path.isfile(out) and os.stat(out).st_nlink > 1:
+        os.remove(out)
+    digest = node.pki.cache.digest(node, kind, serial) if node.pki.cache else None
+    if digest and node.pki.cache.fetch(digest, out):
+        events.emit("cache", out, node.nid, kind)
+        return 0
+    if kind == "key" and node.pki.reservoir and node.pki.reservoir.claim(node, out):
+        events.emit("reservoir", out, node.nid, kind)
+        ret = 0
+    else:
+        ret = events.call(args, node.nid, kind)
+    if digest and not ret:
+        node.pki.cache.store(digest, out)
+    return ret
 
+@metrics.timed("gen.key")
 def key(node, state=True):
     """Generate an RSA key file.
 
@@ -195,6 +235,7 @@ def key(node, state=True):
     This function builds the relevant command for creating an RSA key.
 
     If successfully created, it sets the node's internal status to "csr".
+    Returns True on success.
 
     Since there are limitations in handling .der file formats, the manipulated
     key is in .pem format. See gen.keyform for format conversion.
@@ -205,19 +246,18 @@ def key(node, state=True):
     cmd += " -out {0}/{1}.key.pem".format(node.pki.path[".keys"], node.nid)
     cmd += " -outform pem"
 
-    print("\t`-> [openssl] " + cmd)
-
-    if not call(cmd.split()):
+    done = not _call(node, "key", cmd.split(), "{0}/{1}.key.pem".format(node.pki.path[".keys"], node.nid))
+    if done:
         node.key_path = "{0}/{1}.key.pem".format(node.pki.path[".keys"], node.nid)
         node._status = "csr"
-    else:
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
 
     if state:
       save(node.pki)
+    return done
 
+@metrics.timed("gen.keyform")
 def keyform(node, outform):
-    """Format conversion of RSA key files.
+    """Format conversion of RSA and ECC key files.
 
     node    -- a Node object
     outform -- string, output format, must be in FORMATS
@@ -225,22 +265,76 @@ def keyform(node, outform):
     Typically used for for converting .pem RSA key files to .der.
     
     It assumes inform is pem, swap pem and der if you wish to do the reverse
-    operation.  
+    operation. Returns True on success.
     """
     if not outform in FORMATS:
-        return
+        return False
 
-    cmd  = "{0} rsa".format(node.pki.path["openssl"])
+    cmd  = "{0} {1}".format(node.pki.path["openssl"], "rsa" if not node.curve_name else "pkey" if node.curve_name in EDDSA else "ec")
     cmd += " -in {0}".format(node.key_path)
     cmd += " -inform pem"
     cmd += " -out {0}".format(".".join(node.key_path.split(".")[:-1]) + ".{0}".format(outform))
     cmd += " -outform {0}".format(outform)
 
-    print("\t`-> [openssl] " + cmd)
+    return not events.call(cmd.split(), node.nid, "key")
+
+def extensions(node):
+    """Return the openssl configuration section of a node's cert extensions.
 
-    if call(cmd.split()):
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+    node -- a Node object
 
+    The section is named after the node, "[ <nid>_ext ]", followed by its
+    subject alternative names section if any. gen.csr appends it to
+    pki.path["sans"], see also do.export_build.
+    """
+    template  = "[ {0}_ext ]\n\n".format(node.nid)
+    template += "basicConstraints       =  critical,CA:{0},pathlen:{1}\n".format("TRUE" if node.ntype == "ca" else "FALSE",node.pathlen)
+    #  digitalSignature, nonRepudiation, keyEncipherment, dataEncipherment, keyAgreement, keyCertSign, cRLSign, encipherOnly and decipherOnly
+    #  serverAuth             SSL/TLS Web Server Authentication.
+    #  clientAuth             SSL/TLS Web Client Authentication.
+    #  codeSigning            Code signing.
+    #  emailProtection        E-mail Protection (S/MIME).
+    #  timeStamping           Trusted Timestamping
+    #  msCodeInd              Microsoft Individual Code Signing (authenticode)
+    #  msCodeCom              Microsoft Commercial Code Signing (authenticode)
+    #  msCTLSign              Microsoft Trust List Signing
+    #  msSGC                  Microsoft Server Gated Crypto
+    #  msEFS                  Microsoft Encrypted File System
+    #  nsSGC  
+    # extendedKeyUsage=critical,codeSigning,1.2.3.4          
+    template += "keyUsage               =  {0}\n".format("cRLSign,keyCertSign" if node.ntype == "ca" else "nonRepudiation,digitalSignature,keyEncipherment")
+    template += "subjectKeyIdentifier   =  hash\n"
+    if node.nid != node.issuer:
+      template += "issuerAltName          =  issuer:copy\n"
+      # template += "authorityKeyIdentifer  =  keyid,issuer\n"
+    if node.crl_dps:
+      template += "crlDistributionPoints  =  {0}\n".format(",".join(["URI:" + uri for uri in node.crl_dps.lower().replace(" ", "").split(",")]))
+      events.emit("info", "working on node: " + node.subj, node.nid, "csr")
+    if node.ocsp_uri:
+      template += "authorityInfoAccess  =  OCSP;{0}\n".format(",".join(["URI:" + uri for uri in node.ocsp_uri.lower().replace(" ","").split(",")]))
+    if node.san:
+      ip_idx = dns_idx = uri_idx = email_idx = 1
+      template          += "subjectAltName         =  @{0}_san\n".format(node.nid)
+      template          += "\n[ {0}_san ]\n\n".format(node.nid)
+      for altname in node.san.lower().replace(" ","").split(","):
+        if altname.startswith("ip"):
+          template  += "IP.{0:<10} = {1}\n".format(ip_idx, altname.split("=")[-1].strip())
+          ip_idx    += 1
+        elif altname.startswith("dns"):
+          template  += "DNS.{0:<9} = {1}\n".format(dns_idx, altname.split("=")[-1].strip())
+          dns_idx   += 1
+        elif altname.startswith("email"):
+          template  += "email.{0:<7} = {1}\n".format(email_idx, altname.split("=")[-1].strip())
+          email_idx += 1
+        elif altname.startswith("uri"):
+          template  += "URI.{0:<9} = {1}\n".format(uri_idx, altname.split("=")[-1].strip())
+          uri_idx   += 1
+        else:
+          events.emit("warning", "Skipping subject alternative name argument: {0}".format(altname), node.nid, "csr")
+    template              += "\n"
+    return template
+
+@metrics.timed("gen.csr")
 def csr(node, state=True, verbose=False):
     """Generate a certificate signing request file.
 
@@ -252,6 +346,7 @@ def csr(node, state=True, verbose=False):
     The relevant keyfile must exist.
     
     If successfully created, it sets the node's internal status to "cert".
+    Returns True on success.
 
     Since there are limitations in handling .der file formats, the manipulated
     csr is in .pem format. See gen.csrform for format conversion.
@@ -260,58 +355,15 @@ def csr(node, state=True, verbose=False):
     # question: we only need to change sans when adding or modifying a node, this  is used for the csr generation and as such should be performed in csr()
     with open(node.pki.path["sans"], "a") as san_hdlr:
       if node._status == "csr" :
-        template  = "[ {0}_ext ]\n\n".format(node.nid)
-        template += "basicConstraints       =  critical,CA:{0},pathlen:{1}\n".format("TRUE" if node.ntype == "ca" else "FALSE",node.pathlen)
-        #  digitalSignature, nonRepudiation, keyEncipherment, dataEncipherment, keyAgreement, keyCertSign, cRLSign, encipherOnly and decipherOnly
-        #  serverAuth             SSL/TLS Web Server Authentication.
-        #  clientAuth             SSL/TLS Web Client Authentication.
-        #  codeSigning            Code signing.
-        #  emailProtection        E-mail Protection (S/MIME).
-        #  timeStamping           Trusted Timestamping
-        #  msCodeInd              Microsoft Individual Code Signing (authenticode)
-        #  msCodeCom              Microsoft Commercial Code Signing (authenticode)
-        #  msCTLSign              Microsoft Trust List Signing
-        #  msSGC                  Microsoft Server Gated Crypto
-        #  msEFS                  Microsoft Encrypted File System
-        #  nsSGC  
-        # extendedKeyUsage=critical,codeSigning,1.2.3.4          
-        template += "keyUsage               =  {0}\n".format("cRLSign,keyCertSign" if node.ntype == "ca" else "nonRepudiation,digitalSignature,keyEncipherment")
-        template += "subjectKeyIdentifier   =  hash\n"
-        if node.nid != node.issuer:
-          template += "issuerAltName          =  issuer:copy\n"
-          # template += "authorityKeyIdentifer  =  keyid,issuer\n"
-        if node.crl_dps:
-          template += "crlDistributionPoints  =  {0}\n".format(",".join(["URI:" + uri for uri in node.crl_dps.lower().replace(" ", "").split(",")]))
-          print("working on node: "+ node.subj)
-        if node.ocsp_uri:
-          template += "authorityInfoAccess  =  OCSP;{0}\n".format(",".join(["URI:" + uri for uri in node.ocsp_uri.lower().replace(" ","").split(",")]))
-        if node.san:
-          ip_idx = dns_idx = uri_idx = email_idx = 1
-          template          += "subjectAltName         =  @{0}_san\n".format(node.nid)
-          template          += "\n[ {0}_san ]\n\n".format(node.nid)
-          for altname in node.san.lower().replace(" ","").split(","):
-            if altname.startswith("ip"):
-              template  += "IP.{0:<10} = {1}\n".format(ip_idx, altname.split("=")[-1].strip())
-              ip_idx    += 1
-            elif altname.startswith("dns"):
-              template  += "DNS.{0:<9} = {1}\n".format(dns_idx, altname.split("=")[-1].strip())
-              dns_idx   += 1
-            elif altname.startswith("email"):
-              template  += "email.{0:<7} = {1}\n".format(email_idx, altname.split("=")[-1].strip())
-              email_idx += 1
-            elif altname.startswith("uri"):
-              template  += "URI.{0:<9} = {1}\n".format(uri_idx, altname.split("=")[-1].strip())
-              uri_idx   += 1
-            else:
-              print("\t/!\ [WARNING]\t\tSkipping subject alternative name argument: {0}".format(altname))
-        template              += "\n"
-        san_hdlr.write(template)
+        san_hdlr.write(extensions(node))
         node.san_id = node.nid + "_ext"
       san_hdlr.close()
 
     cmd  = "{0} req".format(node.pki.path["openssl"])
     cmd += " -new"
-    cmd += " -{0}".format(node.csr_digest)
+    # EdDSA signs the whole message, no digest applies
+    if not node.curve_name in EDDSA:
+        cmd += " -{0}".format(node.csr_digest)
     cmd += " -key {0}".format(node.key_path)
     cmd += " -keyform pem"
     cmd += " -subj {0}".format(node.subj)
@@ -321,20 +373,20 @@ def csr(node, state=True, verbose=False):
     if verbose:
         cmd += " -verbose"
 
-    print("\t`-> [openssl] " + cmd)
-
     # Subject might contain white spaces, therefore, ensure the split does not break the command line
-    if not call(cmd.split()[:cmd.split().index("-subj")+1] 
-                + [" ".join(cmd.split()[cmd.split().index("-subj") + 1 : cmd.split().index("-out")])]
-                + cmd.split()[cmd.split().index("-out"):]):
+    done = not _call(node, "csr", cmd.split()[:cmd.split().index("-subj")+1]
+                 + [" ".join(cmd.split()[cmd.split().index("-subj") + 1 : cmd.split().index("-out")])]
+                 + cmd.split()[cmd.split().index("-out"):],
+                 "{0}/{1}.csr.pem".format(node.pki.path["csrs"], node.nid))
+    if done:
         node.csr_path = "{0}/{1}.csr.pem".format(node.pki.path["csrs"], node.nid)
         node._status = "cert"
-    else:
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
 
     if state:
       save(node.pki)
+    return done
 
+@metrics.timed("gen.csrform")
 def csrform(node, outform):
     """Format conversion of csr files.
 
@@ -342,38 +394,39 @@ def csrform(node, outform):
     outform -- string, output format, must be in FORMATS
 
     Typically used for for converting .pem csr files to .der.
-    
-    It assumes inform is pem, swap pem and der if you wish to do the reverse
-    operation.  
+
+    The conversion runs in process, see tinypyki.convert. Returns True on
+    success.
     """
     if not outform in FORMATS:
-        return
+        return False
 
-    cmd  = "{0} req".format(node.pki.path["openssl"])
-    cmd += " -in {0}".format(node.csr_path)
-    cmd += " -inform pem"
-    cmd += " -out {0}".format(".".join(node.csr_path.split(".")[:-1]) + ".{0}".format(outform))
-    cmd += " -outform {0}".format(outform)
+    out = convert.convert(node.csr_path, outform, "csr")
 
-    print("\t`-> [openssl] " + cmd)
+    events.emit("convert", "{0} -> {1}".format(node.csr_path, out), node.nid, "csr")
 
-    if call(cmd.split()):
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+    return out is not None
 
-def cert(node, state=True):
+@metrics.timed("gen.cert")
+def cert(node, state=True, worker=None):
     """Generate certificate file.
 
-    node  -- a Node object
-    state -- boolean, save pki state after creation (default True)
+    node   -- a Node object
+    state  -- boolean, save pki state after creation (default True)
+    worker -- worker id of a serial block reserved through pki.serials
+              (default None, see tinypyki.serials)
 
     This function builds the relevant command for creating a cert file.
     The relevant csr, issuer and PKI files must exist.
     
     If successfully created, it sets the node's internal status to "crl" if it is a "ca", otherwise it sets it to "done".
+    Returns True on success, the serial is given back to pki.serials otherwise.
 
     Since there are limitations in handling .der file formats, the manipulated
     cert is in .pem format. See gen.certform for format conversion. 
     """
+    serial = node.pki.serials.allocate(node.issuer, worker)
+
     cmd  = "{0} x509".format(node.pki.path["openssl"])
     cmd += " -req"
     cmd += " -in {0}".format(node.csr_path)
@@ -387,8 +440,9 @@ def cert(node, state=True):
         cmd += " -CAkey {0}".format(node.pki.nodes[node.issuer].key_path)
         cmd += " -CAkeyform pem"
         # cmd += " -CAserial {0}".format(node.pki.path["serial"])
-    cmd += " -set_serial 0x{0}".format(node.pki.serial)
-    cmd += " -{0}".format(node.cert_digest)
+    cmd += " -set_serial 0x{0:02x}".format(serial)
+    if not node.pki.nodes[node.issuer].curve_name in EDDSA:
+        cmd += " -{0}".format(node.cert_digest)
     cmd += " -days {0}".format(node.life)
     if node.san_id:
         cmd += " -extfile {0}".format(node.pki.path["sans"])
@@ -396,18 +450,19 @@ def cert(node, state=True):
     cmd += " -out {0}/{1}.cert.pem".format(node.pki.path["certs"], node.nid)
     cmd += " -outform pem"
 
-    print("\t`-> [openssl] " + cmd)
-
-    if not call(cmd.split()):
+    done = not _call(node, "cert", cmd.split(), "{0}/{1}.cert.pem".format(node.pki.path["certs"], node.nid), serial)
+    if not done:
+        node.pki.serials.refund(node.issuer, serial, worker)
+    if done:
         node.cert_path = "{0}/{1}.cert.pem".format(node.pki.path["certs"], node.nid)
         node._status = "crl" if node.ntype == "ca" else "done"
-        node.pki.increment()
-    else:
-        print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+        node.pki.meta.update(node)
 
     if state:
-      save(node.pki)
+      save(node.pki, False)
+    return done
 
+@metrics.timed("gen.certform")
 def certform(node, outform):
     """Format conversion of cert files.
 
@@ -415,24 +470,20 @@ def certform(node, outform):
     outform -- string, output format, must be in FORMATS
 
     Typically used for for converting .pem cert files to .der.
-    
-    It assumes inform is pem, swap pem and der if you wish to do the reverse
-    operation.  
+
+    The conversion runs in process, see tinypyki.convert. Returns True on
+    success.
     """
     if not outform in FORMATS:
-        return
+        return False
 
-    cmd  = "{0} x509".format(node.pki.path["openssl"])
-    cmd += " -in {0}".format(node.cert_path)
-    cmd += " -inform pem"
-    cmd += " -out {0}".format(".".join(node.cert_path.split(".")[:-1]) + ".{0}".format(outform))
-    cmd += " -outform {0}".format(outform)
+    out = convert.convert(node.cert_path, outform, "cert")
 
-    print("\t`-> [openssl] " + cmd)
+    events.emit("convert", "{0} -> {1}".format(node.cert_path, out), node.nid, "cert")
 
-    if call(cmd.split()):
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+    return out is not None
 
+@metrics.timed("gen.crl")
 def crl(node, state=True, verbose=False):
     """Generate certificate revocation list file.
 
@@ -443,14 +494,15 @@ def crl(node, state=True, verbose=False):
     This function builds the relevant command for creating crl file.
     
     If successfully created, it sets the node's internal status to "done".
+    Returns True on success, or if the node needs no crl.
 
     Since there are limitations in handling .der file formats, the manipulated
     crl is in .pem format. See gen.crlform for format conversion. 
     """
     if node.ntype == "u" or node.pathlen == 0 and node.ntype == "ca":
         node._status = "done"
-        print("Node {0} does not need a crl: ntype = {1} pathlen = {2} issuer = {3}".format(node.nid, node.ntype, node.pathlen, node.issuer))
-        return
+        events.emit("info", "Node {0} does not need a crl: ntype = {1} pathlen = {2} issuer = {3}".format(node.nid, node.ntype, node.pathlen, node.issuer), node.nid, "crl")
+        return True
 
     cmd  = "{0} ca".format(node.pki.path["openssl"])
     cmd += " -gencrl"
@@ -463,52 +515,53 @@ def crl(node, state=True, verbose=False):
     if verbose:
         cmd += " -verbose"
 
-    print("\t`-> [openssl] " + cmd)
-
     if state and node.crl_path:
         os.rename(node.crl_path, node.crl_path + ".old")
-    if not call(cmd.split()):
+    done = not _call(node, "crl", cmd.split(), "{0}/{1}.crl.pem".format(node.pki.path["crls"], node.nid))
+    if done:
         node.crl_path = "{0}/{1}.crl.pem".format(node.pki.path["crls"], node.nid)
         node._status = "done"
-    else:
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+        node.pki.meta.crl(node)
+
+    if state:
+      save(node.pki, False)
+    return done
 
+@metrics.timed("gen.crlform")
 def crlform(node, outform):
     """Format conversion of crl files.
 
     node    -- a Node object
     outform -- string, output format, must be in FORMATS
 
-    Typically used for for converting .pem crl files to .der. 
-    
-    It assumes inform is pem, swap pem and der if you wish to do the reverse
-    operation.  
+    Typically used for for converting .pem crl files to .der.
+
+    The conversion runs in process, see tinypyki.convert. Returns True on
+    success.
     """
     if not outform in FORMATS:
-        return
+        return False
         
-    cmd  = "{0} crl".format(node.pki.path["openssl"])
-    cmd += " -in {0}".format(node.crl_path)
-    cmd += " -inform pem"   
-    cmd += " -out {0}".format(".".join(node.crl_path.split(".")[:-1]) + ".{0}".format(outform))
-    cmd += " -outform {0}".format(outform)
+    out = convert.convert(node.crl_path, outform, "crl")
 
-    print("\t`-> [openssl] " + cmd)
+    events.emit("convert", "{0} -> {1}".format(node.crl_path, out), node.nid, "crl")
 
-    if call(cmd.split()):
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+    return out is not None
 
-def pkcs12(node):
+@metrics.timed("gen.pkcs12")
+def pkcs12(node, text=True):
     """Generate pkcs12 bundle file.
 
-    node  -- a Node object
-    state -- boolean, save pki state after creation (default True)
+    node -- a Node object
+    text -- boolean, also write the plaintext .p12.txt companion (default True)
 
     This function builds the relevant command for creating a p12 file.
     
     Since the p12 still have a password prompt when handled, a .txt version is
     also built which is the file manipulated through node.p12_path. This is done
-    for automation reasons.
+    for automation reasons. The .txt holds the certificate and key, it is
+    written directly from those files rather than by decoding the p12. Without
+    it, node.p12_path is the .p12 file. Returns True on success.
     """
     cmd  = "{0} pkcs12".format(node.pki.path["openssl"])
     cmd += " -export"
@@ -520,48 +573,56 @@ def pkcs12(node):
     cmd += " -macalg sha1"
     cmd += " -out {0}/{1}.p12".format(node.pki.path["certs"], node.nid)
 
-    print("\t`-> [openssl] " + cmd)
+    if events.call(cmd.split(), node.nid, "p12"):
+        return False
 
-    if call(cmd.split()):
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+    if not text:
+        node.p12_path = "{0}/{1}.p12".format(node.pki.path["certs"], node.nid)
+        return True
 
-    cmd  = "{0} pkcs12".format(node.pki.path["openssl"])
-    cmd += " -in {0}".format("{0}/{1}.p12".format(node.pki.path["certs"], node.nid))
-    cmd += " -nodes"
-    cmd += " -password pass:"
-    cmd += " -out {0}.txt".format("{0}/{1}.p12".format(node.pki.path["certs"], node.nid))
+    events.emit("info", "Writing {0}/{1}.p12.txt".format(node.pki.path["certs"], node.nid), node.nid, "p12")
 
-    print("\t`-> [openssl] " + cmd)
-
-    if not call(cmd.split()):
-        node.p12_path = "{0}.txt".format("{0}/{1}.p12".format(node.pki.path["certs"], node.nid))
-    else:
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+    # Replaced rather than truncated, never write through a hardlink
+    out = "{0}/{1}.p12.txt".format(node.pki.path["certs"], node.nid)
+    with open(node.cert_path, "r") as c_hdlr, open(node.key_path, "r") as k_hdlr, open(out + ".tmp", "w") as t_hdlr:
+        t_hdlr.write("Bag Attributes\n    friendlyName: {0}\n".format(node.nid))
+        t_hdlr.write(c_hdlr.read())
+        t_hdlr.write("Bag Attributes\n    friendlyName: {0}\n".format(node.nid))
+        t_hdlr.write(k_hdlr.read())
+    os.replace(out + ".tmp", out)
+    node.p12_path = "{0}/{1}.p12.txt".format(node.pki.path["certs"], node.nid)
+    return True
 
+@metrics.timed("gen.ecc_key")
 def ecc_key(node, state=True):
     """Generate an ECC key file.
 
     node  -- a Node object
     state -- boolean, save pki state after creation (default True)
 
-    This function builds the relevant command for creating an ECC key.
+    This function builds the relevant command for creating an ECC key, or an
+    EdDSA key if node.curve_name is in EDDSA.
     
-    Since there are limitations in handling .der file formats, the manipulated
-    key is in .pem format.
+    Returns True on success. Since there are limitations in handling .der
+    file formats, the manipulated key is in .pem format.
     """
-    # Generate curve parameter file
-    cmd  = "{0} ecparam".format(node.pki.path["openssl"]) 
-    cmd += " -name {0}".format(node.curve_name)
-    cmd += " -genkey"
-    cmd += " -out {0}/{1}.ecc.key.pem".format(node.pki.path[".keys"], node.nid)
-
-    print("\t`-> [openssl] " + cmd)
-
-    if not call(cmd.split()):
+    if node.curve_name in EDDSA:
+        cmd  = "{0} genpkey".format(node.pki.path["openssl"])
+        cmd += " -algorithm {0}".format(node.curve_name)
+        cmd += " -out {0}/{1}.ecc.key.pem".format(node.pki.path[".keys"], node.nid)
+        cmd += " -outform pem"
+    else:
+        # Generate curve parameter file
+        cmd  = "{0} ecparam".format(node.pki.path["openssl"]) 
+        cmd += " -name {0}".format(node.curve_name)
+        cmd += " -genkey"
+        cmd += " -out {0}/{1}.ecc.key.pem".format(node.pki.path[".keys"], node.nid)
+
+    done = not _call(node, "key", cmd.split(), "{0}/{1}.ecc.key.pem".format(node.pki.path[".keys"], node.nid))
+    if done:
         node.key_path = "{0}/{1}.ecc.key.pem".format(node.pki.path[".keys"], node.nid)
         node._status = "csr"
-    else:
-        print("\t/!\ [WARNING]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
 
     if state:
       save(node.pki)
+    return done
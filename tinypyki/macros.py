@@ -9,9 +9,15 @@
 # Node types
 NTYPES     = ("ca",  "u")
 
+# Node attributes indexed by their pki, see PKI.index
+INDEXED    = ("_status", "ntype", "issuer")
+
 # File formats
 FORMATS    = ("pem", "der")
 
+# Serial allocation modes, see tinypyki.serials
+SERIAL_MODES = ("sequential", "random")
+
 # Digests
 DIGESTS    = ("md5", "sha1", "sha256", "sha384", "sha512")
 
@@ -56,6 +62,9 @@ ECC_CURVES = [ "secp112r1",  "secp112r2",  "secp128r1",  "secp128r2",
                "wap-wsg-idm-ecid-wtls11",  "wap-wsg-idm-ecid-wtls12",  
                "Oakley-EC2N-3",            "Oakley-EC2N-4" ]
 
+# EdDSA curves, handled as curve names: keys from genpkey, signatures without digest
+EDDSA      = ("ed25519", "ed448")
+
 # A rsa size generator for compliancy check
 def SIZES(max_pow=16):
     """A power of two generator.
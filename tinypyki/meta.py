@@ -0,0 +1,331 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""A queryable certificate metadata index.
+
+Every PKI instance holds an Index in pki.meta, kept up to date by gen.cert,
+gen.crl and do.revoke and saved next to the pki state, in pki.path["meta"].
+Answering fleet questions then no longer requires parsing every cert:
+
+    pki.meta.expiring(7, ntype="u")          # leaf certs expiring within 7 days
+    pki.meta.signed_with("sha1")             # certs signed with sha1
+    pki.meta.san("dilbert.el")               # certs whose SANs hold this host
+    pki.meta.issued_by("root")               # certs issued by node root
+
+Records are built from tinypyki.asn1 summaries. Each queried field is held in
+a list of (value, nid) couples, sorted so that equality and range queries are
+a pair of binary searches. Updates are appended and the list is only sorted
+again by the next query on the field, so that indexing a whole stage of certs
+costs one sort rather than an insertion each.
+"""
+
+import bisect
+import os
+import pickle
+import threading
+import time
+
+from .macros import *
+from .       import asn1
+
+# Sorted fields of the index
+KEYS = ("not_after", "digest", "issuer", "san", "next_update")
+
+# SAN types, stripped from indexed SAN values
+SAN_TYPES = ("email", "DNS", "URI", "IP", "DirName", "RID", "otherName")
+
+# Greater than any node id, upper bound of equality queries
+_LAST = chr(0x10ffff)
+
+class Index():
+    """Certificate and crl metadata, sorted by expiry, digest, issuer and SAN."""
+
+    def __init__(self):
+        """Attributes:
+
+        .records -- a dictionary of cert records { "nid": {field: value} },
+                    fields are nid, issuer, ntype, serial, subject, not_before,
+                    not_after, digest, sans, key_type, key_size and revoked (the
+                    revocation reason, None if valid)
+        .crls    -- a dictionary of crl records { "nid": {field: value} },
+                    fields are this_update, next_update and entries
+        .keys    -- a dictionary of lists { "field": [(value, nid)] }, fields
+                    are in KEYS, sorted by the next query (see Index.between)
+        .dirty   -- boolean, changed since last saved
+        """
+        self.records  = {}
+        self.crls     = {}
+        self.keys     = dict((key, []) for key in KEYS)
+        self.dirty    = False
+        self._stale   = set()
+        self._dropped = dict((key, set()) for key in KEYS)
+        self._lock    = threading.RLock()
+
+    def __repr__(self):
+        """Formal Index representation."""
+        return "Index(certs={0}, crls={1})".format(len(self.records), len(self.crls))
+
+    def __len__(self):
+        """Number of indexed certs."""
+        return len(self.records)
+
+    def __getstate__(self):
+        """Locks are not saved with the index, sorted lists are."""
+        with self._lock:
+            for key in list(self._stale):
+                self._flush(key)
+            state = self.__dict__.copy()
+        del state["_lock"], state["_stale"], state["_dropped"]
+        return state
+
+    def __setstate__(self, state):
+        """Restore a lock on load."""
+        self.__dict__.update(state)
+        self._stale   = set()
+        self._dropped = dict((key, set()) for key in KEYS)
+        self._lock    = threading.RLock()
+
+    def between(self, key, low=None, high=None):
+        """Return the node ids of a field whose value is within [low, high[, sorted by value.
+
+        key  -- a field, in KEYS
+        low  -- lower bound (default None, no lower bound)
+        high -- upper bound (default None, no upper bound)
+
+        Pending updates of the field are sorted in first.
+        """
+        with self._lock:
+            if key in self._stale:
+                self._flush(key)
+            return _range(self.keys[key], low, high)
+
+    def update(self, node):
+        """Index, or re-index, the cert of a node.
+
+        node -- a Node object, with a cert_path
+        """
+        summary = asn1.summary(node.cert_path) if node.cert_path else None
+        if not summary:
+            return
+        record = _record(node, summary)
+        with self._lock:
+            self._drop(node.nid)
+            self.records[node.nid] = record
+            for key, value in _entries(record):
+                self._add(key, value, node.nid)
+            self.dirty = True
+
+    def revoke(self, nid, reason=None):
+        """Flag the cert of a node as revoked.
+
+        nid    -- node id
+        reason -- string, revocation reason (default None, "unspecified")
+        """
+        with self._lock:
+            if nid in self.records:
+                self.records[nid]["revoked"] = reason if reason else "unspecified"
+                self.dirty = True
+
+    def crl(self, node):
+        """Index, or re-index, the crl of a node.
+
+        node -- a Node object, with a crl_path
+        """
+        summary = asn1.summary(node.crl_path) if node.crl_path else None
+        if not summary:
+            return
+        with self._lock:
+            if node.nid in self.crls:
+                self._dropped["next_update"].add((self.crls[node.nid]["next_update"], node.nid))
+                self._stale.add("next_update")
+            self.crls[node.nid] = { "this_update" : summary.get("this_update"),
+                                    "next_update" : summary.get("next_update"),
+                                    "entries"     : summary.get("entries", 0) }
+            self._add("next_update", summary.get("next_update"), node.nid)
+            self.dirty = True
+
+    def rebuild(self, pki):
+        """Index every cert and crl of a pki from scratch.
+
+        pki -- a PKI object
+
+        Used once for instances generated before the index existed, the sorted
+        lists are sorted once rather than kept sorted on each insertion.
+        """
+        self.records, self.crls = {}, {}
+        keys = dict((key, []) for key in KEYS)
+        for node in pki.nodes.values():
+            summary = asn1.summary(node.cert_path) if node.cert_path else None
+            if summary:
+                self.records[node.nid] = _record(node, summary)
+                for key, value in _entries(self.records[node.nid]):
+                    keys[key].append((value, node.nid))
+        for node in pki.nodes.values():
+            summary = asn1.summary(node.crl_path) if node.crl_path else None
+            if summary:
+                self.crls[node.nid] = { "this_update" : summary.get("this_update"),
+                                        "next_update" : summary.get("next_update"),
+                                        "entries"     : summary.get("entries", 0) }
+                keys["next_update"].append((summary.get("next_update"), node.nid))
+                # Summaries hold revoked serials, not their reasons
+                revoked = set(summary.get("revoked", []))
+                for nid in node.sign_list:
+                    if nid in self.records and self.records[nid]["serial"] in revoked:
+                        self.records[nid]["revoked"] = "unspecified"
+        for key in keys:
+            keys[key].sort()
+        with self._lock:
+            self.keys     = keys
+            self._stale   = set()
+            self._dropped = dict((key, set()) for key in KEYS)
+            self.dirty    = True
+
+    def expiry(self, start=None, end=None, ntype=None):
+        """Return the node ids whose cert expires within [start, end[.
+
+        start -- lower bound, an ISO "YYYY-MM-DDTHH:MM:SSZ" string, a datetime
+                 or seconds since the epoch (default None, no lower bound)
+        end   -- upper bound, same format (default None, no upper bound)
+        ntype -- only return nodes of this type, in NTYPES (default None, any)
+
+        Node ids are sorted by expiry.
+        """
+        nids = self.between("not_after", _stamp(start), _stamp(end))
+        return nids if ntype is None else [nid for nid in nids if self.records[nid]["ntype"] == ntype]
+
+    def expiring(self, days, ntype=None, now=None):
+        """Return the node ids whose cert expires within a number of days.
+
+        days  -- number of days from now
+        ntype -- only return nodes of this type, in NTYPES (default None, any)
+        now   -- seconds since the epoch (default None, current time)
+
+        Expired certs are included.
+        """
+        now = time.time() if now is None else now
+        return self.expiry(None, now + days * 86400, ntype)
+
+    def signed_with(self, digest):
+        """Return the node ids whose cert is signed with a digest, e.g. "sha1"."""
+        return self.between("digest", digest, digest + "\0")
+
+    def issued_by(self, issuer):
+        """Return the node ids whose cert is issued by node issuer."""
+        return self.between("issuer", issuer, issuer + "\0")
+
+    def san(self, value, prefix=False):
+        """Return the node ids whose SANs hold a value.
+
+        value  -- SAN value, with or without its type, e.g. "DNS:dilbert.el" or
+                  "dilbert.el", case insensitive
+        prefix -- boolean, match SANs starting with value (default False)
+        """
+        value = _san(value)
+        return sorted(set(self.between("san", value, value + (_LAST if prefix else "\0"))))
+
+    def crl_expiry(self, start=None, end=None):
+        """Return the node ids whose crl next update is within [start, end[.
+
+        start -- lower bound, same formats as Index.expiry (default None)
+        end   -- upper bound, same formats as Index.expiry (default None)
+        """
+        return self.between("next_update", _stamp(start), _stamp(end))
+
+    def revoked(self):
+        """Return the node ids whose cert is revoked."""
+        return [nid for nid, record in self.records.items() if record["revoked"]]
+
+    def save(self, path):
+        """Pickle the index in path."""
+        with self._lock:
+            with open(path + ".tmp", "wb") as m_hdlr:
+                pickle.dump(self, m_hdlr)
+            os.rename(path + ".tmp", path)
+            self.dirty = False
+
+    def _add(self, key, value, nid):
+        """Add (value, nid) to a field, sorted on the next query, the lock is held."""
+        if (value, nid) in self._dropped[key]:
+            # Still in the list, dropped then added back
+            self._dropped[key].discard((value, nid))
+        else:
+            self.keys[key].append((value, nid))
+            self._stale.add(key)
+
+    def _drop(self, nid):
+        """Remove a cert record and its entries, the lock is held."""
+        if nid in self.records:
+            for key, value in _entries(self.records.pop(nid)):
+                self._dropped[key].add((value, nid))
+                self._stale.add(key)
+
+    def _flush(self, key):
+        """Remove the dropped entries of a field and sort it, the lock is held."""
+        if self._dropped[key]:
+            self.keys[key] = [entry for entry in self.keys[key] if not entry in self._dropped[key]]
+            self._dropped[key] = set()
+        # Mostly sorted, with the updates appended: close to linear
+        self.keys[key].sort()
+        self._stale.discard(key)
+
+def load(pki):
+    """Return the index of a pki.
+
+    pki -- a PKI object
+
+    Unpickles pki.path["meta"] if any, otherwise indexes the pki files.
+    """
+    if os.path.isfile(pki.path["meta"]):
+        with open(pki.path["meta"], "rb") as m_hdlr:
+            return pickle.load(m_hdlr)
+    index = Index()
+    if any(node.cert_path for node in pki.nodes.values()):
+        index.rebuild(pki)
+    return index
+
+def _record(node, summary):
+    """Return the cert record of a node from its cert summary."""
+    return { "nid"        : node.nid,
+             "issuer"     : node.issuer,
+             "ntype"      : node.ntype,
+             "serial"     : summary.get("serial"),
+             "subject"    : summary.get("subject"),
+             "not_before" : summary.get("not_before"),
+             "not_after"  : summary.get("not_after"),
+             "digest"     : summary.get("digest"),
+             "sans"       : summary.get("sans", []),
+             "key_type"   : summary.get("key_type"),
+             "key_size"   : summary.get("key_size"),
+             "revoked"    : None }
+
+def _entries(record):
+    """Generate the (key, value) couples of a cert record."""
+    if record["not_after"]:
+        yield "not_after", record["not_after"]
+    if record["digest"]:
+        yield "digest", record["digest"]
+    yield "issuer", record["issuer"]
+    for value in set(_san(san) for san in record["sans"]):
+        yield "san", value
+
+def _range(entries, low=None, high=None):
+    """Return the node ids of a sorted list whose value is within [low, high[."""
+    start = bisect.bisect_left(entries, (low,)) if low is not None else 0
+    stop  = bisect.bisect_left(entries, (high,)) if high is not None else len(entries)
+    return [nid for value, nid in entries[start:stop]]
+
+def _san(value):
+    """Return the indexed form of a SAN value, without its type, lowercase."""
+    kind, sep, rest = value.partition(":")
+    return rest.lower() if sep and kind in SAN_TYPES else value.lower()
+
+def _stamp(when):
+    """Return the ISO "YYYY-MM-DDTHH:MM:SSZ" form of a time bound."""
+    if when is None or isinstance(when, str):
+        return when
+    if hasattr(when, "strftime"):
+        return when.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(when))
@@ -0,0 +1,178 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Per operation timing instrumentation.
+
+Once enabled, wall and CPU time are recorded for every gen.* call, gen.save,
+PKI.ordered, Node.subtree and every command spawned through events.call, and
+aggregated into histograms:
+
+    tiny.metrics.enable()                  # or TINYPYKI_METRICS=1 in the environment
+    tiny.do.everything(pki)
+    print(tiny.metrics.prometheus())
+    tiny.metrics.dump("run.json")
+
+Operations recorded:
+
+gen.<function>  -- python side of a generation call, openssl included
+gen.save        -- pickling the pki state
+pki.ordered     -- PKI.ordered
+node.subtree    -- Node.subtree, outermost call only
+spawn           -- a spawned command, labelled by stage; its CPU time is the
+                   child's user and system time
+spawn.overhead  -- time to fork and exec a command, labelled by stage
+
+CPU time of python operations is the calling thread's. Disabled, the
+instrumentation costs a flag test per call.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+
+from .macros import *
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Recording switch, see enable and disable
+enabled = bool(os.environ.get("TINYPYKI_METRICS"))
+
+# Histograms { (operation, label): {"count": int, "wall": [...], "cpu": [...]} },
+# wall and cpu hold the sum then the count per bucket, the last one unbounded
+_histograms = {}
+_lock       = threading.Lock()
+_active     = threading.local()
+
+def enable():
+    """Start recording."""
+    global enabled
+    enabled = True
+
+def disable():
+    """Stop recording, what was recorded is kept."""
+    global enabled
+    enabled = False
+
+def reset():
+    """Forget what was recorded."""
+    with _lock:
+        _histograms.clear()
+
+def observe(op, wall, cpu, label=None):
+    """Record an operation.
+
+    op    -- operation name, e.g. "gen.key"
+    wall  -- wall clock duration in seconds
+    cpu   -- CPU time in seconds
+    label -- optional label, e.g. the stage of a spawn (default None)
+    """
+    if not enabled:
+        return
+    with _lock:
+        histogram = _histograms.get((op, label))
+        if histogram is None:
+            histogram = _histograms[(op, label)] = { "count" : 0,
+                                                     "wall"  : [0.0] + [0] * (len(BUCKETS) + 1),
+                                                     "cpu"   : [0.0] + [0] * (len(BUCKETS) + 1) }
+        histogram["count"] += 1
+        for clock, value in [("wall", wall), ("cpu", cpu)]:
+            histogram[clock][0] += value
+            histogram[clock][1 + _bucket(value)] += 1
+
+def spawn(stage, overhead, wall, cpu):
+    """Record a spawned command.
+
+    stage    -- stage the command belongs to, e.g. "key"
+    overhead -- seconds spent forking and executing it
+    wall     -- seconds from spawn to exit
+    cpu      -- child user and system time in seconds
+    """
+    if not enabled:
+        return
+    observe("spawn", wall, cpu, stage)
+    observe("spawn.overhead", overhead, 0.0, stage)
+
+def timed(op):
+    """Decorator recording the wall and CPU time of each call as op.
+
+    Nested calls to the same operation, e.g. recursion, are recorded once.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled or op in getattr(_active, "ops", ()):
+                return function(*args, **kwargs)
+            _active.ops = getattr(_active, "ops", set()) | {op}
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(op, time.perf_counter() - wall, time.thread_time() - cpu)
+                _active.ops = _active.ops - {op}
+        return wrapper
+    return decorator
+
+def snapshot():
+    """Return the recorded histograms as a list of dictionaries.
+
+    Each holds op, label, count, and for "wall" and "cpu": sum and buckets,
+    a list of [upper bound, cumulative count], the last bound being "+Inf".
+    """
+    with _lock:
+        items = sorted(_histograms.items(), key=lambda item: (item[0][0], str(item[0][1])))
+        result = []
+        for (op, label), histogram in items:
+            entry = { "op" : op, "label" : label, "count" : histogram["count"] }
+            for clock in ["wall", "cpu"]:
+                cumulative, buckets = 0, []
+                for bound, count in zip(list(BUCKETS) + ["+Inf"], histogram[clock][1:]):
+                    cumulative += count
+                    buckets.append([bound, cumulative])
+                entry[clock] = { "sum" : histogram[clock][0], "buckets" : buckets }
+            result.append(entry)
+        return result
+
+def dump(path=None):
+    """Return the recorded histograms as JSON, also written to path if any."""
+    data = json.dumps(snapshot(), indent=2)
+    if path:
+        with open(path, "w") as m_hdlr:
+            m_hdlr.write(data)
+    return data
+
+def prometheus(path=None):
+    """Return the recorded histograms in Prometheus text format, also written to path if any.
+
+    Metrics are tinypyki_wall_seconds and tinypyki_cpu_seconds, labelled by
+    op and, for spawns, stage.
+    """
+    entries = snapshot()
+    lines   = []
+    for clock in ["wall", "cpu"]:
+        name = "tinypyki_{0}_seconds".format(clock)
+        lines.append("# HELP {0} {1} time of tinypyki operations".format(name, "Wall clock" if clock == "wall" else "CPU"))
+        lines.append("# TYPE {0} histogram".format(name))
+        for entry in entries:
+            labels = "op=\"{0}\"".format(entry["op"]) + (",stage=\"{0}\"".format(entry["label"]) if entry["label"] is not None else "")
+            for bound, count in entry[clock]["buckets"]:
+                lines.append("{0}_bucket{{{1},le=\"{2}\"}} {3}".format(name, labels, bound, count))
+            lines.append("{0}_sum{{{1}}} {2}".format(name, labels, repr(entry[clock]["sum"])))
+            lines.append("{0}_count{{{1}}} {2}".format(name, labels, entry["count"]))
+    data = "\n".join(lines) + "\n"
+    if path:
+        with open(path, "w") as m_hdlr:
+            m_hdlr.write(data)
+    return data
+
+def _bucket(value):
+    """Return the index of the bucket of a value, len(BUCKETS) if unbounded."""
+    for idx, bound in enumerate(BUCKETS):
+        if value <= bound:
+            return idx
+    return len(BUCKETS)
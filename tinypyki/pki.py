@@ -6,48 +6,78 @@
 
 """Definition of tinypyki classes PKI() and Node()."""
 
+import copy
 import os
+import shutil
+import threading
 import uuid
 
-from .macros import *
+from .macros  import *
+from .serials import Allocator
+from .        import gen, meta, metrics, costs
+
+# Serializes index updates of nodes generated in parallel, see Node.__setattr__
+_indexing = threading.Lock()
+
+# Held while loading a metadata index, see PKI.meta
+_loading = threading.Lock()
 
 class PKI():
     """A PKI tree structure abstraction and related methods."""
 
-    def __init__(self, pki_id=None):
+    def __init__(self, pki_id=None, serial_mode="sequential"):
         """Attributes:
 
-        .pki_id -- a unique PKI instance identifier (default uuid4)
-        .serial -- internal tracking serial number for certificates
-        .path   -- a dictionary holding references to various paths, valid indexes:
-                   * path["conf"]       -- reserved for future use.
-                   * path["wdir"]       -- work directory, where all instance data is stored on disk
-                   * path["openssl"]    -- path to openssl binary (default /usr/bin/openssl)
-                   * path[".keys"]      -- directory holding all the generated key files
-                   * path["csrs"]       -- directory holding all the generated csr files
-                   * path["crls"]       -- directory holding all the generated crl files
-                   * path["sans"]       -- directory holding all the subject alternative name files
-                   * path["index"]      -- openssl required index file
-                   * path["config.cnf"] -- openssl required configuration file
-                   * path["state"]      -- path to the saved instance state (picked file)
-        .nodes  -- a dictionary of all the nodes in the pki { "unique_node_id": Node_Object_Reference }
+        .pki_id  -- a unique PKI instance identifier (default uuid4)
+        .serials -- certificate serial number allocator (see tinypyki.serials),
+                    serial_mode must be in SERIAL_MODES (default "sequential")
+        .path    -- a dictionary holding references to various paths, valid indexes:
+                    * path["conf"]       -- reserved for future use.
+                    * path["wdir"]       -- work directory, where all instance data is stored on disk
+                    * path["openssl"]    -- path to openssl binary (default /usr/bin/openssl)
+                    * path[".keys"]      -- directory holding all the generated key files
+                    * path["csrs"]       -- directory holding all the generated csr files
+                    * path["crls"]       -- directory holding all the generated crl files
+                    * path["sans"]       -- directory holding all the subject alternative name files
+                    * path["index"]      -- openssl required index file
+                    * path["config.cnf"] -- openssl required configuration file
+                    * path["state"]      -- path to the saved instance state (picked file)
+                    * path["meta"]       -- path to the saved metadata index (see tinypyki.meta)
+        .nodes   -- a dictionary of all the nodes in the pki { "unique_node_id": Node_Object_Reference }
+        .cache   -- an optional artifact cache shared across PKI instances
+                    (default None, see tinypyki.cache)
+        .reservoir -- an optional pool of pre-generated keys
+                      (default None, see tinypyki.reservoir)
+        .costs   -- predicted operation timings, refined as nodes are generated
+                    (see tinypyki.costs)
+        .index   -- live node indexes { "attr": { value: {"nid": None} } } for
+                    each attr in INDEXED, e.g. index["_status"]["cert"] holds
+                    the node ids to certify next and index["issuer"]["ca"] the
+                    ones ca issues; kept up to date by Node.__setattr__
         """
 
-        self.id     = pki_id if pki_id else str(uuid.uuid4())
-        self.serial = "{0:02x}".format(1)
-        self.path   = {"wdir"       : os.getcwd() + "/instances/{0}".format(pki_id),
-                       "openssl"    : "/usr/bin/openssl",
-                       ".keys"      : None,
-                       "csrs"       : None,
-                       "certs"      : None,
-                       "crls"       : None,
-                       "sans"       : None,
-                       "index"      : None,
-                       "serial"     : None, 
-                       "config.cnf" : None,
-                       "state"      : None
-                       }
-        self.nodes  = {}
+        self.id      = pki_id if pki_id else str(uuid.uuid4())
+        self.serials = Allocator(serial_mode)
+        self.path    = {"wdir"       : os.getcwd() + "/instances/{0}".format(pki_id),
+                        "openssl"    : "/usr/bin/openssl",
+                        ".keys"      : None,
+                        "csrs"       : None,
+                        "certs"      : None,
+                        "crls"       : None,
+                        "sans"       : None,
+                        "index"      : None,
+                        "serial"     : None, 
+                        "config.cnf" : None,
+                        "state"      : None,
+                        "meta"       : None
+                        }
+        self.nodes   = {}
+        self.cache   = None
+        self.reservoir = None
+        self.costs   = costs.Model()
+        self._meta   = None
+        self.index   = dict((attr, {}) for attr in INDEXED)
+        self._signed = {}
         for k in self.path.keys():
             self.path[k] = os.path.join(self.path["wdir"], k) if not self.path[k] else self.path[k]
 
@@ -67,23 +97,106 @@ class PKI():
                 pretty_print += "\t`-> {0:<10} = {1}\n".format(attr, self.__dict__[attr])
         return pretty_print
 
+    def __getstate__(self):
+        """The metadata index is saved apart from the pki state, see gen.save."""
+        state = self.__dict__.copy()
+        state["_meta"] = None
+        state["index"] = None
+        state["_signed"] = {}
+        return state
+
+    def __setstate__(self, state):
+        """Upgrade pki states saved by former versions."""
+        if "serial" in state:
+            state["serials"] = Allocator(start=int(state.pop("serial"), 16))
+        state.setdefault("cache", None)
+        state.setdefault("reservoir", None)
+        state.setdefault("costs", costs.Model())
+        state.setdefault("_meta", None)
+        state["path"].setdefault("meta", os.path.join(state["path"]["wdir"], "meta"))
+        self.__dict__.update(state)
+        # Indexes are not saved, they are rebuilt from the nodes
+        self.index   = dict((attr, {}) for attr in INDEXED)
+        self._signed = {}
+        for node in self.nodes.values():
+            self._index(node)
+
+    def _index(self, node):
+        """Internal use for adding a node to the pki indexes."""
+        for attr in INDEXED:
+            self.index[attr].setdefault(node.__dict__.get(attr), {})[node.nid] = None
+
+    def _unindex(self, node):
+        """Internal use for removing a node from the pki indexes."""
+        for attr in INDEXED:
+            bucket = self.index[attr].get(node.__dict__.get(attr))
+            if bucket is not None:
+                bucket.pop(node.nid, None)
+                if not bucket:
+                    del self.index[attr][node.__dict__.get(attr)]
+
+    def _link(self, issuer, nid):
+        """Internal use for adding nid to the sign_list of node issuer, once.
+
+        A set of each sign_list is kept in self._signed so that inserting n
+        nodes under the same issuer is not quadratic. It is rebuilt whenever
+        the sign_list was replaced or changed length behind its back.
+        """
+        sign_list = self.nodes[issuer].sign_list
+        signed    = self._signed.get(issuer)
+        if signed is None or signed[0] is not sign_list or signed[1] != len(sign_list):
+            signed = self._signed[issuer] = [sign_list, len(sign_list), set(sign_list)]
+        if not nid in signed[2]:
+            sign_list.append(nid)
+            signed[1] += 1
+            signed[2].add(nid)
+
+    def _depths(self, nids):
+        """Internal use, return the depth in the tree of each node id, roots are 0."""
+        depth = {}
+        for nid in nids:
+            chain = []
+            while not nid in depth and self.nodes[nid].issuer != nid:
+                chain.append(nid)
+                nid = self.nodes[nid].issuer
+            base = depth.setdefault(nid, 0)
+            for idx, sub in enumerate(reversed(chain)):
+                depth[sub] = base + idx + 1
+        return depth
+
+    def having(self, attr, value):
+        """Return the list of node ids whose attr, in INDEXED, equals value."""
+        return list(self.index[attr].get(value, {}))
+
+    @property
+    def meta(self):
+        """Certificate metadata index, loaded on first use (see tinypyki.meta)."""
+        # Stage workers may all ask for it first, only one loads it
+        if self._meta is None:
+            with _loading:
+                if self._meta is None:
+                    self._meta = meta.load(self)
+        return self._meta
+
+    @property
+    def serial(self):
+        """Next serial of the global sequence, as a hex string."""
+        return "{0:02x}".format(self.serials.next)
+
     def increment(self):
-        """Internal use for incrementing the serial."""
-        self.serial = "{0:02x}".format(int(self.serial, 16) + 1)
+        """Internal use for allocating a serial from the global sequence."""
+        return self.serials.allocate(None)
 
+    @metrics.timed("pki.ordered")
     def ordered(self):
         """Return a list of node ids in a relative order.
 
         Leftmost node ids are to be created before the rightmost nodes are,
-        to solve the issuer hierarchy problem.
+        to solve the issuer hierarchy problem: they are sorted by depth in the
+        tree, each node's depth being computed once.
         """
-        ordered_list = []
-        while len(ordered_list) != len(self.nodes):
-            for node in self.nodes.values():
-                if not node.nid in ordered_list:
-                    if node.issuer == node.nid or node.issuer in ordered_list:
-                        ordered_list.append(node.nid)
-        return ordered_list
+        depth = self._depths(self.nodes)
+        return sorted(self.nodes, key=depth.__getitem__)
 
     def trust_chain(self, nid):
         """Return the trust chain, from this node to the root node.
@@ -104,6 +217,69 @@ class PKI():
                 chain.append(ca_id)
             return chain
 
+    def clone(self, new_id, wdir=None):
+        """Fork this PKI instance, on disk and in memory.
+
+        new_id -- the unique PKI instance identifier of the clone
+        wdir   -- work directory of the clone (default: next to this one,
+                  named after new_id)
+
+        The node tree is copied and every path is moved to the new work
+        directory. The keys, csrs and certs of the nodes never change once
+        generated, so they are hardlinked (copied if the filesystem refuses).
+        Everything else (index, serial, sans, config.cnf, crls, keystores...)
+        is copied and the paths it holds are rewritten. Files are unlinked
+        before being regenerated (see gen._call) so the clone never writes
+        through to this instance.
+
+        The cache and reservoir, if any, are shared. Returns the clone, whose
+        state is saved.
+        """
+        old    = self.path["wdir"]
+        new    = wdir if wdir else os.path.join(os.path.dirname(old), new_id)
+        pki    = copy.deepcopy(self, {id(self.cache): self.cache, id(self.reservoir): self.reservoir})
+        pki.id = new_id
+        if self._meta is not None:
+            pki._meta       = copy.deepcopy(self._meta)
+            pki._meta.dirty = True
+        for k in pki.path:
+            pki.path[k] = new + pki.path[k][len(old):] if pki.path[k].startswith(old) else pki.path[k]
+        for node in pki.nodes.values():
+            for attr in ["key_path", "csr_path", "cert_path", "crl_path", "p12_path"]:
+                path = getattr(node, attr)
+                if path and path.startswith(old):
+                    setattr(node, attr, new + path[len(old):])
+
+        # Only the files regenerated through gen._call, which unlinks them
+        # first, are shared
+        shared = set(getattr(node, attr) for node in self.nodes.values() for attr in ["key_path", "csr_path", "cert_path"])
+        for root, dirs, files in os.walk(old):
+            target = new + root[len(old):]
+            if not os.path.isdir(target):
+                os.makedirs(target)
+            for name in files:
+                src, dst = os.path.join(root, name), os.path.join(target, name)
+                if os.path.islink(src):
+                    link = os.readlink(src)
+                    os.symlink(new + link[len(old):] if link.startswith(old) else link, dst)
+                elif src == self.path["state"] or src == self.path["meta"] and self._meta is not None:
+                    continue
+                elif src == self.path["meta"]:
+                    shutil.copy2(src, dst)
+                elif src in shared:
+                    try:
+                        os.link(src, dst)
+                    except OSError:
+                        shutil.copy2(src, dst)
+                elif root == old:
+                    with open(src, "rb") as s_hdlr, open(dst, "wb") as d_hdlr:
+                        d_hdlr.write(s_hdlr.read().replace(old.encode("utf-8"), new.encode("utf-8")))
+                else:
+                    shutil.copy2(src, dst)
+        if os.path.isdir(new):
+            gen.save(pki)
+        return pki
+
 class Node():
     """A PKI tree Node abstraction and related methods."""
     def __init__(self,
@@ -163,7 +339,7 @@ class Node():
         ._status     -- an internal status indicator for this node helping to identify what next needs to be generated
         ._itergen    -- an internal attribute used for iterations
         .curve_name  -- the curve name to be used if ECC is desired, 
-                        must be defined in ECC_CURVES (default None), 
+                        must be defined in ECC_CURVES or EDDSA (default None), 
                         see tinypyki.gen.ecc_key
         """
     
@@ -191,7 +367,21 @@ class Node():
         self.p12_path    = p12_path            if p12_path    else None
         self._status     = "key"
         self._itergen    = None
-        self.curve_name  = curve_name          if curve_name  and curve_name          in ECC_CURVES else None
+        self.curve_name  = curve_name          if curve_name  and (curve_name in ECC_CURVES or curve_name in EDDSA) else None
+
+    def __setattr__(self, name, value):
+        """Keep the indexes of the pki this node is inserted in up to date."""
+        if name != "pki" and not name in INDEXED:
+            object.__setattr__(self, name, value)
+            return
+        with _indexing:
+            pki = self.__dict__.get("pki")
+            if pki is not None and pki.nodes.get(self.__dict__.get("nid")) is self:
+                pki._unindex(self)
+            object.__setattr__(self, name, value)
+            pki = self.__dict__.get("pki")
+            if pki is not None and pki.nodes.get(self.__dict__.get("nid")) is self:
+                pki._index(self)
 
     def __repr__(self):
         """Formal Node representation."""
@@ -221,7 +411,7 @@ class Node():
         A node is said to be lower than another if it belongs to that other
         node's subtree.
         """
-        return self.__ne__(other) and self.pki.id == other.pki.id and self.nid in other.subtree() 
+        return self.__ne__(other) and self.pki.id == other.pki.id and self.nid != other.nid and self.nid in other
 
     def __gt__(self, other):
         """Greater than.
@@ -251,7 +441,7 @@ class Node():
 
     def __getitem__(self, nid):
         """Enables index access to a node within this node's subtree."""
-        if nid in self.subtree(including=True):
+        if nid in self:
             return self.pki.nodes[nid]
         else:
             raise IndexError
@@ -268,21 +458,35 @@ class Node():
             self._itergen = None
             raise StopIteration
 
+    @metrics.timed("node.subtree")
     def subtree(self, including=False):
         """Returns a list of node ids which have this node in their trust chain.
 
         including -- if True, includes this node's node id in the subtree (default False)
         """
         sub_list = [] if not including else [self.nid]
-        for nid in self.sign_list:
-            if not self.pki.nodes[nid].sign_list:
+        # Depth first, each node followed by its own subtree, without recursion
+        stack = [(self.nid, iter(self.sign_list))]
+        while stack:
+            issuer, sign_list = stack[-1]
+            nid = next(sign_list, None)
+            if nid is None:
+                stack.pop()
+            elif nid != issuer:
                 sub_list.append(nid)
-            else:
-                if nid == self.nid:
-                    continue
-                sub_list += self.pki.nodes[nid].subtree(including=True)
+                stack.append((nid, iter(self.pki.nodes[nid].sign_list)))
         return sub_list
 
     def __contains__(self, nid):
-        """Enables for quick checks if a node's node id is in this node's subtree (including itself)"""
-        return isinstance(nid, str) and nid in self.subtree(including=True)
+        """Enables for quick checks if a node's node id is in this node's subtree (including itself)
+
+        The issuers of nid are walked up instead, in as many steps as nid is deep.
+        """
+        if not isinstance(nid, str):
+            return False
+        nodes = self.pki.nodes if self.pki else {}
+        while nid != self.nid:
+            if not nid in nodes or nodes[nid].issuer == nid:
+                return False
+            nid = nodes[nid].issuer
+        return True
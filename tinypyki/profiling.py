@@ -0,0 +1,202 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Profiling of tinypyki runs, python and spawned commands together.
+
+    with tiny.profile("run"):
+        tiny.do.everything(pki)
+
+or TINYPYKI_PROFILE=run in the environment to profile the whole process, the
+files are then written at exit. Three files are written:
+
+run.folded     -- stacks in the collapsed format of flamegraph.pl and
+                  speedscope, one line per stack with its number of samples
+run.trace.json -- Chrome trace events, for chrome://tracing or Perfetto: the
+                  sampled python stacks and a span per spawned command, per
+                  thread
+run.pstats     -- the cProfile statistics of the calling thread, see pstats
+
+Python stacks of every thread are sampled every interval seconds. Commands
+are timed from their events.call exit events (see tinypyki.events), with
+their command line, node id and stage: samples taken while a thread waits for
+a command get an extra "[openssl <stage>]" frame, so the wait time shows up
+as such instead of lumped into subprocess calls. Events must not be silenced
+with events.quiet() while profiling, that removes the profile's subscriber.
+"""
+
+import atexit
+import bisect
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+from .macros import *
+from .       import events
+
+class Profile():
+    """A profiling session, see profile."""
+
+    def __init__(self, prefix="tinypyki-profile", interval=0.001):
+        """Attributes:
+
+        .prefix   -- path prefix of the written files (default "tinypyki-profile")
+        .interval -- seconds between two stack samples (default 0.001)
+        .samples  -- list of (thread id, time, stack) samples, stacks are tuples
+                     of frame names, outermost first
+        .children -- list of spawned commands, dictionaries holding cmd, tool,
+                     nid, stage, code, thread, start and end (epoch seconds)
+        .profiler -- the cProfile.Profile of the calling thread
+        """
+        self.prefix   = prefix
+        self.interval = interval
+        self.samples  = []
+        self.children = []
+        self.profiler = cProfile.Profile()
+        self._running = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def start(self):
+        """Start profiling, return self."""
+        events.subscribe(self._event)
+        self._running.set()
+        self._sampler = threading.Thread(target=self._sample, name="tinypyki-profile")
+        self._sampler.daemon = True
+        self._sampler.start()
+        self.profiler.enable()
+        return self
+
+    def stop(self, write=True):
+        """Stop profiling and write the files, unless write is False."""
+        if not self._running.is_set():
+            return
+        self.profiler.disable()
+        self._running.clear()
+        self._sampler.join()
+        events.unsubscribe(self._event)
+        if write:
+            self.write()
+
+    def _event(self, event):
+        """Events subscriber, records command exits."""
+        if event.kind == "exit" and event.cmd:
+            # Reservoir refills run openssl through nice -n 10
+            args = event.cmd.split()
+            args = args[3:] if args[0] == "nice" and len(args) > 3 else args
+            self.children.append({ "cmd"    : event.cmd,
+                                   "tool"   : os.path.basename(args[0]),
+                                   "nid"    : event.nid,
+                                   "stage"  : event.stage,
+                                   "code"   : event.code,
+                                   "thread" : threading.get_ident(),
+                                   "start"  : event.time - event.seconds,
+                                   "end"    : event.time })
+
+    def _sample(self):
+        """Sampler thread, records the stacks of every other thread."""
+        own = threading.get_ident()
+        while self._running.is_set():
+            now = time.time()
+            for thread, frame in sys._current_frames().items():
+                if thread == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append("{0} ({1}:{2})".format(frame.f_code.co_name, os.path.basename(frame.f_code.co_filename),
+                                                        frame.f_code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples.append((thread, now, tuple(stack[::-1])))
+            time.sleep(self.interval)
+
+    def _stacks(self):
+        """Generate the samples, with a command frame while a command runs."""
+        # Commands of a thread run one after the other, sorted by start
+        spans = {}
+        for child in sorted(self.children, key=lambda child: child["start"]):
+            spans.setdefault(child["thread"], ([], []))
+            spans[child["thread"]][0].append(child["start"])
+            spans[child["thread"]][1].append(child)
+        for thread, when, stack in self.samples:
+            starts, children = spans.get(thread, ([], []))
+            idx = bisect.bisect_right(starts, when) - 1
+            if idx >= 0 and when <= children[idx]["end"]:
+                stack += ("[{0} {1}]".format(children[idx]["tool"], children[idx]["stage"]),)
+            yield thread, when, stack
+
+    def folded(self):
+        """Return the samples in the collapsed stack format, one "a;b;c count" line per stack."""
+        counts = {}
+        for thread, when, stack in self._stacks():
+            key = ";".join(frame.replace(";", ",") for frame in stack)
+            counts[key] = counts.get(key, 0) + 1
+        return "".join("{0} {1}\n".format(stack, count) for stack, count in sorted(counts.items()))
+
+    def trace(self):
+        """Return the Chrome trace events, as a dictionary."""
+        pid    = os.getpid()
+        origin = min([when for thread, when, stack in self.samples] + [child["start"] for child in self.children] + [time.time()])
+        usecs  = lambda when: int((when - origin) * 1e6)
+        trace  = []
+        names  = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for thread in set([sample[0] for sample in self.samples] + [child["thread"] for child in self.children]):
+            trace.append({ "ph" : "M", "name" : "thread_name", "pid" : pid, "tid" : thread,
+                           "args" : { "name" : names.get(thread, str(thread)) } })
+        # Consecutive samples sharing frames make nested spans
+        opened, last = {}, {}
+        for thread, when, stack in sorted(self._stacks(), key=lambda sample: (sample[0], sample[1])):
+            frames = opened.setdefault(thread, [])
+            common = 0
+            while common < len(frames) and common < len(stack) and frames[common][0] == stack[common]:
+                common += 1
+            for frame, start in frames[common:]:
+                trace.append({ "ph" : "X", "name" : frame, "cat" : "python", "pid" : pid, "tid" : thread,
+                               "ts" : usecs(start), "dur" : usecs(when) - usecs(start) })
+            del frames[common:]
+            frames.extend((frame, when) for frame in stack[common:])
+            last[thread] = when
+        for thread, frames in opened.items():
+            for frame, start in frames:
+                trace.append({ "ph" : "X", "name" : frame, "cat" : "python", "pid" : pid, "tid" : thread,
+                               "ts" : usecs(start), "dur" : usecs(last[thread] + self.interval) - usecs(start) })
+        for child in self.children:
+            trace.append({ "ph" : "X", "name" : "{0} {1}".format(child["tool"], child["stage"]), "cat" : child["tool"],
+                           "pid" : pid, "tid" : child["thread"], "ts" : usecs(child["start"]),
+                           "dur" : usecs(child["end"]) - usecs(child["start"]),
+                           "args" : { "cmd" : child["cmd"], "nid" : child["nid"], "code" : child["code"] } })
+        return { "traceEvents" : trace, "displayTimeUnit" : "ms" }
+
+    def write(self):
+        """Write the .folded, .trace.json and .pstats files, return their paths."""
+        paths = [self.prefix + ".folded", self.prefix + ".trace.json", self.prefix + ".pstats"]
+        with open(paths[0], "w") as f_hdlr:
+            f_hdlr.write(self.folded())
+        with open(paths[1], "w") as t_hdlr:
+            json.dump(self.trace(), t_hdlr)
+        self.profiler.dump_stats(paths[2])
+        events.emit("info", "Profile written to {0}".format(", ".join(paths)), None, "profile")
+        return paths
+
+def profile(prefix="tinypyki-profile", interval=0.001):
+    """Return a profiling context manager, see Profile.
+
+    prefix   -- path prefix of the written files (default "tinypyki-profile")
+    interval -- seconds between two stack samples (default 0.001)
+    """
+    return Profile(prefix, interval)
+
+# Whole process profiling
+if os.environ.get("TINYPYKI_PROFILE"):
+    _session = Profile(os.environ["TINYPYKI_PROFILE"]).start()
+    atexit.register(_session.stop)
@@ -0,0 +1,187 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""A reservoir of pre-generated keys.
+
+Set pki.reservoir to a Reservoir object and gen.key and gen.ecc_key claim a
+ready key from its spool directory instead of generating one. Keys are kept
+per kind, ("rsa", key_len) or ("ecc", curve_name), and refilled by background
+threads running openssl at a lower priority. Their events are of the
+"reservoir" stage, which the printer leaves out but for warnings (see
+tinypyki.events.BACKGROUND):
+
+    pki.reservoir = tiny.reservoir.Reservoir("/var/spool/tinypyki", size=8)
+    pki.reservoir.want(("rsa", 4096), ("ecc", "secp384r1"))
+    pki.reservoir.start()
+
+Claiming is a rename within the spool, so several processes can share a
+spool directory.
+"""
+
+import os
+import shutil
+import threading
+import uuid
+
+from .macros import *
+from .       import events
+
+class Reservoir():
+    """A background pool of ready RSA and ECC keys."""
+
+    def __init__(self, path=None, size=4, openssl="/usr/bin/openssl", interval=5):
+        """Attributes:
+
+        .path     -- spool directory (default ~/.cache/tinypyki-keys)
+        .size     -- number of ready keys to keep per kind (default 4)
+        .openssl  -- path to openssl binary (default /usr/bin/openssl)
+        .interval -- seconds between two checks of full pools (default 5)
+        .kinds    -- list of the key kinds to keep, ("rsa", key_len) or ("ecc", curve_name)
+        """
+        self.path     = path if path else os.path.join(os.path.expanduser("~"), ".cache", "tinypyki-keys")
+        self.size     = int(size)
+        self.openssl  = openssl
+        self.interval = interval
+        self.kinds    = []
+        self._threads = []
+        self._stop    = threading.Event()
+        self._wake    = threading.Event()
+
+    def __repr__(self):
+        """Formal Reservoir representation."""
+        return "Reservoir(\"{0}\", size={1}, kinds={2})".format(self.path, self.size, self.kinds)
+
+    def __getstate__(self):
+        """Threads are not saved with the pki state, restart them after load."""
+        state = self.__dict__.copy()
+        for attr in ["_threads", "_stop", "_wake"]:
+            del state[attr]
+        return state
+
+    def __setstate__(self, state):
+        """Restore a stopped reservoir on load."""
+        self.__dict__.update(state)
+        self._threads = []
+        self._stop    = threading.Event()
+        self._wake    = threading.Event()
+
+    def want(self, *kinds):
+        """Register key kinds to keep ready, e.g. ("rsa", 4096), ("ecc", "secp384r1")."""
+        for kind in kinds:
+            if not tuple(kind) in self.kinds:
+                self.kinds.append(tuple(kind))
+        self._wake.set()
+
+    def spool(self, kind):
+        """Return the spool directory of a key kind."""
+        return os.path.join(self.path, "{0}-{1}".format(*kind))
+
+    def ready(self, kind):
+        """Return the number of ready keys of a kind."""
+        if not os.path.isdir(self.spool(kind)):
+            return 0
+        return len([name for name in os.listdir(self.spool(kind)) if name.endswith(".key.pem")])
+
+    def claim(self, node, path):
+        """Move a ready key for this node to path.
+
+        node -- a Node object, its curve_name or key_len selects the key kind
+        path -- destination key file path
+
+        Returns True if a key was claimed, False if the pool is empty. An empty
+        pool registers the kind so that it is refilled.
+        """
+        kind = ("ecc", node.curve_name) if node.curve_name else ("rsa", node.key_len)
+        if not kind in self.kinds:
+            self.want(kind)
+        spool = self.spool(kind)
+        for name in os.listdir(spool) if os.path.isdir(spool) else []:
+            if not name.endswith(".key.pem"):
+                continue
+            claimed = os.path.join(spool, name[:-len(".key.pem")] + ".claimed")
+            try:
+                os.rename(os.path.join(spool, name), claimed)
+            except OSError:
+                # Claimed by another thread or process in the meantime
+                continue
+            shutil.move(claimed, path)
+            self._wake.set()
+            return True
+        return False
+
+    def fill(self, kind, count=None):
+        """Generate keys of a kind until the pool holds .size keys.
+
+        kind  -- ("rsa", key_len) or ("ecc", curve_name)
+        count -- maximum number of keys to generate (default None, no maximum)
+
+        Returns the number of keys generated.
+        """
+        if not os.path.isdir(self.spool(kind)):
+            os.makedirs(self.spool(kind))
+        done = 0
+        while self.ready(kind) < self.size and (count is None or done < count) and not self._stop.is_set():
+            tmp = os.path.join(self.spool(kind), "{0}.tmp".format(uuid.uuid4()))
+            if kind[0] == "ecc" and kind[1] in EDDSA:
+                cmd  = "{0} genpkey".format(self.openssl)
+                cmd += " -algorithm {0}".format(kind[1])
+                cmd += " -out {0}".format(tmp)
+                cmd += " -outform pem"
+            elif kind[0] == "ecc":
+                cmd  = "{0} ecparam".format(self.openssl)
+                cmd += " -name {0}".format(kind[1])
+                cmd += " -genkey"
+                cmd += " -out {0}".format(tmp)
+            else:
+                cmd  = "{0} genpkey".format(self.openssl)
+                cmd += " -algorithm rsa"
+                cmd += " -pkeyopt rsa_keygen_bits:{0}".format(kind[1])
+                cmd += " -out {0}".format(tmp)
+                cmd += " -outform pem"
+            # Refills run behind interactive generation, through nice rather
+            # than a preexec_fn which is not safe with threads
+            if events.call(["nice", "-n", "10"] + cmd.split(), None, "reservoir"):
+                events.emit("warning", "Reservoir could not generate a {0} key".format(kind), None, "reservoir")
+                if os.path.isfile(tmp):
+                    os.remove(tmp)
+                return done
+            os.rename(tmp, tmp[:-len(".tmp")] + ".key.pem")
+            done += 1
+        return done
+
+    def start(self, workers=1):
+        """Start background refill threads.
+
+        workers -- number of refill threads (default 1)
+        """
+        self._stop.clear()
+        for idx in range(workers):
+            thread = threading.Thread(target=self._refill, name="tinypyki-reservoir-{0}".format(idx))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, wait=True):
+        """Stop background refill threads.
+
+        wait -- boolean, wait for the keys being generated (default True)
+        """
+        self._stop.set()
+        self._wake.set()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+    def _refill(self):
+        """Background loop, refill the emptiest pool one key at a time."""
+        while not self._stop.is_set():
+            missing = [(self.ready(kind), kind) for kind in list(self.kinds) if self.ready(kind) < self.size]
+            if not missing:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                continue
+            self.fill(min(missing)[1], 1)
@@ -0,0 +1,148 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Certificate serial number allocation.
+
+Every PKI instance holds an Allocator in pki.serials, saved along with the
+pki state. Two modes are available:
+
+sequential -- serials follow a single counter (default, former PKI.serial
+              behaviour); contiguous blocks can be reserved up front for
+              workers, which then allocate from their own block
+random     -- 128 bit random serials, unique per issuer
+"""
+
+import os
+import threading
+
+from .macros import *
+
+class Allocator():
+    """A serial number allocator."""
+
+    def __init__(self, mode="sequential", start=1):
+        """Attributes:
+
+        .mode   -- allocation mode, must be in SERIAL_MODES (default "sequential")
+        .next   -- next serial of the global sequence (default 1)
+        .blocks -- a dictionary of reserved blocks { "worker_id": [next, last] }
+        .issued -- a dictionary of random serials issued { "issuer_nid": set(serials) }
+        """
+        self.mode   = mode if mode in SERIAL_MODES else "sequential"
+        self.next   = int(start)
+        self.blocks = {}
+        self.issued = {}
+        self._lock  = threading.Lock()
+
+    def __repr__(self):
+        """Formal Allocator representation."""
+        return "Allocator(mode=\"{0}\", next={1}, blocks={2})".format(self.mode, self.next, len(self.blocks))
+
+    def __getstate__(self):
+        """Locks are not saved with the pki state."""
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        """Restore a lock on load."""
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def allocate(self, issuer, worker=None):
+        """Return a new serial number (integer).
+
+        issuer -- node id of the issuing node
+        worker -- worker id of a reserved block to allocate from (default None)
+
+        In sequential mode, a worker allocates from its own block until it is
+        exhausted and falls back to the global sequence afterwards. In random
+        mode, the serial is drawn until it is unique for this issuer. The
+        serial is committed, unless given back with refund.
+        """
+        if self.mode == "random":
+            with self._lock:
+                issued = self.issued.setdefault(issuer, set())
+            while True:
+                serial = int.from_bytes(os.urandom(16), "big") >> 1
+                with self._lock:
+                    if serial and not serial in issued:
+                        issued.add(serial)
+                        return serial
+        # A block is only used by the worker it was reserved for
+        block = self.blocks.get(worker) if worker is not None else None
+        if block and block[0] <= block[1]:
+            block[0] += 1
+            return block[0] - 1
+        with self._lock:
+            serial     = self.next
+            self.next += 1
+            return serial
+
+    def refund(self, issuer, serial, worker=None):
+        """Give back a serial whose certificate could not be signed.
+
+        issuer -- node id of the issuing node
+        serial -- integer, as returned by allocate
+        worker -- worker id of the block it was allocated from (default None)
+
+        The serial is handed out again if it was the last one allocated from
+        the block or the global sequence, otherwise it is lost.
+        """
+        if self.mode == "random":
+            with self._lock:
+                self.issued.get(issuer, set()).discard(serial)
+            return
+        block = self.blocks.get(worker) if worker is not None else None
+        if block and block[0] == serial + 1:
+            block[0] = serial
+            return
+        with self._lock:
+            if self.next == serial + 1:
+                self.next = serial
+
+    def reserve(self, worker, size):
+        """Reserve a contiguous block of serials for a worker.
+
+        worker -- a worker id string
+        size   -- integer, number of serials in the block
+
+        Returns the (first, last) serials of the block. Workers allocating from
+        their block never touch the global sequence, so they do not need to
+        coordinate per certificate. Only relevant in sequential mode.
+        """
+        with self._lock:
+            first      = self.next
+            self.next += int(size)
+            self.blocks[worker] = [first, self.next - 1]
+            return first, self.next - 1
+
+    def release(self, worker):
+        """Release a worker's block.
+
+        Unused serials are not handed out again, unless the block is the last
+        one reserved.
+        """
+        with self._lock:
+            block = self.blocks.pop(worker, None)
+            if block and block[1] == self.next - 1:
+                self.next = block[0]
+
+    def merge(self, other):
+        """Merge the state of an allocator used by another process.
+
+        other -- an Allocator object
+
+        Typically used once a worker process is done signing with a copy of
+        the pki: block progress and random serials issued are folded back.
+        """
+        with self._lock:
+            self.next = max(self.next, other.next)
+            for worker, block in other.blocks.items():
+                if worker in self.blocks:
+                    self.blocks[worker][0] = max(self.blocks[worker][0], block[0])
+            for issuer, serials in other.issued.items():
+                self.issued.setdefault(issuer, set()).update(serials)
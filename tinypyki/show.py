@@ -7,9 +7,8 @@
 """A polyvalent display function."""
 
 import os
-from subprocess import call
 
-from . import pki
+from . import pki, asn1, events
 
 def show(thing):
     """A generic pretty print function.
@@ -18,58 +17,48 @@ def show(thing):
     accordingly.
 
     Handled objects: None, PKI, Node, dict and filepaths to valid (.ecc).key,
-    .csr, .cert, .crl, .p12 files (calls relevant openssl command)
+    .csr, .cert, .crl, .p12 files.
+
+    Key, csr, cert and crl files are parsed in process (see tinypyki.asn1) and
+    their summary dictionary is returned. Output goes through tinypyki.events,
+    as "stage" and "text" events.
     """
 
     if thing == None:
-        print("~~> None object, probably value not set.")
+        events.emit("stage", "None object, probably value not set.", None, "show")
     elif isinstance(thing, pki.PKI):
-        print("~~> Printing PKI object...")
-        print(thing)
+        events.emit("stage", "Printing PKI object...", None, "show")
+        events.emit("text", str(thing), None, "show")
     elif isinstance(thing, pki.Node):
-        print("~~> Printing Node object...")
-        print(thing)
+        events.emit("stage", "Printing Node object...", thing.nid, "show")
+        events.emit("text", str(thing), thing.nid, "show")
     elif isinstance(thing, str) and os.path.isfile(thing):
-        cmd  = "{0}".format("openssl")
         # figure out file nature
-        if "key" in thing.split("/")[-1].split("."):
-            print("~~> Printing key...")
-            if not "ecc" in thing.split("/")[-1].split("."):
-                cmd += " rsa"
+        if "p12" in thing.split("/")[-1].split("."):
+            events.emit("stage", "Printing pkcs12...", None, "show")
+            if thing.endswith(".txt"):
+                with open(thing, "r") as p_hdlr:
+                    events.emit("text", p_hdlr.read(), None, "show")
             else:
-                cmd += " ecparam -param_enc explicit"
-        elif "csr" in thing.split("/")[-1].split("."):
-            print("~~> Printing csr...")
-            cmd += " req"
-        elif "cert" in thing.split("/")[-1].split("."):
-            print("~~> Printing cer...")
-            cmd += " x509"
-        elif "crl" in thing.split("/")[-1].split("."):
-            print("~~> Printing crl...")
-            cmd += " crl"
-        elif "p12" in thing.split("/")[-1].split("."):
-            print("~~> Printing pkcs12...")
-            cmd  = "cat {0}".format(thing)
-            
-            print("\t`-> [openssl] " + cmd)
-            
-            if call(cmd.split()):
-                print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+                events.emit("info", "Binary pkcs12 bundle ({0} bytes), see do.verify".format(os.path.getsize(thing)), None, "show")
             return
-        else:
-            print("\t/!\ [Warning]\t\tUnsupported extension: {0}".format(thing))
+        summary = asn1.summary(thing)
+        if not summary:
+            events.emit("warning", "Unsupported file: {0}".format(thing), None, "show")
             return
-
-        # invariable for key, csr, cert and crl files
-        cmd += " -in {0}".format(thing)
-        cmd += " -noout"
-        cmd += " -text"
-
-        print("\t`-> [openssl] " + cmd)
-
-        if call(cmd.split()):
-            print("\t/!\ [Warning]\t\tWell, clearly something went wrong when calling, investigate the error message above.")
+        events.emit("stage", "Printing {0}...".format(summary["type"]), None, "show")
+        for field in sorted(summary):
+            if field == "extensions":
+                for name, ext in sorted(summary[field].items()):
+                    events.emit("text", "\t`-> {0:<11} = {1}{2}: {3}".format("extension", name, " (critical)" if ext["critical"] else "", ext["value"]), None, "show")
+            elif field == "serial":
+                events.emit("text", "\t`-> {0:<11} = 0x{1:02x}".format(field, summary[field]), None, "show")
+            elif field == "revoked":
+                events.emit("text", "\t`-> {0:<11} = {1}".format(field, ", ".join("0x{0:02x}".format(serial) for serial in summary[field])), None, "show")
+            elif field != "type":
+                events.emit("text", "\t`-> {0:<11} = {1}".format(field, summary[field]), None, "show")
+        return summary
     elif isinstance(thing, dict):
-        print("\t`-> [info] " + " : ".join(thing.keys()))
+        events.emit("info", " : ".join(thing.keys()), None, "show")
     else:
-        print("\t/!\ [Warning]\t\tObject not identified: {0}".format(str(thing)))
+        events.emit("warning", "Object not identified: {0}".format(str(thing)), None, "show")
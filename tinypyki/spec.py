@@ -0,0 +1,176 @@
+# Copyright (C) 2014 Orange
+
+# This software is distributed under the terms and conditions of the 'BSD
+# 3-Clause' license which can be found in the 'LICENSE.txt' file in this package
+# distribution or at 'http://opensource.org/licenses/BSD-3-Clause'.
+
+"""Declarative PKI specifications.
+
+A spec describes a whole PKI (CA hierarchy, leaf templates and count ranges)
+as a JSON or YAML document instead of loops of Node() calls:
+
+    {"pki"       : "mass-pki",
+     "defaults"  : {"life": 30},
+     "templates" : {"leaf": {"ntype": "u", "san": "dns=hexample.com",
+                             "subj": {"cn": "{nid}-dummy-hexample"}}},
+     "nodes"     : [{"nid": "root-ca", "san": "email=dev.null@hexample.com",
+                     "children": [{"nid": "target-{0..99999}", "template": "leaf"}]}]}
+
+Each entry of "nodes" (and of any "children" list) holds Node() keyword
+arguments plus the following spec keywords:
+
+template -- name of an entry of "templates" whose values are used as defaults
+children -- list of entries issued by this entry (their issuer is implied)
+subj     -- either a subject string or a dictionary of tinypyki.change.subj
+            keyword arguments
+
+A nid may hold one count range {first..last} (bounds included, leading zeros
+of first are kept as padding), e.g. "target-{0..99}" or "enb-{000..999}".
+The placeholders {nid}, {issuer} and {i} (range index) are substituted in the
+string values of an entry. In YAML, quote the values holding braces.
+
+Ranges are expanded lazily: nodes are generated and inserted one at a time,
+the expanded node list is never built. Nodes generated from the same entry
+share their attribute values, only nid, issuer, sign_list and substituted
+strings are specific to each node.
+"""
+
+import json
+import os
+import re
+import uuid
+
+from .macros import *
+from .pki    import PKI, Node
+from .       import do, change, events
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Spec-only keywords, everything else is handed to Node()
+KEYWORDS = ("template", "children")
+
+# Count range in a nid, e.g. target-{0..99}
+RANGE    = re.compile(r"\{(\d+)\.\.(\d+)\}")
+
+def read(spec_path):
+    """Read a spec file.
+
+    spec_path -- path to a .json, .yaml or .yml spec file
+
+    Returns the spec dictionary or None if it cannot be read. Reading YAML
+    requires PyYAML.
+    """
+    if not os.path.isfile(spec_path):
+        events.emit("warning", "Spec file not found: {0}".format(spec_path), None, "spec")
+        return None
+    with open(spec_path, "r") as s_hdlr:
+        if spec_path.split(".")[-1].lower() in ["yaml", "yml"]:
+            if not yaml:
+                events.emit("warning", "PyYAML is required to read {0}".format(spec_path), None, "spec")
+                return None
+            return yaml.safe_load(s_hdlr)
+        return json.load(s_hdlr)
+
+def depth(entry, templates=None):
+    """Return the number of hierarchy levels underneath an entry.
+
+    entry     -- a spec entry dictionary
+    templates -- the spec "templates" dictionary (default None)
+
+    Used for setting the pathlen of roots which do not specify one.
+    """
+    children = _resolve(entry, templates or {}).get("children")
+    return 1 + max(depth(child, templates) for child in children) if children else 0
+
+def nodes(spec):
+    """Generate Node objects from a spec, issuers first.
+
+    spec -- a spec dictionary (see tinypyki.spec)
+
+    This is a generator: each node is created when it is requested, so that
+    inserting nodes as they come never holds the expanded list in memory.
+    """
+    templates = spec.get("templates", {})
+    defaults  = spec.get("defaults", {})
+    for entry in spec.get("nodes", []):
+        for node in _expand(entry, None, templates, defaults):
+            yield node
+
+def load(spec, pki=None):
+    """Load a spec into a PKI instance.
+
+    spec -- a spec dictionary or a path to a spec file
+    pki  -- a PKI object to insert the nodes into (default None, creates
+            PKI(spec["pki"]))
+
+    Nodes are streamed from tinypyki.spec.nodes into do.insert. Returns the
+    PKI object, or None if the spec cannot be read.
+    """
+    spec = read(spec) if isinstance(spec, str) else spec
+    if not isinstance(spec, dict):
+        return None
+    pki = pki if pki else PKI(spec.get("pki"))
+    events.emit("stage", "Loading spec into {0}...".format(pki.id), None, "spec")
+    for node in nodes(spec):
+        do.insert(node, pki)
+    return pki
+
+def _resolve(entry, templates):
+    """Merge an entry with its template, entry values win."""
+    if not entry.get("template"):
+        return entry
+    if not entry["template"] in templates:
+        events.emit("warning", "Unknown template: {0}".format(entry["template"]), None, "spec")
+        return entry
+    resolved = dict(templates[entry["template"]])
+    resolved.update(entry)
+    return resolved
+
+def _expand(entry, issuer, templates, defaults):
+    """Generate the nodes of an entry and, depth first, of its children."""
+    entry = _resolve(entry, templates)
+    attrs = dict(defaults)
+    attrs.update((k, v) for k, v in entry.items() if not k in KEYWORDS)
+    attrs.setdefault("ntype", "ca" if entry.get("children") else "u")
+    if not issuer and not "pathlen" in attrs and entry.get("children"):
+        attrs["pathlen"] = depth(entry, templates)
+    if isinstance(attrs.get("subj"), dict):
+        subj = Node(pki=None, nid="-")
+        change.subj(subj, **attrs["subj"])
+        attrs["subj"] = subj.subj
+
+    # Split values shared by all generated nodes from per node templates
+    dynamic   = dict((k, v) for k, v in attrs.items() if not k in ["nid", "issuer"] and isinstance(v, str) and ("{nid}" in v or "{issuer}" in v or "{i}" in v))
+    prototype = Node(**dict((k, v) for k, v in attrs.items() if not k in dynamic and not k in ["nid", "issuer"]))
+
+    for idx, nid in _nids(str(attrs.get("nid", "")), issuer):
+        node = Node.__new__(Node)
+        node.__dict__.update(prototype.__dict__)
+        node.nid       = nid
+        node.issuer    = issuer if issuer else attrs.get("issuer", nid)
+        node.sign_list = [nid] if node.issuer == nid else []
+        for attr, value in dynamic.items():
+            setattr(node, attr, _substitute(value, nid, node.issuer, idx))
+        yield node
+        for child in entry.get("children", []):
+            for sub_node in _expand(child, nid, templates, defaults):
+                yield sub_node
+
+def _nids(nid, issuer):
+    """Generate (range index, nid) couples for a nid template."""
+    nid = nid.replace("{issuer}", issuer) if issuer else nid
+    match = RANGE.search(nid)
+    if not match:
+        yield None, nid if nid else str(uuid.uuid4())
+        return
+    first, last = int(match.group(1)), int(match.group(2))
+    width = len(match.group(1)) if match.group(1).startswith("0") else 0
+    for idx in range(first, last + 1):
+        yield idx, nid[:match.start()] + "{0:0{1}d}".format(idx, width) + nid[match.end():]
+
+def _substitute(value, nid, issuer, idx):
+    """Substitute spec placeholders in a string value."""
+    return value.replace("{nid}", nid).replace("{issuer}", issuer).replace("{i}", str(idx) if idx is not None else "")